@@ -16,7 +16,7 @@ from mmdet.core import build_prior_generator, build_bbox_coder
 from mmdet3d.core.bbox import get_box_type, limit_period
 
 # local class
-from voxel_generator import VoxelGenerator
+from voxel_generator import VoxelGenerator, warmup as voxel_generator_warmup
 from anchor_3d_generator import AlignedAnchor3DRangeGenerator
 from delta_xyzwhlr_bbox_coder import DeltaXYZWLHRBBoxCoder
 from box3d_nms import box3d_multiclass_nms
@@ -26,12 +26,13 @@ from box3d_nms import box3d_multiclass_nms
 import rospy
 import ros_numpy
 from std_msgs.msg import Header
-from sensor_msgs.msg import PointCloud2
+from sensor_msgs.msg import PointCloud2, PointField
 from autoware_msgs.msg import DetectedObject, DetectedObjectArray
 
-# pypcd
-from pypcd import pypcd
-from pypcd import numpy_pc2
+# pointcloud2
+from numpy.lib import recfunctions
+from mmdet3d_extension.datasets.pipelines.pcd import pcd_to_pointcloud2
+from mmdet3d_extension.datasets.pipelines.pointcloud2 import decode_pointcloud2
 
 
 class PointPillarsDetector:
@@ -42,6 +43,8 @@ class PointPillarsDetector:
         self.numpy_voxel_layer = VoxelGenerator(**self.config.model["voxel_layer"])
         self.tensor_voxel_layer.training = False
         self.numpy_voxel_layer.training = False
+        # 提前完成voxel化kernel的编译,避免第一帧的jit耗时
+        voxel_generator_warmup()
         self.ort_sess = ort.InferenceSession(model_path)
 
         # build anchor generator
@@ -304,11 +307,7 @@ class ROS3DDetector:
         Returns:
             numpy.array: Nx4 numpy array.
         """
-        pc = pypcd.PointCloud.from_msg(pc2)
-        x = pc.pc_data["x"].flatten()
-        y = pc.pc_data["y"].flatten()
-        z = pc.pc_data["z"].flatten()
-        intensity = pc.pc_data["intensity"].flatten()
+        x, y, z, intensity = decode_pointcloud2(pc2, ["x", "y", "z", "intensity"], dtype=np.float64).T
 
         # normalize the intensity from 0-255 to 0-1
         intensity = intensity / 255.0
@@ -457,7 +456,8 @@ def main_test():
     header.stamp = rospy.Time.now()
     detected_object_array = ROS3DDetector.convert_result_to_autoware(result=result, header=header)
     # convert numpy points to pointcloud2
-    pc2 = numpy_pc2.array_to_xyzi_pointcloud2f(points, stamp=header.stamp, frame_id=header.frame_id)
+    xyzi = recfunctions.unstructured_to_structured(points, names=["x", "y", "z", "intensity"])
+    pc2 = pcd_to_pointcloud2(xyzi, header=header, msg_class=PointCloud2, field_class=PointField)
     pub_detected_object_array = rospy.Publisher(args.pub_detected_object_topic, DetectedObjectArray, queue_size=1)
     pub_pointcloud2 = rospy.Publisher(args.pub_pc_topic, PointCloud2, queue_size=1)
     rate = rospy.Rate(10)
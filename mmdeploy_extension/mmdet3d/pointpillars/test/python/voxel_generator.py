@@ -96,10 +96,9 @@ def points_to_voxel(points, voxel_size, coors_range, max_points=35, reverse_inde
             coordinates: [M, 3] int32 tensor.
             num_points_per_voxel: [M] int32 tensor.
     """
-    if not isinstance(voxel_size, np.ndarray):
-        voxel_size = np.array(voxel_size, dtype=points.dtype)
-    if not isinstance(coors_range, np.ndarray):
-        coors_range = np.array(coors_range, dtype=points.dtype)
+    # kernel使用显式的签名编译,voxel_size coors_range 需要与points的类型一致
+    voxel_size = np.ascontiguousarray(voxel_size, dtype=points.dtype)
+    coors_range = np.ascontiguousarray(coors_range, dtype=points.dtype)
     voxelmap_shape = (coors_range[3:] - coors_range[:3]) / voxel_size
     voxelmap_shape = tuple(np.round(voxelmap_shape).astype(np.int32).tolist())
     if reverse_index:
@@ -142,7 +141,14 @@ def points_to_voxel(points, voxel_size, coors_range, max_points=35, reverse_inde
     return voxels, coors, num_points_per_voxel
 
 
-@numba.jit(nopython=True)
+# 显式的签名使kernel在import时编译(或从磁盘缓存中加载),而不是在第一帧时编译
+_KERNEL_SIGNATURES = [
+    f"int64({t}[:, :], {t}[::1], {t}[::1], int32[::1], int32[:, :, ::1], {t}[:, :, ::1], int32[:, ::1], int64, int64)"
+    for t in ("float32", "float64")
+]
+
+
+@numba.jit(_KERNEL_SIGNATURES, nopython=True, cache=True)
 def _points_to_voxel_reverse_kernel(
     points,
     voxel_size,
@@ -218,7 +224,7 @@ def _points_to_voxel_reverse_kernel(
     return voxel_num
 
 
-@numba.jit(nopython=True)
+@numba.jit(_KERNEL_SIGNATURES, nopython=True, cache=True)
 def _points_to_voxel_kernel(
     points,
     voxel_size,
@@ -290,3 +296,14 @@ def _points_to_voxel_kernel(
             voxels[voxelidx, num] = points[i]
             num_points_per_voxel[voxelidx] += 1
     return voxel_num
+
+
+def warmup(ndim=4):
+    """在处理第一帧之前调用,确保voxel化的kernel已经编译好,并完成一次完整的调用
+
+    Args:
+        ndim (int, optional): 点云的维度. Defaults to 4.
+    """
+    points = np.zeros((1, ndim), dtype=np.float32)
+    for reverse_index in (True, False):
+        points_to_voxel(points, [1.0, 1.0, 1.0], [0.0, 0.0, 0.0, 1.0, 1.0, 1.0], 1, reverse_index, 1)
@@ -36,7 +36,7 @@ file_client_args = dict(backend="disk")
 
 db_sampler = dict(
     data_root=data_root,
-    info_path=data_root + infos_prefix + "_" + "infos_train.pkl",
+    info_path=data_root + infos_prefix + "_" + "dbinfos_train.pkl",
     rate=1.0,
     prepare=dict(
         filter_by_difficulty=[-1],
@@ -46,6 +46,13 @@ train_pipeline = [
         load_dim=4,
         use_dim=5,
         file_client_args=file_client_args,
+        # 加载时丢弃数据增强之后也不会落在 point_cloud_range 中的点,参数需要与下面的数据增强一致
+        pre_crop=dict(
+            point_cloud_range=point_cloud_range,
+            rot_range=[-0.3925, 0.3925],
+            scale_ratio_range=[0.95, 1.05],
+            flip_ratio_bev_horizontal=0.5,
+        ),
     ),
     dict(type="LoadPointsFromMultiSweeps", sweeps_num=10, file_client_args=file_client_args),
     dict(type="LoadAnnotations3D", with_bbox_3d=True, with_label_3d=True),
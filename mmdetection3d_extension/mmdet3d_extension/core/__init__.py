@@ -1,2 +1,3 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+from .bbox import *  # noqa: F401, F403
 from .evaluation import *  # noqa: F401, F403
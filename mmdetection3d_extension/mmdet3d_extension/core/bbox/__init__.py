@@ -0,0 +1,7 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+from .points_in_boxes import points_in_boxes_count, points_in_boxes_mask
+
+__all__ = [
+    "points_in_boxes_count",
+    "points_in_boxes_mask",
+]
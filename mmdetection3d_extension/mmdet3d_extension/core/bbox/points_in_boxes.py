@@ -0,0 +1,110 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+import numba
+import numpy as np
+
+
+@numba.jit(nopython=True)
+def _build_bev_grid(points, boxes, cell_size):
+    """以所有box的BEV包围框的并集为范围,将范围内的点按BEV网格做计数排序
+
+    Returns:
+        tuple: box的BEV包围框 [M, 4] (x_min, y_min, x_max, y_max), 网格的原点与大小 (x0, y0, nx, ny),
+            每个网格中的点在 order 中的范围 cell_start [nx * ny + 1], 按网格排序的点的index order
+    """
+    num_boxes = boxes.shape[0]
+    bev = np.empty((num_boxes, 4), dtype=np.float64)
+    x0, y0, x1, y1 = np.inf, np.inf, -np.inf, -np.inf
+    for j in range(num_boxes):
+        c, s = np.cos(boxes[j, 6]), np.sin(boxes[j, 6])
+        half_x, half_y = boxes[j, 3] / 2, boxes[j, 4] / 2
+        extent_x = abs(half_x * c) + abs(half_y * s)
+        extent_y = abs(half_x * s) + abs(half_y * c)
+        bev[j, 0], bev[j, 2] = boxes[j, 0] - extent_x, boxes[j, 0] + extent_x
+        bev[j, 1], bev[j, 3] = boxes[j, 1] - extent_y, boxes[j, 1] + extent_y
+        x0, y0 = min(x0, bev[j, 0]), min(y0, bev[j, 1])
+        x1, y1 = max(x1, bev[j, 2]), max(y1, bev[j, 3])
+    nx = int((x1 - x0) / cell_size) + 1
+    ny = int((y1 - y0) / cell_size) + 1
+
+    # 范围外的点的网格为-1, 不会被任何box访问
+    cells = np.full(points.shape[0], -1, dtype=np.int64)
+    cell_start = np.zeros(nx * ny + 1, dtype=np.int64)
+    for i in range(points.shape[0]):
+        x, y = points[i, 0], points[i, 1]
+        if x < x0 or x > x1 or y < y0 or y > y1:
+            continue
+        cell = min(int((x - x0) / cell_size), nx - 1) * ny + min(int((y - y0) / cell_size), ny - 1)
+        cells[i] = cell
+        cell_start[cell + 1] += 1
+    for k in range(nx * ny):
+        cell_start[k + 1] += cell_start[k]
+    order = np.empty(cell_start[-1], dtype=np.int64)
+    fill = cell_start[:-1].copy()
+    for i in range(points.shape[0]):
+        if cells[i] >= 0:
+            order[fill[cells[i]]] = i
+            fill[cells[i]] += 1
+    return bev, x0, y0, nx, ny, cell_start, order
+
+
+@numba.jit(nopython=True)
+def _points_in_boxes_kernel(points, boxes, cell_size, indices):
+    """对每个box只测试其BEV包围框覆盖的网格中的点, indices 为None时只计数,否则写入 [M, N] 的bool数组"""
+    num_boxes = boxes.shape[0]
+    counts = np.zeros(num_boxes, dtype=np.int64)
+    if num_boxes == 0 or points.shape[0] == 0:
+        return counts
+    bev, x0, y0, nx, ny, cell_start, order = _build_bev_grid(points, boxes, cell_size)
+    for j in range(num_boxes):
+        cx, cy, cz = boxes[j, 0], boxes[j, 1], boxes[j, 2]
+        half_x, half_y, half_z = boxes[j, 3] / 2, boxes[j, 4] / 2, boxes[j, 5] / 2
+        c, s = np.cos(boxes[j, 6]), np.sin(boxes[j, 6])
+        gx0 = min(int((bev[j, 0] - x0) / cell_size), nx - 1)
+        gx1 = min(int((bev[j, 2] - x0) / cell_size), nx - 1)
+        gy0 = min(int((bev[j, 1] - y0) / cell_size), ny - 1)
+        gy1 = min(int((bev[j, 3] - y0) / cell_size), ny - 1)
+        for gx in range(gx0, gx1 + 1):
+            for k in range(cell_start[gx * ny + gy0], cell_start[gx * ny + gy1 + 1]):
+                i = order[k]
+                if abs(points[i, 2] - cz) > half_z:
+                    continue
+                dx, dy = points[i, 0] - cx, points[i, 1] - cy
+                # 将点旋转到box的坐标系中
+                if abs(dx * c + dy * s) > half_x or abs(-dx * s + dy * c) > half_y:
+                    continue
+                counts[j] += 1
+                if indices is not None:
+                    indices[j, i] = True
+    return counts
+
+
+def points_in_boxes_count(points, boxes, cell_size=2.0):
+    """统计每个box内的点的数量, 与对所有点测试所有box的 box_np_ops.points_in_rbbox 相比,
+    先将点按BEV网格排序,每个box只测试其BEV包围框覆盖的网格中的点
+
+    Args:
+        points (np.ndarray): [N, C] 点云, 前3维为 x y z
+        boxes (np.ndarray): [M, 7+] box, x y z 为box的中心 (origin=(0.5, 0.5, 0.5)), 之后为 x_size y_size z_size yaw
+        cell_size (float, optional): BEV网格的大小,单位为m. Defaults to 2.0.
+
+    Returns:
+        np.ndarray: [M] int64 每个box内的点的数量
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    if len(boxes) == 0:
+        return np.zeros((0,), dtype=np.int64)
+    return _points_in_boxes_kernel(points, boxes, float(cell_size), None)
+
+
+def points_in_boxes_mask(points, boxes, cell_size=2.0):
+    """每个点是否在每个box内, 与 box_np_ops.points_in_rbbox 的结果的转置相同, 参数参考 points_in_boxes_count
+
+    Returns:
+        np.ndarray: [M, N] bool
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    indices = np.zeros((len(boxes), points.shape[0]), dtype=np.bool_)
+    if len(boxes) == 0:
+        return indices
+    _points_in_boxes_kernel(points, boxes, float(cell_size), indices)
+    return indices
@@ -1,8 +1,9 @@
 # Copyright (c) OpenMMLab. All rights reserved.
 from .lidar_utils import lidar_eval
-from .usd_utils import usd_eval
+from .usd_utils import USDOnlineEvaluator, usd_eval
 
 __all__ = [
     "lidar_eval",
     "usd_eval",
+    "USDOnlineEvaluator",
 ]
@@ -4,6 +4,7 @@ import io as sysio
 
 import numba
 import numpy as np
+from numba import cuda
 
 # 定义评估时各个类别的iou阈值
 # 但是由于不同类别的size不一样，如果采用同一个iou阈值会导致某些类别的某些框被评估为0,
@@ -70,10 +71,30 @@ def image_box_overlap(boxes, query_boxes, criterion=-1):
     return overlaps
 
 
-def bev_box_overlap(boxes, qboxes, criterion=-1):
-    from .rotate_iou import rotate_iou_gpu_eval
+def rotate_iou_eval(boxes, qboxes, criterion=-1):
+    """计算bev下旋转框的iou,有cuda设备时使用gpu版本,否则使用多核cpu版本
+    NOTE : gpu版本的模块在import时就会编译cuda kernel,没有cuda驱动时会直接报错,所以只能在确认有cuda设备后再import
+
+    Args:
+        boxes (np.ndarray): [N, 5] 格式为 x, y, x_size, y_size, rot (camera坐标系)
+        qboxes (np.ndarray): [K, 5] 格式同上
+        criterion (int, optional): -1: iou, 0: inter / area(qboxes), 1: inter / area(boxes), 其他: inter
+
+    Returns:
+        np.ndarray: [N, K] float32
+    """
+    if cuda.is_available():
+        from .rotate_iou import rotate_iou_gpu_eval
 
-    riou = rotate_iou_gpu_eval(boxes, qboxes, criterion)
+        return rotate_iou_gpu_eval(boxes, qboxes, criterion)
+
+    from .rotate_iou_cpu import rotate_iou_cpu_eval
+
+    return rotate_iou_cpu_eval(boxes, qboxes, criterion)
+
+
+def bev_box_overlap(boxes, qboxes, criterion=-1):
+    riou = rotate_iou_eval(boxes, qboxes, criterion)
     return riou
 
 
@@ -107,9 +128,7 @@ def d3_box_overlap_kernel(boxes, qboxes, rinc, criterion=-1):
 
 
 def d3_box_overlap(boxes, qboxes, criterion=-1):
-    from .rotate_iou import rotate_iou_gpu_eval
-
-    rinc = rotate_iou_gpu_eval(boxes[:, [0, 2, 3, 5, 6]], qboxes[:, [0, 2, 3, 5, 6]], 2)
+    rinc = rotate_iou_eval(boxes[:, [0, 2, 3, 5, 6]], qboxes[:, [0, 2, 3, 5, 6]], 2)
     d3_box_overlap_kernel(boxes, qboxes, rinc, criterion)
     return rinc
 
@@ -1,4 +1,5 @@
 # Copyright (c) OpenMMLab. All rights reserved.
-from .eval import usd_eval
+from .eval import usd_eval, warmup
+from .online_eval import USDOnlineEvaluator
 
-__all__ = ["usd_eval"]
+__all__ = ["usd_eval", "warmup", "USDOnlineEvaluator"]
@@ -4,9 +4,21 @@ import io as sysio
 
 import numba
 import numpy as np
+from numba import cuda
 
+# 默认的评估难度,均不做任何过滤,只是为了保持 easy moderate hard 三列的输出格式
+# 每个难度是一个过滤条件,不满足条件的gt(以及超出range的dt)在评估时会被忽略,支持的key:
+#   - name (str): 难度的名称,用于输出结果
+#   - range (tuple[float]): [min, max) bev下到lidar原点的距离范围,单位m,同时作用于gt和dt
+#   - min_points (int): gt中点的数量(annos中的num_points_in_gt)少于该值的gt被忽略
+#   - max_occluded (int): 遮挡程度(annos中的occluded)大于该值的gt被忽略
+DEFAULT_DIFFICULTIES = [dict(name="easy"), dict(name="moderate"), dict(name="hard")]
 
-@numba.jit
+# get_thresholds 最多得到的score阈值数量
+N_SAMPLE_PTS = 41
+
+
+@numba.jit(cache=True)
 def get_thresholds(scores: np.ndarray, num_gt, num_sample_pts=41):
     scores.sort()
     scores = scores[::-1]
@@ -26,7 +38,40 @@ def get_thresholds(scores: np.ndarray, num_gt, num_sample_pts=41):
     return thresholds
 
 
-@numba.jit(nopython=True)
+@numba.jit(nopython=True, cache=True)
+def get_thresholds_from_counts(scores, counts, num_gt, num_sample_pts=41):
+    """与 get_thresholds 的结果相同,输入为合并了相同score之后的tp, 不需要展开为所有tp的score
+
+    Args:
+        scores (np.ndarray): [K] 升序且不重复的score
+        counts (np.ndarray): [K] 每个score的tp数量
+        num_gt (int): 没有被忽略的gt的数量
+        num_sample_pts (int, optional): recall的采样点数. Defaults to 41.
+
+    Returns:
+        list[float]: 降序的score阈值
+    """
+    num_scores = 0
+    for k in range(counts.shape[0]):
+        num_scores += int(counts[k])
+    current_recall = 0.0
+    thresholds = []
+    i = 0
+    for k in range(scores.shape[0] - 1, -1, -1):
+        for _ in range(int(counts[k])):
+            l_recall = (i + 1) / num_gt
+            if i < (num_scores - 1):
+                r_recall = (i + 2) / num_gt
+            else:
+                r_recall = l_recall
+            if not (((r_recall - current_recall) < (current_recall - l_recall)) and (i < (num_scores - 1))):
+                thresholds.append(scores[k])
+                current_recall += 1 / (num_sample_pts - 1.0)
+            i += 1
+    return thresholds
+
+
+@numba.jit(nopython=True, cache=True)
 def image_box_overlap(boxes, query_boxes, criterion=-1):
     N = boxes.shape[0]
     K = query_boxes.shape[0]
@@ -50,14 +95,63 @@ def image_box_overlap(boxes, query_boxes, criterion=-1):
     return overlaps
 
 
+def rotate_iou_eval(boxes, qboxes, criterion=-1):
+    """计算bev下旋转框的iou,有cuda设备时使用gpu版本,否则使用多核cpu版本
+    NOTE : gpu版本的模块在import时就会编译cuda kernel,没有cuda驱动时会直接报错,所以只能在确认有cuda设备后再import
+
+    Args:
+        boxes (np.ndarray): [N, 5] 格式为 x, y, x_size, y_size, rot (camera坐标系)
+        qboxes (np.ndarray): [K, 5] 格式同上
+        criterion (int, optional): -1: iou, 0: inter / area(qboxes), 1: inter / area(boxes), 其他: inter
+
+    Returns:
+        np.ndarray: [N, K] float32
+    """
+    if cuda.is_available():
+        from .rotate_iou import rotate_iou_gpu_eval
+
+        return rotate_iou_gpu_eval(boxes, qboxes, criterion)
+
+    from .rotate_iou_cpu import rotate_iou_cpu_eval
+
+    return rotate_iou_cpu_eval(boxes, qboxes, criterion)
+
+
+def rotate_iou_eval_blocks(boxes, qboxes, box_offsets, qbox_offsets, iou_offsets, criterion=-1):
+    """rotate_iou_eval 的分块对角版本,只计算同一帧(block)内的box之间的iou,跨帧的box对不参与计算
+
+    Args:
+        boxes (np.ndarray): [N, 5] 所有帧的box拼接在一起
+        qboxes (np.ndarray): [K, 5] 所有帧的query box拼接在一起
+        box_offsets (np.ndarray): [B + 1] 每一帧的box在boxes中的起始位置
+        qbox_offsets (np.ndarray): [B + 1] 每一帧的query box在qboxes中的起始位置
+        iou_offsets (np.ndarray): [B + 1] 每一帧的iou矩阵在返回的一维数组中的起始位置
+        criterion (int, optional): 同 rotate_iou_eval
+
+    Returns:
+        np.ndarray: 一维float32数组,第b帧的iou矩阵按行优先存放在 [iou_offsets[b], iou_offsets[b + 1]) 中
+    """
+    if cuda.is_available():
+        from .rotate_iou import rotate_iou_gpu_eval_blocks
+
+        return rotate_iou_gpu_eval_blocks(boxes, qboxes, box_offsets, qbox_offsets, iou_offsets, criterion)
+
+    from .rotate_iou_cpu import rotate_iou_cpu_eval_blocks
+
+    return rotate_iou_cpu_eval_blocks(boxes, qboxes, box_offsets, qbox_offsets, iou_offsets, criterion)
+
+
 def bev_box_overlap(boxes, qboxes, criterion=-1):
-    from .rotate_iou import rotate_iou_gpu_eval
+    riou = rotate_iou_eval(boxes, qboxes, criterion)
+    return riou
 
-    riou = rotate_iou_gpu_eval(boxes, qboxes, criterion)
+
+def bev_box_overlap_blocks(boxes, qboxes, box_offsets, qbox_offsets, iou_offsets, criterion=-1):
+    riou = rotate_iou_eval_blocks(boxes, qboxes, box_offsets, qbox_offsets, iou_offsets, criterion)
     return riou
 
 
-@numba.jit(nopython=True, parallel=True)
+@numba.jit(nopython=True, parallel=True, cache=True)
 def d3_box_overlap_kernel(boxes, qboxes, rinc, criterion=-1):
     # ONLY support overlap in CAMERA, not lidar.
     # TODO: change to use prange for parallel mode, should check the difference
@@ -87,14 +181,59 @@ def d3_box_overlap_kernel(boxes, qboxes, rinc, criterion=-1):
 
 
 def d3_box_overlap(boxes, qboxes, criterion=-1):
-    from .rotate_iou import rotate_iou_gpu_eval
-
-    rinc = rotate_iou_gpu_eval(boxes[:, [0, 2, 3, 5, 6]], qboxes[:, [0, 2, 3, 5, 6]], 2)
+    rinc = rotate_iou_eval(boxes[:, [0, 2, 3, 5, 6]], qboxes[:, [0, 2, 3, 5, 6]], 2)
     d3_box_overlap_kernel(boxes, qboxes, rinc, criterion)
     return rinc
 
 
-@numba.jit(nopython=True)
+@numba.jit(nopython=True, parallel=True, cache=True)
+def d3_box_overlap_blocks_kernel(boxes, qboxes, rinc, box_offsets, qbox_offsets, iou_offsets, criterion=-1):
+    # ONLY support overlap in CAMERA, not lidar.
+    # 与 d3_box_overlap_kernel 相同,只是rinc为分块对角的一维存储
+    for b in numba.prange(box_offsets.shape[0] - 1):
+        num_qbox = qbox_offsets[b + 1] - qbox_offsets[b]
+        for i in range(box_offsets[b], box_offsets[b + 1]):
+            row = iou_offsets[b] + (i - box_offsets[b]) * num_qbox
+            for j in range(qbox_offsets[b], qbox_offsets[b + 1]):
+                idx = row + j - qbox_offsets[b]
+                if rinc[idx] > 0:
+                    iw = min(boxes[i, 1], qboxes[j, 1]) - max(boxes[i, 1] - boxes[i, 4], qboxes[j, 1] - qboxes[j, 4])
+
+                    if iw > 0:
+                        area1 = boxes[i, 3] * boxes[i, 4] * boxes[i, 5]
+                        area2 = qboxes[j, 3] * qboxes[j, 4] * qboxes[j, 5]
+                        inc = iw * rinc[idx]
+                        if criterion == -1:
+                            ua = area1 + area2 - inc
+                        elif criterion == 0:
+                            ua = area1
+                        elif criterion == 1:
+                            ua = area2
+                        else:
+                            ua = inc
+                        rinc[idx] = inc / ua
+                    else:
+                        rinc[idx] = 0.0
+
+
+def d3_box_overlap_blocks(boxes, qboxes, box_offsets, qbox_offsets, iou_offsets, criterion=-1):
+    rinc = rotate_iou_eval_blocks(
+        boxes[:, [0, 2, 3, 5, 6]], qboxes[:, [0, 2, 3, 5, 6]], box_offsets, qbox_offsets, iou_offsets, 2
+    )
+    # 统一输入的类型与内存布局, kernel只按这一组类型编译一次, warmup 时编译的版本与真实eval时相同
+    d3_box_overlap_blocks_kernel(
+        np.ascontiguousarray(boxes, dtype=np.float64),
+        np.ascontiguousarray(qboxes, dtype=np.float64),
+        rinc,
+        box_offsets.astype(np.int64),
+        qbox_offsets.astype(np.int64),
+        iou_offsets.astype(np.int64),
+        criterion,
+    )
+    return rinc
+
+
+@numba.jit(nopython=True, cache=True)
 def compute_statistics_jit(
     overlaps,
     gt_datas,
@@ -225,9 +364,10 @@ def get_split_parts(num, num_part):
         return [same_part] * num_part + [remain_num]
 
 
-@numba.jit(nopython=True)
+@numba.jit(nopython=True, cache=True)
 def fused_compute_statistics(
     overlaps,
+    overlap_offsets,
     pr,
     gt_nums,
     dt_nums,
@@ -247,7 +387,7 @@ def fused_compute_statistics(
     dc_num = 0
     for i in range(gt_nums.shape[0]):
         for t, thresh in enumerate(thresholds):
-            overlap = overlaps[dt_num : dt_num + dt_nums[i], gt_num : gt_num + gt_nums[i]]
+            overlap = overlaps[overlap_offsets[i] : overlap_offsets[i + 1]].reshape((dt_nums[i], gt_nums[i]))
 
             gt_data = gt_datas[gt_num : gt_num + gt_nums[i]]
             dt_data = dt_datas[dt_num : dt_num + dt_nums[i]]
@@ -277,20 +417,418 @@ def fused_compute_statistics(
         dc_num += dc_nums[i]
 
 
+@numba.jit(nopython=True, cache=True)
+def match_statistics_jit(
+    overlaps,
+    gt_alphas,
+    dt_alphas,
+    dt_scores,
+    ignored_gt,
+    ignored_det,
+    min_overlap,
+    thresh,
+    assigned_detection,
+    delta,
+):
+    """compute_statistics_jit(compute_fp=True) 中gt与dt的匹配部分,匹配规则与其完全相同,
+    额外将每个dt是否被匹配写入 assigned_detection,并将tp的朝向差写入 delta
+
+    Returns:
+        tuple: tp, fp, fn, delta_idx (delta中有效的数量)
+    """
+    det_size = dt_scores.shape[0]
+    gt_size = gt_alphas.shape[0]
+    assigned_detection[:] = False
+    NO_DETECTION = -10000000
+    tp, fp, fn = 0, 0, 0
+    delta_idx = 0
+    for i in range(gt_size):
+        if ignored_gt[i] == -1:
+            continue
+        det_idx = -1
+        valid_detection = NO_DETECTION
+        max_overlap = 0
+        assigned_ignored_det = False
+
+        for j in range(det_size):
+            if ignored_det[j] == -1:
+                continue
+            if assigned_detection[j]:
+                continue
+            if dt_scores[j] < thresh:
+                continue
+            overlap = overlaps[j, i]
+            if (overlap > min_overlap) and (overlap > max_overlap or assigned_ignored_det) and ignored_det[j] == 0:
+                max_overlap = overlap
+                det_idx = j
+                valid_detection = 1
+                assigned_ignored_det = False
+            elif (overlap > min_overlap) and (valid_detection == NO_DETECTION) and ignored_det[j] == 1:
+                det_idx = j
+                valid_detection = 1
+                assigned_ignored_det = True
+
+        if (valid_detection == NO_DETECTION) and ignored_gt[i] == 0:
+            fn += 1
+        elif (valid_detection != NO_DETECTION) and (ignored_gt[i] == 1 or ignored_det[det_idx] == 1):
+            assigned_detection[det_idx] = True
+        elif valid_detection != NO_DETECTION:
+            tp += 1
+            delta[delta_idx] = gt_alphas[i] - dt_alphas[det_idx]
+            delta_idx += 1
+            assigned_detection[det_idx] = True
+    for i in range(det_size):
+        if not (assigned_detection[i] or ignored_det[i] == -1 or ignored_det[i] == 1 or dt_scores[i] < thresh):
+            fp += 1
+    return tp, fp, fn, delta_idx
+
+
+@numba.jit(nopython=True, cache=True)
+def compute_statistics_sorted_jit(
+    overlaps,
+    gt_datas,
+    dt_datas,
+    ignored_gt,
+    ignored_det,
+    dc_bboxes,
+    metric,
+    min_overlap,
+    thresholds,
+    pr,
+    compute_aos=False,
+):
+    """一次扫描得到一帧在所有score阈值下的 tp fp fn similarity,并累加到pr中,
+    结果与对每个阈值调用一次 compute_statistics_jit(compute_fp=True) 完全相同
+
+    NOTE : 阈值升高时低分的dt会被剔除,如果被剔除的dt在当前的匹配中没有被匹配,那么剔除它不会改变
+    其他gt的匹配结果(每个gt仍然会选到同一个dt),只需要将fp减一;只有被剔除的dt已经被匹配时才需要重新匹配.
+    所以将dt按score升序排列,随阈值升高依次剔除,绝大部分阈值都不需要重新匹配
+
+    Args:
+        thresholds (np.ndarray): 由 get_thresholds 得到的降序的score阈值
+        pr (np.ndarray): [num_thresholds, 4] 累加 tp fp fn similarity
+    """
+    det_size = dt_datas.shape[0]
+    gt_size = gt_datas.shape[0]
+    if metric == 0 and dc_bboxes.shape[0] > 0:
+        # dontcare对fp的修正依赖于每个阈值下的匹配结果,只能逐个阈值计算
+        for t in range(thresholds.shape[0]):
+            tp, fp, fn, similarity, _ = compute_statistics_jit(
+                overlaps,
+                gt_datas,
+                dt_datas,
+                ignored_gt,
+                ignored_det,
+                dc_bboxes,
+                metric,
+                min_overlap=min_overlap,
+                thresh=thresholds[t],
+                compute_fp=True,
+                compute_aos=compute_aos,
+            )
+            pr[t, 0] += tp
+            pr[t, 1] += fp
+            pr[t, 2] += fn
+            if similarity != -1:
+                pr[t, 3] += similarity
+        return
+
+    dt_scores = dt_datas[:, -1]
+    dt_alphas = dt_datas[:, 4]
+    gt_alphas = gt_datas[:, 4]
+    order = np.argsort(dt_scores)
+    assigned_detection = np.zeros((det_size,), dtype=np.bool_)
+    delta = np.zeros((gt_size,))
+    tp, fp, fn, delta_idx = 0, 0, 0, 0
+    removed = 0
+    need_match = True
+    for t in range(thresholds.shape[0] - 1, -1, -1):
+        thresh = thresholds[t]
+        while removed < det_size and dt_scores[order[removed]] < thresh:
+            j = order[removed]
+            if assigned_detection[j]:
+                need_match = True
+            elif ignored_det[j] == 0:
+                fp -= 1
+            removed += 1
+        if need_match:
+            tp, fp, fn, delta_idx = match_statistics_jit(
+                overlaps,
+                gt_alphas,
+                dt_alphas,
+                dt_scores,
+                ignored_gt,
+                ignored_det,
+                min_overlap,
+                thresh,
+                assigned_detection,
+                delta,
+            )
+            need_match = False
+        pr[t, 0] += tp
+        pr[t, 1] += fp
+        pr[t, 2] += fn
+        if compute_aos:
+            tmp = np.zeros((fp + delta_idx,))
+            for i in range(delta_idx):
+                tmp[i + fp] = (1.0 + np.cos(delta[i])) / 2.0
+            if tp > 0 or fp > 0:
+                pr[t, 3] += np.sum(tmp)
+
+
+@numba.jit(nopython=True, cache=True)
+def fused_compute_statistics_sorted(
+    overlaps,
+    overlap_offsets,
+    pr,
+    gt_nums,
+    dt_nums,
+    dc_nums,
+    gt_datas,
+    dt_datas,
+    dontcares,
+    ignored_gts,
+    ignored_dets,
+    metric,
+    min_overlap,
+    thresholds,
+    compute_aos=False,
+):
+    """与 fused_compute_statistics 的输入输出相同,但每一帧只做一次按score排序的扫描,
+    而不是对每个阈值都重新匹配一次"""
+    gt_num = 0
+    dt_num = 0
+    dc_num = 0
+    for i in range(gt_nums.shape[0]):
+        overlap = overlaps[overlap_offsets[i] : overlap_offsets[i + 1]].reshape((dt_nums[i], gt_nums[i]))
+        compute_statistics_sorted_jit(
+            overlap,
+            gt_datas[gt_num : gt_num + gt_nums[i]],
+            dt_datas[dt_num : dt_num + dt_nums[i]],
+            ignored_gts[gt_num : gt_num + gt_nums[i]],
+            ignored_dets[dt_num : dt_num + dt_nums[i]],
+            dontcares[dc_num : dc_num + dc_nums[i]],
+            metric,
+            min_overlap,
+            thresholds,
+            pr,
+            compute_aos,
+        )
+        gt_num += gt_nums[i]
+        dt_num += dt_nums[i]
+        dc_num += dc_nums[i]
+
+
+@numba.jit(nopython=True, parallel=True, cache=True)
+def collect_thresholds_cells(
+    overlaps,
+    overlap_offsets,
+    gt_nums,
+    dt_nums,
+    gt_datas,
+    dt_datas,
+    dontcares,
+    dc_nums,
+    ignored_gt_masks,
+    ignored_det_masks,
+    cell_masks,
+    cell_overlaps,
+    score_offsets,
+    metric,
+):
+    """并行计算每个cell中所有tp的score,用于确定每个cell的score阈值
+
+    NOTE : 每个cell是一个 (ignore mask, min_overlap) 的组合,cell之间相互独立,
+    每个cell由一个线程处理,overlaps等只读的buffer在线程之间共享
+
+    Args:
+        ignored_gt_masks (np.ndarray): [num_masks, total_gt] 每一组ignore mask中gt的忽略情况
+        ignored_det_masks (np.ndarray): [num_masks, total_dt] 每一组ignore mask中dt的忽略情况
+        cell_masks (np.ndarray): [num_cells] 每个cell使用的ignore mask的索引
+        cell_overlaps (np.ndarray): [num_cells] 每个cell的min_overlap
+        score_offsets (np.ndarray): [num_cells + 1] 每个cell的tp score在输出中的起始位置,
+            每个cell的tp数量不超过其没有被忽略的gt的数量
+
+    Returns:
+        tuple:
+            - scores (np.ndarray): 一维数组,第c个cell的tp score为 scores[score_offsets[c]:score_offsets[c] + score_nums[c]]
+            - score_nums (np.ndarray): [num_cells] 每个cell的tp数量
+    """
+    num_cells = cell_masks.shape[0]
+    scores = np.zeros((score_offsets[-1],))
+    score_nums = np.zeros((num_cells,), dtype=np.int64)
+    for c in numba.prange(num_cells):
+        ignored_gts = ignored_gt_masks[cell_masks[c]]
+        ignored_dets = ignored_det_masks[cell_masks[c]]
+        count = 0
+        gt_num = 0
+        dt_num = 0
+        dc_num = 0
+        for i in range(gt_nums.shape[0]):
+            overlap = overlaps[overlap_offsets[i] : overlap_offsets[i + 1]].reshape((dt_nums[i], gt_nums[i]))
+            _, _, _, _, thresholds = compute_statistics_jit(
+                overlap,
+                gt_datas[gt_num : gt_num + gt_nums[i]],
+                dt_datas[dt_num : dt_num + dt_nums[i]],
+                ignored_gts[gt_num : gt_num + gt_nums[i]],
+                ignored_dets[dt_num : dt_num + dt_nums[i]],
+                dontcares[dc_num : dc_num + dc_nums[i]],
+                metric,
+                cell_overlaps[c],
+                0.0,
+                False,
+            )
+            start = score_offsets[c] + count
+            scores[start : start + thresholds.shape[0]] = thresholds
+            count += thresholds.shape[0]
+            gt_num += gt_nums[i]
+            dt_num += dt_nums[i]
+            dc_num += dc_nums[i]
+        score_nums[c] = count
+    return scores, score_nums
+
+
+@numba.jit(nopython=True, parallel=True, cache=True)
+def fused_compute_statistics_cells(
+    overlaps,
+    overlap_offsets,
+    pr,
+    gt_nums,
+    dt_nums,
+    dc_nums,
+    gt_datas,
+    dt_datas,
+    dontcares,
+    ignored_gt_masks,
+    ignored_det_masks,
+    cell_masks,
+    cell_overlaps,
+    thresholds,
+    threshold_nums,
+    metric,
+    compute_aos=False,
+):
+    """并行地对每个cell调用 fused_compute_statistics_sorted
+
+    Args:
+        pr (np.ndarray): [num_cells, num_sample_pts, 4] 每个cell在每个阈值下累加的 tp fp fn similarity
+        thresholds (np.ndarray): [num_cells, num_sample_pts] 每个cell的score阈值,只有前threshold_nums[c]个有效
+        threshold_nums (np.ndarray): [num_cells] 每个cell的有效阈值数量
+    """
+    for c in numba.prange(cell_masks.shape[0]):
+        fused_compute_statistics_sorted(
+            overlaps,
+            overlap_offsets,
+            pr[c, : threshold_nums[c]],
+            gt_nums,
+            dt_nums,
+            dc_nums,
+            gt_datas,
+            dt_datas,
+            dontcares,
+            ignored_gt_masks[cell_masks[c]],
+            ignored_det_masks[cell_masks[c]],
+            metric,
+            cell_overlaps[c],
+            thresholds[c, : threshold_nums[c]],
+            compute_aos,
+        )
+
+
+@numba.jit(nopython=True, cache=True)
+def compute_frame_events_jit(
+    overlaps,
+    overlap_offsets,
+    gt_nums,
+    dt_nums,
+    dc_nums,
+    gt_datas,
+    dt_datas,
+    dontcares,
+    ignored_gts,
+    ignored_dets,
+    metric,
+    min_overlap,
+    compute_aos=False,
+):
+    """逐帧计算在线eval需要保存的统计量,之后这些帧的数据就可以丢弃
+
+    NOTE : 一帧的 tp fp fn similarity 随score阈值的变化是一个阶梯函数,只在该帧的dt的score处发生变化,
+    所以只需要保存每个score处的变化量(event),最终的阈值确定之后,某个阈值下所有帧的统计量之和等于
+    所有帧的初始值(没有dt时, fn为没有被忽略的gt的数量)加上score大于等于该阈值的所有event之和
+
+    Returns:
+        tuple:
+            - tp_scores (np.ndarray): 阈值为0时所有tp的score,用于确定最终的score阈值
+            - event_scores (np.ndarray): [num_events] 发生变化的score
+            - event_stats (np.ndarray): [num_events, 4] 阈值从高到低越过该score时 tp fp fn similarity 的变化量
+    """
+    tp_scores = np.zeros((gt_datas.shape[0],))
+    event_scores = np.zeros((dt_datas.shape[0],))
+    event_stats = np.zeros((dt_datas.shape[0], 4))
+    num_tp = 0
+    num_events = 0
+    gt_num = 0
+    dt_num = 0
+    dc_num = 0
+    for i in range(gt_nums.shape[0]):
+        overlap = overlaps[overlap_offsets[i] : overlap_offsets[i + 1]].reshape((dt_nums[i], gt_nums[i]))
+        gt_data = gt_datas[gt_num : gt_num + gt_nums[i]]
+        dt_data = dt_datas[dt_num : dt_num + dt_nums[i]]
+        ignored_gt = ignored_gts[gt_num : gt_num + gt_nums[i]]
+        ignored_det = ignored_dets[dt_num : dt_num + dt_nums[i]]
+        dontcare = dontcares[dc_num : dc_num + dc_nums[i]]
+        _, _, _, _, thresholds = compute_statistics_jit(
+            overlap, gt_data, dt_data, ignored_gt, ignored_det, dontcare, metric, min_overlap, 0.0, False
+        )
+        tp_scores[num_tp : num_tp + thresholds.shape[0]] = thresholds
+        num_tp += thresholds.shape[0]
+
+        # 以该帧所有dt的score(降序)作为阈值,一次扫描得到每个阈值下的统计量
+        scores = np.unique(dt_data[:, -1])[::-1].copy()
+        pr = np.zeros((scores.shape[0], 4))
+        compute_statistics_sorted_jit(
+            overlap, gt_data, dt_data, ignored_gt, ignored_det, dontcare, metric, min_overlap, scores, pr, compute_aos
+        )
+        prev = np.zeros((4,))
+        prev[2] = np.sum(ignored_gt == 0)
+        for j in range(scores.shape[0]):
+            delta = pr[j] - prev
+            if np.any(delta != 0):
+                event_scores[num_events] = scores[j]
+                event_stats[num_events] = delta
+                num_events += 1
+            prev = pr[j]
+        gt_num += gt_nums[i]
+        dt_num += dt_nums[i]
+        dc_num += dc_nums[i]
+    return tp_scores[:num_tp], event_scores[:num_events], event_stats[:num_events]
+
+
 def calculate_iou_partly(gt_annos, dt_annos, metric, num_parts=50):
-    """一个通过gpu并行计算从而快速批量计算的iou算法 , num_parts是并行的任务数量
+    """分块对角的批量iou计算,只计算同一帧内gt与dt之间的iou, num_parts是分批计算的批数
     NOTE : 此算法在获取2dbbox 3dbbox或者2dbevbbox的时候,默认的顺序是相机坐标系
-    TODO : 具体如何快速批量计算我还没仔细看,据说相交与cpu串行方式500x加速,参考自kitti中
+    NOTE : 原先的实现是将一批帧的box拼接后计算一个稠密的iou矩阵再切出对角块,其中绝大部分是跨帧的box对,
+    时间和内存都随每批的帧数平方增长,现在只计算对角块并以 一维buffer + offsets 的形式紧凑存储,内存与box对的数量线性相关
 
     Args:
         gt_annos (dict): 格式遵循自定义lidar格式,包含location、dimensions、rotation_y 信息(camera坐标系下)
         dt_annos (dict): 格式遵循自定义lidar格式,包含location、dimensions、rotation_y 信息(camera坐标系下)
         metric (int): Eval type. 1: bev, 2: 3d.
         num_parts (int): A parameter for fast calculate algorithm.
+
+    Returns:
+        tuple:
+            - overlaps (np.ndarray): 一维float64数组,第i帧的iou矩阵为
+              overlaps[overlap_offsets[i]:overlap_offsets[i + 1]].reshape(total_gt_num[i], total_dt_num[i])
+            - overlap_offsets (np.ndarray): [num_examples + 1] 每一帧的iou矩阵的起始位置
+            - total_gt_num (np.ndarray): 每一帧gt_annos的box数量
+            - total_dt_num (np.ndarray): 每一帧dt_annos的box数量
     """
     assert len(gt_annos) == len(dt_annos)
-    total_dt_num = np.stack([len(a["name"]) for a in dt_annos], 0)
-    total_gt_num = np.stack([len(a["name"]) for a in gt_annos], 0)
+    total_dt_num = np.stack([len(a["name"]) for a in dt_annos], 0).astype(np.int64)
+    total_gt_num = np.stack([len(a["name"]) for a in gt_annos], 0).astype(np.int64)
+    overlap_offsets = np.concatenate([[0], np.cumsum(total_gt_num * total_dt_num)]).astype(np.int64)
     num_examples = len(gt_annos)
     split_parts = get_split_parts(num_examples, num_parts)
     parted_overlaps = []
@@ -299,6 +837,11 @@ def calculate_iou_partly(gt_annos, dt_annos, metric, num_parts=50):
     for num_part in split_parts:
         gt_annos_part = gt_annos[example_idx : example_idx + num_part]
         dt_annos_part = dt_annos[example_idx : example_idx + num_part]
+        gt_num_part = total_gt_num[example_idx : example_idx + num_part]
+        dt_num_part = total_dt_num[example_idx : example_idx + num_part]
+        gt_offsets = np.concatenate([[0], np.cumsum(gt_num_part)]).astype(np.int64)
+        dt_offsets = np.concatenate([[0], np.cumsum(dt_num_part)]).astype(np.int64)
+        iou_offsets = np.concatenate([[0], np.cumsum(gt_num_part * dt_num_part)]).astype(np.int64)
         if metric == 1:
             loc = np.concatenate([a["location"][:, [0, 2]] for a in gt_annos_part], 0)
             dims = np.concatenate([a["dimensions"][:, [0, 2]] for a in gt_annos_part], 0)
@@ -308,7 +851,7 @@ def calculate_iou_partly(gt_annos, dt_annos, metric, num_parts=50):
             dims = np.concatenate([a["dimensions"][:, [0, 2]] for a in dt_annos_part], 0)
             rots = np.concatenate([a["rotation_y"] for a in dt_annos_part], 0)
             dt_boxes = np.concatenate([loc, dims, rots[..., np.newaxis]], axis=1)
-            overlap_part = bev_box_overlap(gt_boxes, dt_boxes).astype(np.float64)
+            overlap_part = bev_box_overlap_blocks(gt_boxes, dt_boxes, gt_offsets, dt_offsets, iou_offsets)
         elif metric == 2:
             loc = np.concatenate([a["location"] for a in gt_annos_part], 0)
             dims = np.concatenate([a["dimensions"] for a in gt_annos_part], 0)
@@ -318,28 +861,39 @@ def calculate_iou_partly(gt_annos, dt_annos, metric, num_parts=50):
             dims = np.concatenate([a["dimensions"] for a in dt_annos_part], 0)
             rots = np.concatenate([a["rotation_y"] for a in dt_annos_part], 0)
             dt_boxes = np.concatenate([loc, dims, rots[..., np.newaxis]], axis=1)
-            overlap_part = d3_box_overlap(gt_boxes, dt_boxes).astype(np.float64)
+            overlap_part = d3_box_overlap_blocks(gt_boxes, dt_boxes, gt_offsets, dt_offsets, iou_offsets)
         else:
             raise ValueError("unknown metric")
         parted_overlaps.append(overlap_part)
         example_idx += num_part
-    overlaps = []
-    example_idx = 0
-    for j, num_part in enumerate(split_parts):
-        gt_annos_part = gt_annos[example_idx : example_idx + num_part]
-        dt_annos_part = dt_annos[example_idx : example_idx + num_part]
-        gt_num_idx, dt_num_idx = 0, 0
-        for i in range(num_part):
-            gt_box_num = total_gt_num[example_idx + i]
-            dt_box_num = total_dt_num[example_idx + i]
-            overlaps.append(
-                parted_overlaps[j][gt_num_idx : gt_num_idx + gt_box_num, dt_num_idx : dt_num_idx + dt_box_num]
-            )
-            gt_num_idx += gt_box_num
-            dt_num_idx += dt_box_num
-        example_idx += num_part
+    overlaps = np.concatenate(parted_overlaps).astype(np.float64)
+
+    return overlaps, overlap_offsets, total_gt_num, total_dt_num
 
-    return overlaps, parted_overlaps, total_gt_num, total_dt_num
+
+def _ignored_by_difficulty(anno, difficulty, is_gt):
+    """根据difficulty中定义的过滤条件,计算一帧中每个box是否需要被忽略
+
+    Args:
+        anno (dict): 一帧的标注或检测结果,已经转换到camera坐标系
+        difficulty (dict): 过滤条件,参考 DEFAULT_DIFFICULTIES
+        is_gt (bool): 是否为gt, min_points 和 max_occluded 只作用于gt
+
+    Returns:
+        np.ndarray: [N] bool, True表示被忽略
+    """
+    ignored = np.zeros((len(anno["name"]),), dtype=np.bool_)
+    if "range" in difficulty:
+        # camera坐标系下的 x z 即为lidar坐标系下的 -y x
+        distance = np.linalg.norm(anno["location"][:, [0, 2]], axis=1)
+        min_range, max_range = difficulty["range"]
+        ignored |= (distance < min_range) | (distance >= max_range)
+    if is_gt and "min_points" in difficulty:
+        assert "num_points_in_gt" in anno, "difficulty with min_points needs num_points_in_gt in gt annos"
+        ignored |= anno["num_points_in_gt"] < difficulty["min_points"]
+    if is_gt and "max_occluded" in difficulty:
+        ignored |= anno["occluded"] > difficulty["max_occluded"]
+    return ignored
 
 
 def _prepare_data(gt_annos, dt_annos, current_class, difficulty):
@@ -350,15 +904,16 @@ def _prepare_data(gt_annos, dt_annos, current_class, difficulty):
     total_num_valid_gt = 0
     for i in range(len(gt_annos)):
 
-        # 不需要clean data，伪造一个clean data
+        # 不需要clean data，根据difficulty的过滤条件伪造一个clean data
         # num_valid_gt, ignored_gt, ignored_det, dc_bboxes = rets
-        num_valid_gt = len(gt_annos[i]["name"])  # num_valid_gt是每个example的gt的数量
-        ignored_gt = [0] * len(gt_annos[i]["name"])  # 0表示没有被忽略
-        ignored_det = [0] * len(dt_annos[i]["name"])  # 0表示没有被忽略
+        # 0表示没有被忽略,1表示被忽略(匹配上的dt不计为tp,没有匹配上的gt也不计为fn)
+        ignored_gt = _ignored_by_difficulty(gt_annos[i], difficulty, is_gt=True).astype(np.int64)
+        ignored_det = _ignored_by_difficulty(dt_annos[i], difficulty, is_gt=False).astype(np.int64)
+        num_valid_gt = int((ignored_gt == 0).sum())  # num_valid_gt是每个example中没有被忽略的gt的数量
         dc_bboxes = []  # 空表示没有dont care的类别被忽略
 
-        ignored_gts.append(np.array(ignored_gt, dtype=np.int64))
-        ignored_dets.append(np.array(ignored_det, dtype=np.int64))
+        ignored_gts.append(ignored_gt)
+        ignored_dets.append(ignored_det)
         if len(dc_bboxes) == 0:
             dc_bboxes = np.zeros((0, 4)).astype(np.float64)
         else:
@@ -385,17 +940,23 @@ def eval_class(
     min_overlaps,
     compute_aos=False,
     num_parts=200,
+    num_workers=None,
 ):
     """自定义的lidar eval函数,参考自kitti,目前仅支持bev 3d的eval
 
+    NOTE : 每个 (class, difficulty, overlap) 的评估相互独立,先收集所有需要计算的cell,
+    再通过numba的线程池并行计算,overlaps等buffer在线程之间只读共享,不需要拷贝或者pickle.
+    忽略情况和min_overlap都相同的cell的结果相同,只计算一次
+
     Args:
         gt_annos (dict): Must from get_label_annos() in kitti_common.py.
         dt_annos (dict): Must from get_label_annos() in kitti_common.py.
         current_classes (list[int]): 参与评估的类别 class_id list
-        difficultys (list[int]): Eval difficulty, 0: easy, 1: normal, 2: hard
+        difficultys (list[dict]): Eval difficulty, 每个难度为一个过滤条件,参考 DEFAULT_DIFFICULTIES
         metric (int): Eval type. 1: bev, 2: 3d
         min_overlaps (float): Min overlap. format: [num_overlap, metric, class].
         num_parts (int): A parameter for fast calculate algorithm
+        num_workers (int, optional): 并行计算使用的线程数,默认为None,使用numba的全部线程
 
     Returns:
         dict[str, np.ndarray]: recall, precision and aos
@@ -404,99 +965,158 @@ def eval_class(
     num_examples = len(gt_annos)
     if num_examples < num_parts:
         num_parts = num_examples
-    split_parts = get_split_parts(num_examples, num_parts)  # 返回一个list[int] 不清楚是什么意思
-
-    rets = calculate_iou_partly(dt_annos, gt_annos, metric, num_parts)
-    overlaps, parted_overlaps, total_dt_num, total_gt_num = rets
-    N_SAMPLE_PTS = 41
-    num_minoverlap = len(min_overlaps)
-    num_class = len(current_classes)
-    num_difficulty = len(difficultys)
-    precision = np.zeros([num_class, num_difficulty, num_minoverlap, N_SAMPLE_PTS])
-    recall = np.zeros([num_class, num_difficulty, num_minoverlap, N_SAMPLE_PTS])
-    aos = np.zeros([num_class, num_difficulty, num_minoverlap, N_SAMPLE_PTS])
-    for m, current_class in enumerate(current_classes):
-        for idx_l, difficulty in enumerate(difficultys):
-            rets = _prepare_data(gt_annos, dt_annos, current_class, difficulty)
-            (
-                gt_datas_list,
-                dt_datas_list,
-                ignored_gts,
-                ignored_dets,
-                dontcares,
-                total_dc_num,
-                total_num_valid_gt,
-            ) = rets
-            for k, min_overlap in enumerate(min_overlaps[:, metric, m]):
-
-                thresholdss = []
-                for i in range(len(gt_annos)):
-
-                    rets = compute_statistics_jit(
-                        overlaps[i],
-                        gt_datas_list[i],
-                        dt_datas_list[i],
-                        ignored_gts[i],
-                        ignored_dets[i],
-                        dontcares[i],
-                        metric,
-                        min_overlap=min_overlap,
-                        thresh=0.0,
-                        compute_fp=False,
-                    )
-                    tp, fp, fn, similarity, thresholds = rets
-                    thresholdss += thresholds.tolist()
-                thresholdss = np.array(thresholdss)
-                thresholds = get_thresholds(thresholdss, total_num_valid_gt)
-                thresholds = np.array(thresholds)
-                pr = np.zeros([len(thresholds), 4])
-                idx = 0
-                for j, num_part in enumerate(split_parts):
-                    gt_datas_part = np.concatenate(gt_datas_list[idx : idx + num_part], 0)
-                    dt_datas_part = np.concatenate(dt_datas_list[idx : idx + num_part], 0)
-                    dc_datas_part = np.concatenate(dontcares[idx : idx + num_part], 0)
-                    ignored_dets_part = np.concatenate(ignored_dets[idx : idx + num_part], 0)
-                    ignored_gts_part = np.concatenate(ignored_gts[idx : idx + num_part], 0)
-                    fused_compute_statistics(
-                        parted_overlaps[j],
-                        pr,
-                        total_gt_num[idx : idx + num_part],
-                        total_dt_num[idx : idx + num_part],
-                        total_dc_num[idx : idx + num_part],
-                        gt_datas_part,
-                        dt_datas_part,
-                        dc_datas_part,
-                        ignored_gts_part,
-                        ignored_dets_part,
-                        metric,
-                        min_overlap=min_overlap,
-                        thresholds=thresholds,
-                        compute_aos=compute_aos,
-                    )
-                    idx += num_part
-                for i in range(len(thresholds)):
-                    recall[m, idx_l, k, i] = pr[i, 0] / (pr[i, 0] + pr[i, 2])
-                    precision[m, idx_l, k, i] = pr[i, 0] / (pr[i, 0] + pr[i, 1])
+
+    prev_num_threads = numba.get_num_threads()
+    if num_workers is not None:
+        numba.set_num_threads(max(1, min(num_workers, numba.config.NUMBA_NUM_THREADS)))
+    try:
+        rets = calculate_iou_partly(dt_annos, gt_annos, metric, num_parts)
+        overlaps, overlap_offsets, total_dt_num, total_gt_num = rets
+        num_minoverlap = len(min_overlaps)
+        num_class = len(current_classes)
+        num_difficulty = len(difficultys)
+
+        # - 收集所有的cell, 不同的class或difficulty如果得到的忽略情况完全相同,则共用同一组ignore mask
+        mask_index = dict()
+        ignored_gt_masks, ignored_det_masks, num_valid_gts = [], [], []
+        cell_index = dict()
+        cell_masks, cell_overlaps = [], []
+        cell_of = np.zeros([num_class, num_difficulty, num_minoverlap], dtype=np.int64)
+        for m, current_class in enumerate(current_classes):
+            for idx_l, difficulty in enumerate(difficultys):
+                rets = _prepare_data(gt_annos, dt_annos, current_class, difficulty)
+                (
+                    gt_datas_list,
+                    dt_datas_list,
+                    ignored_gts,
+                    ignored_dets,
+                    dontcares,
+                    total_dc_num,
+                    total_num_valid_gt,
+                ) = rets
+                ignored_gt = np.concatenate(ignored_gts, 0)
+                ignored_det = np.concatenate(ignored_dets, 0)
+                ignored_key = np.concatenate([ignored_gt, np.full((1,), -2), ignored_det]).tobytes()
+                if ignored_key not in mask_index:
+                    mask_index[ignored_key] = len(ignored_gt_masks)
+                    ignored_gt_masks.append(ignored_gt)
+                    ignored_det_masks.append(ignored_det)
+                    num_valid_gts.append(total_num_valid_gt)
+                for k, min_overlap in enumerate(min_overlaps[:, metric, m]):
+                    key = (mask_index[ignored_key], float(min_overlap))
+                    if key not in cell_index:
+                        cell_index[key] = len(cell_masks)
+                        cell_masks.append(key[0])
+                        cell_overlaps.append(min_overlap)
+                    cell_of[m, idx_l, k] = cell_index[key]
+        # gt_datas dt_datas dontcares 与difficulty无关,所有的cell共用
+        # NOTE : 统一下面的kernel的输入的类型与内存布局, 与 warmup 时编译的版本一致
+        gt_datas = np.concatenate(gt_datas_list, 0).astype(np.float64)
+        dt_datas = np.concatenate(dt_datas_list, 0).astype(np.float64)
+        dontcares = np.concatenate(dontcares, 0).astype(np.float64)
+        total_dc_num = total_dc_num.astype(np.int64)
+        ignored_gt_masks = np.stack(ignored_gt_masks, 0)
+        ignored_det_masks = np.stack(ignored_det_masks, 0)
+        num_valid_gts = np.array(num_valid_gts, dtype=np.int64)
+        cell_masks = np.array(cell_masks, dtype=np.int64)
+        cell_overlaps = np.array(cell_overlaps, dtype=np.float64)
+        num_cells = len(cell_masks)
+
+        # - 第一遍: 得到每个cell的tp score,进而确定每个cell的score阈值
+        score_offsets = np.concatenate([[0], np.cumsum(num_valid_gts[cell_masks])]).astype(np.int64)
+        scores, score_nums = collect_thresholds_cells(
+            overlaps,
+            overlap_offsets,
+            total_gt_num,
+            total_dt_num,
+            gt_datas,
+            dt_datas,
+            dontcares,
+            total_dc_num,
+            ignored_gt_masks,
+            ignored_det_masks,
+            cell_masks,
+            cell_overlaps,
+            score_offsets,
+            metric,
+        )
+        thresholds = np.zeros([num_cells, N_SAMPLE_PTS])
+        threshold_nums = np.zeros([num_cells], dtype=np.int64)
+        for c in range(num_cells):
+            cell_scores = scores[score_offsets[c] : score_offsets[c] + score_nums[c]]
+            cell_thresholds = np.array(get_thresholds(cell_scores, num_valid_gts[cell_masks[c]]))
+            thresholds[c, : len(cell_thresholds)] = cell_thresholds
+            threshold_nums[c] = len(cell_thresholds)
+
+        # - 第二遍: 在每个cell的所有阈值下统计 tp fp fn similarity
+        pr = np.zeros([num_cells, N_SAMPLE_PTS, 4])
+        fused_compute_statistics_cells(
+            overlaps,
+            overlap_offsets,
+            pr,
+            total_gt_num,
+            total_dt_num,
+            total_dc_num,
+            gt_datas,
+            dt_datas,
+            dontcares,
+            ignored_gt_masks,
+            ignored_det_masks,
+            cell_masks,
+            cell_overlaps,
+            thresholds,
+            threshold_nums,
+            metric,
+            compute_aos=compute_aos,
+        )
+    finally:
+        numba.set_num_threads(prev_num_threads)
+
+    ret_dict = _cells_to_curves(pr, threshold_nums, cell_of, compute_aos)
+
+    # clean temp variables
+    del overlaps
+
+    gc.collect()
+    return ret_dict
+
+
+def _cells_to_curves(pr, threshold_nums, cell_of, compute_aos=False):
+    """根据每个cell在各个阈值下的 tp fp fn similarity 计算 recall precision aos 曲线
+
+    Args:
+        pr (np.ndarray): [num_cells, N_SAMPLE_PTS, 4] 每个cell在每个阈值下的 tp fp fn similarity
+        threshold_nums (np.ndarray): [num_cells] 每个cell的有效阈值数量
+        cell_of (np.ndarray): [num_class, num_difficulty, num_minoverlap] 每个组合对应的cell的索引
+        compute_aos (bool, optional): 是否计算aos. Defaults to False.
+
+    Returns:
+        dict[str, np.ndarray]: recall, precision and aos
+    """
+    num_class, num_difficulty, num_minoverlap = cell_of.shape
+    precision = np.zeros([num_class, num_difficulty, num_minoverlap, pr.shape[1]])
+    recall = np.zeros([num_class, num_difficulty, num_minoverlap, pr.shape[1]])
+    aos = np.zeros([num_class, num_difficulty, num_minoverlap, pr.shape[1]])
+    for m in range(num_class):
+        for idx_l in range(num_difficulty):
+            for k in range(num_minoverlap):
+                c = cell_of[m, idx_l, k]
+                for i in range(threshold_nums[c]):
+                    recall[m, idx_l, k, i] = pr[c, i, 0] / (pr[c, i, 0] + pr[c, i, 2])
+                    precision[m, idx_l, k, i] = pr[c, i, 0] / (pr[c, i, 0] + pr[c, i, 1])
                     if compute_aos:
-                        aos[m, idx_l, k, i] = pr[i, 3] / (pr[i, 0] + pr[i, 1])
-                for i in range(len(thresholds)):
+                        aos[m, idx_l, k, i] = pr[c, i, 3] / (pr[c, i, 0] + pr[c, i, 1])
+                for i in range(threshold_nums[c]):
                     precision[m, idx_l, k, i] = np.max(precision[m, idx_l, k, i:], axis=-1)
                     recall[m, idx_l, k, i] = np.max(recall[m, idx_l, k, i:], axis=-1)
                     if compute_aos:
                         aos[m, idx_l, k, i] = np.max(aos[m, idx_l, k, i:], axis=-1)
-    ret_dict = {
+    return {
         "recall": recall,
         "precision": precision,
         "orientation": aos,
     }
 
-    # clean temp variables
-    del overlaps
-    del parted_overlaps
-
-    gc.collect()
-    return ret_dict
-
 
 def get_mAP11(prec):
     sums = 0
@@ -521,27 +1141,36 @@ def print_str(value, *arg, sstream=None):
     return sstream.getvalue()
 
 
-def do_eval(gt_annos, dt_annos, current_classes, min_overlaps, eval_types=["bev", "3d"]):
+def do_eval(
+    gt_annos,
+    dt_annos,
+    current_classes,
+    min_overlaps,
+    eval_types=["bev", "3d"],
+    difficultys=None,
+    num_workers=None,
+):
     # min_overlaps: [num_minoverlap, metric, num_class]
-    difficultys = [0, 1, 2]
+    if difficultys is None:
+        difficultys = DEFAULT_DIFFICULTIES
 
     mAP11_bev = None
     mAP40_bev = None
     if "bev" in eval_types:
-        ret = eval_class(gt_annos, dt_annos, current_classes, difficultys, 1, min_overlaps)
+        ret = eval_class(gt_annos, dt_annos, current_classes, difficultys, 1, min_overlaps, num_workers=num_workers)
         mAP11_bev = get_mAP11(ret["precision"])
         mAP40_bev = get_mAP40(ret["precision"])
 
     mAP11_3d = None
     mAP40_3d = None
     if "3d" in eval_types:
-        ret = eval_class(gt_annos, dt_annos, current_classes, difficultys, 2, min_overlaps)
+        ret = eval_class(gt_annos, dt_annos, current_classes, difficultys, 2, min_overlaps, num_workers=num_workers)
         mAP11_3d = get_mAP11(ret["precision"])
         mAP40_3d = get_mAP40(ret["precision"])
     return (mAP11_bev, mAP11_3d, mAP40_bev, mAP40_3d)
 
 
-def usd_eval(gt_annos, dt_annos, current_classes, eval_types=["bev", "3d"]):
+def usd_eval(gt_annos, dt_annos, current_classes, eval_types=["bev", "3d"], difficulties=None, num_workers=None):
     """usd数据集的eval方法
     NOTE : 修改自kitti的 evaluation. kitti中支持2dbbox 3dbbox_bev 3d 三种评估方式,本方法仅支持 bev 和 3d
     NOTE : 因为评估方式不同写起来很费事,所以首先将usd格式的标注数据转换为kitti格式的标注数据,
@@ -555,38 +1184,67 @@ def usd_eval(gt_annos, dt_annos, current_classes, eval_types=["bev", "3d"]):
         dt_annos (list[dict]): Contain detected information of each sample.
         current_classes (list[str]): 用于eval的class_name list.
         eval_types (list[str], optional): Types to eval. Defaults to ['bev', '3d'].
+        difficulties (list[dict], optional): 评估难度的过滤条件,参考 DEFAULT_DIFFICULTIES.
+            Defaults to None, 使用 DEFAULT_DIFFICULTIES.
+        num_workers (int, optional): eval时并行计算使用的线程数. Defaults to None, 使用numba的全部线程.
 
     Returns:
         tuple: String and dict of evaluation results.
     """
+    _convert_lidar_annos_to_kitti_annos(gt_annos)
+    _convert_lidar_annos_to_kitti_annos(dt_annos)
 
-    def convert_lidar_annos_to_kitti_annos(lidar_annos):
-        """将usd格式的标注数据转换为kitti格式的标注数据
-        两者的区别主要在于:
-            1. usd格式的标注数据中location dimensions rotation_y都是在lidar坐标系下的,
-        而kitti格式的标注数据中location dimensions rotation_y都是在camera坐标系下的
-            2. kitti格式的标注中有 truncated occluded alpha bbox的信息,而lidar格式的标注中没有
-        """
-        for anno in lidar_annos:
-            object_nums = len(anno["name"])
-
-            # 将lidar坐标系下的3d bbox标注转换为camera坐标系下的3d bbox标注
-            # camera x y z equal lidar -y -z x
-            anno["location"] = anno["location"][:, [1, 2, 0]] * [-1, -1, 1]
-            anno["dimensions"] = anno["dimensions"][:, [1, 2, 0]]
-            anno["rotation_y"] = anno["rotation_y"] + np.pi / 2
-
-            # 下面的字段缺少真实的信息,所以用0填充
-            anno["truncated"] = np.zeros((object_nums,))
+    assert len(eval_types) > 0, "must contain at least one evaluation type"
+
+    current_classes, min_overlaps, class_to_name = _get_eval_settings(current_classes)
+
+    if difficulties is None:
+        difficulties = DEFAULT_DIFFICULTIES
+
+    mAP11_bev, mAP11_3d, mAP40_bev, mAP40_3d = do_eval(
+        gt_annos, dt_annos, current_classes, min_overlaps, eval_types, difficulties, num_workers
+    )
+    return _format_results(
+        current_classes, class_to_name, min_overlaps, difficulties, mAP11_bev, mAP11_3d, mAP40_bev, mAP40_3d
+    )
+
+
+def _convert_lidar_annos_to_kitti_annos(lidar_annos):
+    """将usd格式的标注数据转换为kitti格式的标注数据
+    两者的区别主要在于:
+        1. usd格式的标注数据中location dimensions rotation_y都是在lidar坐标系下的,
+    而kitti格式的标注数据中location dimensions rotation_y都是在camera坐标系下的
+        2. kitti格式的标注中有 truncated occluded alpha bbox的信息,而lidar格式的标注中没有
+    """
+    for anno in lidar_annos:
+        object_nums = len(anno["name"])
+
+        # 将lidar坐标系下的3d bbox标注转换为camera坐标系下的3d bbox标注
+        # camera x y z equal lidar -y -z x
+        anno["location"] = anno["location"][:, [1, 2, 0]] * [-1, -1, 1]
+        anno["dimensions"] = anno["dimensions"][:, [1, 2, 0]]
+        anno["rotation_y"] = anno["rotation_y"] + np.pi / 2
+
+        # 下面的字段缺少真实的信息,所以用0填充, occluded 如果标注中有则保留
+        anno["truncated"] = np.zeros((object_nums,))
+        if "occluded" not in anno:
             anno["occluded"] = np.zeros((object_nums,))
-            anno["alpha"] = np.zeros((object_nums,))
-            anno["bbox"] = np.zeros((object_nums, 4))
+        anno["alpha"] = np.zeros((object_nums,))
+        anno["bbox"] = np.zeros((object_nums, 4))
 
-    convert_lidar_annos_to_kitti_annos(gt_annos)
-    convert_lidar_annos_to_kitti_annos(dt_annos)
 
-    assert len(eval_types) > 0, "must contain at least one evaluation type"
+def _get_eval_settings(current_classes):
+    """获取参与eval的类别的 class_id 以及其对应的iou阈值
+
+    Args:
+        current_classes (list[str | int]): 用于eval的class_name或class_id list.
 
+    Returns:
+        tuple:
+            - current_classes (list[int]): 参与eval的类别的 class_id
+            - min_overlaps (np.ndarray): [num_minoverlap, metric, num_class] 每个类别的iou阈值
+            - class_to_name (dict[int, str]): class_id 到 class_name 的映射
+    """
     # 定义eval时各个类别的iou阈值、评估难度等
     # TODO ： 具体的分析每一个参数的含义
     # NOTE ：由于不同类别的size不一样，如果采用同一个iou阈值会导致某些类别的某些框被评估为0,
@@ -636,12 +1294,24 @@ def usd_eval(gt_annos, dt_annos, current_classes, eval_types=["bev", "3d"]):
     # 根据参与eval的所有类的label_id,获取其对应的预设的iou阈值
     min_overlaps = min_overlaps[:, :, current_classes]
 
+    return current_classes, min_overlaps, class_to_name
+
+
+def _format_results(
+    current_classes, class_to_name, min_overlaps, difficulties, mAP11_bev, mAP11_3d, mAP40_bev, mAP40_3d
+):
+    """将各个类别、难度、iou阈值下的AP整理为用于打印的字符串以及用于logger的dict
+
+    Returns:
+        tuple: String and dict of evaluation results.
+    """
     result = ""
+    difficulty = [d.get("name", f"difficulty{idx}") for idx, d in enumerate(difficulties)]
 
-    mAP11_bev, mAP11_3d, mAP40_bev, mAP40_3d = do_eval(gt_annos, dt_annos, current_classes, min_overlaps, eval_types)
+    def format_ap(values):
+        return ", ".join(f"{v:.4f}" for v in values)
 
     ret_dict = {}
-    difficulty = ["easy", "moderate", "hard"]
 
     # calculate AP11
     result += "\n----------- AP11 Results ------------\n\n"
@@ -653,12 +1323,12 @@ def usd_eval(gt_annos, dt_annos, current_classes, eval_types=["bev", "3d"]):
             # prepare results for print
             result += "{} AP11@{:.2f}, {:.2f}, {:.2f}:\n".format(curcls_name, *min_overlaps[i, :, j])
             if mAP11_bev is not None:
-                result += "bev  AP11:{:.4f}, {:.4f}, {:.4f}\n".format(*mAP11_bev[j, :, i])
+                result += f"bev  AP11:{format_ap(mAP11_bev[j, :, i])}\n"
             if mAP11_3d is not None:
-                result += "3d   AP11:{:.4f}, {:.4f}, {:.4f}\n".format(*mAP11_3d[j, :, i])
+                result += f"3d   AP11:{format_ap(mAP11_3d[j, :, i])}\n"
 
             # prepare results for logger
-            for idx in range(3):
+            for idx in range(len(difficulty)):
                 if i == 0:
                     postfix = f"{difficulty[idx]}_strict"
                 else:
@@ -672,16 +1342,16 @@ def usd_eval(gt_annos, dt_annos, current_classes, eval_types=["bev", "3d"]):
     # calculate mAP11 over all classes if there are multiple classes
     if len(current_classes) > 1:
         # prepare results for print
-        result += "\nOverall AP11@{}, {}, {}:\n".format(*difficulty)
+        result += "\nOverall AP11@{}:\n".format(", ".join(difficulty))
         if mAP11_bev is not None:
             mAP11_bev = mAP11_bev.mean(axis=0)
-            result += "bev  AP11:{:.4f}, {:.4f}, {:.4f}\n".format(*mAP11_bev[:, 0])
+            result += f"bev  AP11:{format_ap(mAP11_bev[:, 0])}\n"
         if mAP11_3d is not None:
             mAP11_3d = mAP11_3d.mean(axis=0)
-            result += "3d   AP11:{:.4f}, {:.4f}, {:.4f}\n".format(*mAP11_3d[:, 0])
+            result += f"3d   AP11:{format_ap(mAP11_3d[:, 0])}\n"
 
         # prepare results for logger
-        for idx in range(3):
+        for idx in range(len(difficulty)):
             postfix = f"{difficulty[idx]}"
             if mAP11_3d is not None:
                 ret_dict[f"KITTI/Overall_3D_AP11_{postfix}"] = mAP11_3d[idx, 0]
@@ -698,12 +1368,12 @@ def usd_eval(gt_annos, dt_annos, current_classes, eval_types=["bev", "3d"]):
             # prepare results for print
             result += "{} AP40@{:.2f}, {:.2f}, {:.2f}:\n".format(curcls_name, *min_overlaps[i, :, j])
             if mAP40_bev is not None:
-                result += "bev  AP40:{:.4f}, {:.4f}, {:.4f}\n".format(*mAP40_bev[j, :, i])
+                result += f"bev  AP40:{format_ap(mAP40_bev[j, :, i])}\n"
             if mAP40_3d is not None:
-                result += "3d   AP40:{:.4f}, {:.4f}, {:.4f}\n".format(*mAP40_3d[j, :, i])
+                result += f"3d   AP40:{format_ap(mAP40_3d[j, :, i])}\n"
 
             # prepare results for logger
-            for idx in range(3):
+            for idx in range(len(difficulty)):
                 if i == 0:
                     postfix = f"{difficulty[idx]}_strict"
                 else:
@@ -717,16 +1387,16 @@ def usd_eval(gt_annos, dt_annos, current_classes, eval_types=["bev", "3d"]):
     # calculate mAP40 over all classes if there are multiple classes
     if len(current_classes) > 1:
         # prepare results for print
-        result += "\nOverall AP40@{}, {}, {}:\n".format(*difficulty)
+        result += "\nOverall AP40@{}:\n".format(", ".join(difficulty))
         if mAP40_bev is not None:
             mAP40_bev = mAP40_bev.mean(axis=0)
-            result += "bev  AP40:{:.4f}, {:.4f}, {:.4f}\n".format(*mAP40_bev[:, 0])
+            result += f"bev  AP40:{format_ap(mAP40_bev[:, 0])}\n"
         if mAP40_3d is not None:
             mAP40_3d = mAP40_3d.mean(axis=0)
-            result += "3d   AP40:{:.4f}, {:.4f}, {:.4f}\n".format(*mAP40_3d[:, 0])
+            result += f"3d   AP40:{format_ap(mAP40_3d[:, 0])}\n"
 
         # prepare results for logger
-        for idx in range(3):
+        for idx in range(len(difficulty)):
             postfix = f"{difficulty[idx]}"
             if mAP40_3d is not None:
                 ret_dict[f"LIDAR/Overall_3D_AP40_{postfix}"] = mAP40_3d[idx, 0]
@@ -734,3 +1404,44 @@ def usd_eval(gt_annos, dt_annos, current_classes, eval_types=["bev", "3d"]):
                 ret_dict[f"LIDAR/Overall_BEV_AP40_{postfix}"] = mAP40_bev[idx, 0]
 
     return result, ret_dict
+
+
+def warmup():
+    """提前编译eval用到的numba kernel,编译结果会缓存到磁盘(cache=True),之后的进程直接从缓存中加载
+    NOTE : kernel都不指定签名,import时不会编译,只在第一次调用(或者 warmup)时编译,不做eval的进程没有编译的开销
+    NOTE : 使用两帧伪造的数据完整地跑一遍 usd_eval 以及在线eval,保证与真实eval时用到的kernel以及参数类型完全一致,
+    这样第一次eval时就不会再有jit编译的耗时
+    """
+    from .online_eval import USDOnlineEvaluator
+
+    def fake_annos():
+        gt_annos, dt_annos = [], []
+        for _ in range(2):
+            location = np.array([[10.0, 0.0, -1.0], [20.0, 5.0, -1.0]], dtype=np.float32)
+            dimensions = np.array([[4.0, 2.0, 1.5], [4.0, 2.0, 1.5]], dtype=np.float32)
+            gt_annos.append(
+                dict(
+                    name=np.array(["car", "car"]),
+                    location=location,
+                    dimensions=dimensions,
+                    rotation_y=np.zeros((2,), dtype=np.float32),
+                    score=np.zeros((2,), dtype=np.float32),
+                    num_points_in_gt=np.array([100, 10], dtype=np.int32),
+                    occluded=np.zeros((2,), dtype=np.int32),
+                )
+            )
+            dt_annos.append(
+                dict(
+                    name=np.array(["car", "car"]),
+                    location=location + 0.2,
+                    dimensions=dimensions,
+                    rotation_y=np.full((2,), 0.1, dtype=np.float32),
+                    score=np.array([0.9, 0.3], dtype=np.float32),
+                )
+            )
+        return gt_annos, dt_annos
+
+    usd_eval(*fake_annos(), ["car"])
+    evaluator = USDOnlineEvaluator(["car"])
+    evaluator.update(*fake_annos())
+    evaluator.evaluate()
@@ -0,0 +1,238 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+import numpy as np
+
+from .eval import (
+    DEFAULT_DIFFICULTIES,
+    N_SAMPLE_PTS,
+    _cells_to_curves,
+    _convert_lidar_annos_to_kitti_annos,
+    _format_results,
+    _get_eval_settings,
+    _prepare_data,
+    calculate_iou_partly,
+    compute_frame_events_jit,
+    get_mAP11,
+    get_mAP40,
+    get_thresholds_from_counts,
+)
+
+
+class USDOnlineEvaluator(object):
+    """在线(流式)的usd eval,在test的过程中每得到一批检测结果就送入evaluator,而不是等所有结果都保存下来之后再eval
+
+    每积累 chunk_size 帧就计算一次这些帧的iou以及匹配结果,之后只保存每个cell(difficulty, overlap)的
+    tp fp fn 随score阈值变化的event以及每个score的tp数量,相同score的event与tp被合并到同一行,不再保存box和iou,
+    所以每个cell保存的状态只与不重复的score的数量有关,不随帧数增长.
+    最终在 evaluate 时确定score阈值并得到AP,结果与 usd_eval 完全相同
+
+    不重复的score的数量最多与检测结果的数量相同,设置 num_score_bins 后score会先被量化到 [0, 1] 内
+    等宽的 num_score_bins 个bin的下边界,每个cell最多保存 num_score_bins 行,内存有上界,
+    AP相当于在量化后的score上计算的结果,与 usd_eval 有与bin宽度相关的误差
+
+    NOTE : 与 eval_class 相同,gt和dt的忽略情况只与difficulty有关,与类别无关,
+    所以只需要对每个 (difficulty, min_overlap) 统计一次,结果在所有的类别之间共享
+
+    Args:
+        current_classes (list[str]): 用于eval的class_name list.
+        eval_types (list[str], optional): Types to eval. Defaults to ['bev', '3d'].
+        difficulties (list[dict], optional): 评估难度的过滤条件,参考 DEFAULT_DIFFICULTIES.
+            Defaults to None, 使用 DEFAULT_DIFFICULTIES.
+        chunk_size (int, optional): 每积累多少帧计算一次. Defaults to 64.
+        num_score_bins (int, optional): score量化的bin的数量. Defaults to None, 不量化,结果与 usd_eval 完全相同.
+    """
+
+    def __init__(
+        self, current_classes, eval_types=["bev", "3d"], difficulties=None, chunk_size=64, num_score_bins=None
+    ):
+        assert len(eval_types) > 0, "must contain at least one evaluation type"
+        if isinstance(eval_types, str):
+            eval_types = [eval_types]
+        self.eval_types = eval_types
+        self.difficulties = DEFAULT_DIFFICULTIES if difficulties is None else difficulties
+        self.chunk_size = chunk_size
+        assert num_score_bins is None or num_score_bins > 0, "num_score_bins must be positive"
+        self.num_score_bins = num_score_bins
+        self.current_classes, self.min_overlaps, self.class_to_name = _get_eval_settings(current_classes)
+        self.num_frames = 0
+
+        # metric 1: bev, 2: 3d
+        self._metrics = [metric for metric, name in ((1, "bev"), (2, "3d")) if name in eval_types]
+        self._cells = dict()
+        self._cell_of = dict()
+        for metric in self._metrics:
+            self._cells[metric], self._cell_of[metric] = self._build_cells(metric)
+        self._gt_buffer = []
+        self._dt_buffer = []
+
+    def _build_cells(self, metric):
+        """过滤条件(除name之外)与min_overlap都相同的 (class, difficulty, overlap) 组合共用一个cell"""
+        num_minoverlap = self.min_overlaps.shape[0]
+        cell_of = np.zeros([len(self.current_classes), len(self.difficulties), num_minoverlap], dtype=np.int64)
+        cells = []
+        cell_index = dict()
+        for m in range(len(self.current_classes)):
+            for idx_l, difficulty in enumerate(self.difficulties):
+                difficulty_key = tuple(sorted((k, repr(v)) for k, v in difficulty.items() if k != "name"))
+                for k in range(num_minoverlap):
+                    min_overlap = float(self.min_overlaps[k, metric, m])
+                    key = (difficulty_key, min_overlap)
+                    if key not in cell_index:
+                        cell_index[key] = len(cells)
+                        cells.append(
+                            dict(
+                                difficulty=idx_l,
+                                min_overlap=min_overlap,
+                                num_valid_gt=0,
+                                # 每一行为 tp fp fn similarity 的变化量以及该score的tp数量
+                                event_scores=np.zeros((0,)),
+                                event_stats=np.zeros((0, 5)),
+                                pending_scores=[],
+                                pending_stats=[],
+                                pending_size=0,
+                            )
+                        )
+                    cell_of[m, idx_l, k] = cell_index[key]
+        return cells, cell_of
+
+    def update(self, gt_annos, dt_annos):
+        """送入一批帧的gt和检测结果,格式与 usd_eval 的输入相同
+
+        Args:
+            gt_annos (list[dict]): Contain gt information of each sample.
+            dt_annos (list[dict]): Contain detected information of each sample.
+        """
+        assert len(gt_annos) == len(dt_annos)
+        _convert_lidar_annos_to_kitti_annos(gt_annos)
+        _convert_lidar_annos_to_kitti_annos(dt_annos)
+        self._gt_buffer += gt_annos
+        self._dt_buffer += dt_annos
+        self.num_frames += len(gt_annos)
+        if len(self._gt_buffer) >= self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        gt_annos, dt_annos = self._gt_buffer, self._dt_buffer
+        self._gt_buffer, self._dt_buffer = [], []
+        if len(gt_annos) == 0:
+            return
+
+        # 不同cell的difficulty可能相同,每个difficulty只需要准备一次数据
+        prepared = dict()
+        for metric in self._metrics:
+            overlaps, overlap_offsets, dt_nums, gt_nums = calculate_iou_partly(dt_annos, gt_annos, metric, 1)
+            for cell in self._cells[metric]:
+                if cell["difficulty"] not in prepared:
+                    rets = _prepare_data(gt_annos, dt_annos, None, self.difficulties[cell["difficulty"]])
+                    (
+                        gt_datas_list,
+                        dt_datas_list,
+                        ignored_gts,
+                        ignored_dets,
+                        dontcares,
+                        total_dc_num,
+                        total_num_valid_gt,
+                    ) = rets
+                    prepared[cell["difficulty"]] = (
+                        np.concatenate(gt_datas_list, 0).astype(np.float64),
+                        np.concatenate(dt_datas_list, 0).astype(np.float64),
+                        np.concatenate(dontcares, 0).astype(np.float64),
+                        total_dc_num.astype(np.int64),
+                        np.concatenate(ignored_gts, 0),
+                        np.concatenate(ignored_dets, 0),
+                        total_num_valid_gt,
+                    )
+                gt_datas, dt_datas, dontcares, dc_nums, ignored_gt, ignored_det, num_valid_gt = prepared[
+                    cell["difficulty"]
+                ]
+                tp_scores, event_scores, event_stats = compute_frame_events_jit(
+                    overlaps,
+                    overlap_offsets,
+                    gt_nums,
+                    dt_nums,
+                    dc_nums,
+                    gt_datas,
+                    dt_datas,
+                    dontcares,
+                    ignored_gt,
+                    ignored_det,
+                    metric,
+                    cell["min_overlap"],
+                )
+                cell["num_valid_gt"] += num_valid_gt
+                if self.num_score_bins is not None:
+                    event_scores = self._quantize_scores(event_scores)
+                    tp_scores = self._quantize_scores(tp_scores)
+                # tp的score合并到event中,只记录每个score的tp数量,用于确定最终的score阈值
+                tp_stats = np.zeros((len(tp_scores), 5))
+                tp_stats[:, 4] = 1
+                cell["pending_scores"] += [event_scores, tp_scores]
+                cell["pending_stats"] += [np.concatenate([event_stats, np.zeros((len(event_stats), 1))], 1), tp_stats]
+                cell["pending_size"] += len(event_scores) + len(tp_scores)
+                # 待合并的event数量超过已合并的数量时再合并,均摊下来排序的开销与event的总数成线性对数关系
+                if cell["pending_size"] > max(len(cell["event_scores"]), 4096):
+                    self._compact(cell)
+
+    def _quantize_scores(self, scores):
+        """将score量化到所在bin的下边界,超出 [0, 1] 的score归入首尾的bin"""
+        bins = np.clip(np.floor(scores * self.num_score_bins), 0, self.num_score_bins - 1)
+        return bins / self.num_score_bins
+
+    @staticmethod
+    def _compact(cell):
+        """将相同score的event合并,合并后event_scores为升序且不重复"""
+        scores = np.concatenate([cell["event_scores"]] + cell["pending_scores"])
+        stats = np.concatenate([cell["event_stats"]] + cell["pending_stats"], 0)
+        unique_scores, inverse = np.unique(scores, return_inverse=True)
+        merged_stats = np.zeros((len(unique_scores), 5))
+        np.add.at(merged_stats, inverse, stats)
+        cell["event_scores"] = unique_scores
+        cell["event_stats"] = merged_stats
+        cell["pending_scores"] = []
+        cell["pending_stats"] = []
+        cell["pending_size"] = 0
+
+    def _cell_statistics(self, metric):
+        """根据每个cell保存的统计量,得到每个cell在各个score阈值下的 tp fp fn similarity"""
+        cells = self._cells[metric]
+        pr = np.zeros([len(cells), N_SAMPLE_PTS, 4])
+        threshold_nums = np.zeros([len(cells)], dtype=np.int64)
+        for c, cell in enumerate(cells):
+            self._compact(cell)
+            thresholds = np.array(
+                get_thresholds_from_counts(cell["event_scores"], cell["event_stats"][:, 4], cell["num_valid_gt"]),
+                dtype=np.float64,
+            )
+            threshold_nums[c] = len(thresholds)
+
+            # suffix[i] 为score大于等于 event_scores[i] 的所有event之和,最后补一行0表示没有event
+            suffix = np.cumsum(cell["event_stats"][::-1, :4], axis=0)[::-1]
+            suffix = np.concatenate([suffix, np.zeros((1, 4))], 0)
+            base = np.array([0.0, 0.0, cell["num_valid_gt"], 0.0])
+            first_event = np.searchsorted(cell["event_scores"], thresholds, side="left")
+            pr[c, : len(thresholds)] = base + suffix[first_event]
+        return pr, threshold_nums
+
+    def evaluate(self):
+        """计算所有已经送入的帧的AP
+
+        Returns:
+            tuple: String and dict of evaluation results, 与 usd_eval 的返回相同.
+        """
+        self._flush()
+        mAPs = dict()
+        for metric in self._metrics:
+            pr, threshold_nums = self._cell_statistics(metric)
+            ret = _cells_to_curves(pr, threshold_nums, self._cell_of[metric])
+            mAPs[metric] = (get_mAP11(ret["precision"]), get_mAP40(ret["precision"]))
+        mAP11_bev, mAP40_bev = mAPs.get(1, (None, None))
+        mAP11_3d, mAP40_3d = mAPs.get(2, (None, None))
+        return _format_results(
+            self.current_classes,
+            self.class_to_name,
+            self.min_overlaps,
+            self.difficulties,
+            mAP11_bev,
+            mAP11_3d,
+            mAP40_bev,
+            mAP40_3d,
+        )
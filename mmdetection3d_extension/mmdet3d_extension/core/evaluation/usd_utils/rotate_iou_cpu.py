@@ -0,0 +1,370 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+#####################
+# CPU port of rotate_iou.py, based on https://github.com/hongzhenwang/RRPN-revise
+# Licensed under The MIT License
+#####################
+import math
+
+import numba
+import numpy as np
+
+
+@numba.jit(nopython=True, inline="always")
+def trangle_area(ax, ay, bx, by, cx, cy):
+    return ((ax - cx) * (by - cy) - (ay - cy) * (bx - cx)) / 2.0
+
+
+@numba.jit(nopython=True, inline="always")
+def area(int_pts, num_of_inter):
+    area_val = 0.0
+    for i in range(num_of_inter - 2):
+        area_val += abs(
+            trangle_area(
+                int_pts[0],
+                int_pts[1],
+                int_pts[2 * i + 2],
+                int_pts[2 * i + 3],
+                int_pts[2 * i + 4],
+                int_pts[2 * i + 5],
+            )
+        )
+    return area_val
+
+
+@numba.jit(nopython=True, inline="always")
+def sort_vertex_in_convex_polygon(int_pts, num_of_inter, vs):
+    if num_of_inter > 0:
+        center_x = np.float32(0.0)
+        center_y = np.float32(0.0)
+        for i in range(num_of_inter):
+            center_x += int_pts[2 * i]
+            center_y += int_pts[2 * i + 1]
+        center_x /= num_of_inter
+        center_y /= num_of_inter
+        for i in range(num_of_inter):
+            v0 = int_pts[2 * i] - center_x
+            v1 = int_pts[2 * i + 1] - center_y
+            d = math.sqrt(v0 * v0 + v1 * v1)
+            v0 = v0 / d
+            v1 = v1 / d
+            if v1 < 0:
+                v0 = -2 - v0
+            vs[i] = v0
+        for i in range(1, num_of_inter):
+            if vs[i - 1] > vs[i]:
+                temp = vs[i]
+                tx = int_pts[2 * i]
+                ty = int_pts[2 * i + 1]
+                j = i
+                while j > 0 and vs[j - 1] > temp:
+                    vs[j] = vs[j - 1]
+                    int_pts[j * 2] = int_pts[j * 2 - 2]
+                    int_pts[j * 2 + 1] = int_pts[j * 2 - 1]
+                    j -= 1
+
+                vs[j] = temp
+                int_pts[j * 2] = tx
+                int_pts[j * 2 + 1] = ty
+
+
+@numba.jit(nopython=True, inline="always")
+def line_segment_intersection(pts1, pts2, i, j, temp_pts):
+    A0 = pts1[2 * i]
+    A1 = pts1[2 * i + 1]
+    B0 = pts1[2 * ((i + 1) % 4)]
+    B1 = pts1[2 * ((i + 1) % 4) + 1]
+    C0 = pts2[2 * j]
+    C1 = pts2[2 * j + 1]
+    D0 = pts2[2 * ((j + 1) % 4)]
+    D1 = pts2[2 * ((j + 1) % 4) + 1]
+
+    BA0 = B0 - A0
+    BA1 = B1 - A1
+    DA0 = D0 - A0
+    CA0 = C0 - A0
+    DA1 = D1 - A1
+    CA1 = C1 - A1
+    acd = DA1 * CA0 > CA1 * DA0
+    bcd = (D1 - B1) * (C0 - B0) > (C1 - B1) * (D0 - B0)
+    if acd != bcd:
+        abc = CA1 * BA0 > BA1 * CA0
+        abd = DA1 * BA0 > BA1 * DA0
+        if abc != abd:
+            DC0 = D0 - C0
+            DC1 = D1 - C1
+            ABBA = A0 * B1 - B0 * A1
+            CDDC = C0 * D1 - D0 * C1
+            DH = BA1 * DC0 - BA0 * DC1
+            Dx = ABBA * DC0 - BA0 * CDDC
+            Dy = ABBA * DC1 - BA1 * CDDC
+            temp_pts[0] = Dx / DH
+            temp_pts[1] = Dy / DH
+            return True
+    return False
+
+
+@numba.jit(nopython=True, inline="always")
+def point_in_quadrilateral(pt_x, pt_y, corners):
+    ab0 = corners[2] - corners[0]
+    ab1 = corners[3] - corners[1]
+
+    ad0 = corners[6] - corners[0]
+    ad1 = corners[7] - corners[1]
+
+    ap0 = pt_x - corners[0]
+    ap1 = pt_y - corners[1]
+
+    abab = ab0 * ab0 + ab1 * ab1
+    abap = ab0 * ap0 + ab1 * ap1
+    adad = ad0 * ad0 + ad1 * ad1
+    adap = ad0 * ap0 + ad1 * ap1
+
+    return abab >= abap and abap >= 0 and adad >= adap and adap >= 0
+
+
+@numba.jit(nopython=True, inline="always")
+def quadrilateral_intersection(pts1, pts2, int_pts, temp_pts):
+    num_of_inter = 0
+    for i in range(4):
+        if point_in_quadrilateral(pts1[2 * i], pts1[2 * i + 1], pts2):
+            int_pts[num_of_inter * 2] = pts1[2 * i]
+            int_pts[num_of_inter * 2 + 1] = pts1[2 * i + 1]
+            num_of_inter += 1
+        if point_in_quadrilateral(pts2[2 * i], pts2[2 * i + 1], pts1):
+            int_pts[num_of_inter * 2] = pts2[2 * i]
+            int_pts[num_of_inter * 2 + 1] = pts2[2 * i + 1]
+            num_of_inter += 1
+    for i in range(4):
+        for j in range(4):
+            has_pts = line_segment_intersection(pts1, pts2, i, j, temp_pts)
+            if has_pts:
+                int_pts[num_of_inter * 2] = temp_pts[0]
+                int_pts[num_of_inter * 2 + 1] = temp_pts[1]
+                num_of_inter += 1
+
+    return num_of_inter
+
+
+@numba.jit(nopython=True, cache=True)
+def rbbox_to_corners(rbboxes):
+    """Convert rotated boxes to clockwise corners, same as the device function
+    in rotate_iou.py but done once per box instead of once per box pair.
+
+    Args:
+        rbboxes (np.ndarray, shape=[N, 5]): Rotated 2d boxes.
+
+    Returns:
+        np.ndarray, shape=[N, 8]: x0, y0, ..., x3, y3 of each box.
+    """
+    N = rbboxes.shape[0]
+    corners = np.zeros((N, 8), dtype=np.float32)
+    corners_x = np.zeros((4,), dtype=np.float32)
+    corners_y = np.zeros((4,), dtype=np.float32)
+    for n in range(N):
+        angle = rbboxes[n, 4]
+        a_cos = math.cos(angle)
+        a_sin = math.sin(angle)
+        center_x = rbboxes[n, 0]
+        center_y = rbboxes[n, 1]
+        x_d = rbboxes[n, 2]
+        y_d = rbboxes[n, 3]
+        corners_x[0] = -x_d / 2
+        corners_x[1] = -x_d / 2
+        corners_x[2] = x_d / 2
+        corners_x[3] = x_d / 2
+        corners_y[0] = -y_d / 2
+        corners_y[1] = y_d / 2
+        corners_y[2] = y_d / 2
+        corners_y[3] = -y_d / 2
+        for i in range(4):
+            corners[n, 2 * i] = a_cos * corners_x[i] + a_sin * corners_y[i] + center_x
+            corners[n, 2 * i + 1] = -a_sin * corners_x[i] + a_cos * corners_y[i] + center_y
+    return corners
+
+
+@numba.jit(nopython=True, inline="always")
+def rotate_iou_pair(
+    boxes, query_boxes, box_corners, qbox_corners, box_radius, qbox_radius, n, k, int_pts, vs, temp_pts, criterion
+):
+    """Compute rotated iou between boxes[n] and query_boxes[k], same as
+    devRotateIoUEval(query_boxes[k], boxes[n], criterion) in rotate_iou.py.
+    int_pts, vs and temp_pts are scratch buffers reused between calls.
+    """
+    area1 = query_boxes[k, 2] * query_boxes[k, 3]
+    area2 = boxes[n, 2] * boxes[n, 3]
+    dx = boxes[n, 0] - query_boxes[k, 0]
+    dy = boxes[n, 1] - query_boxes[k, 1]
+    reach = box_radius[n] + qbox_radius[k]
+    if dx * dx + dy * dy > reach * reach:
+        # circumcircles are disjoint, no need to clip the polygons
+        area_inter = np.float32(0.0)
+    else:
+        num_intersection = quadrilateral_intersection(qbox_corners[k], box_corners[n], int_pts, temp_pts)
+        sort_vertex_in_convex_polygon(int_pts, num_intersection, vs)
+        area_inter = area(int_pts, num_intersection)
+    if criterion == -1:
+        return area_inter / (area1 + area2 - area_inter)
+    elif criterion == 0:
+        return area_inter / area1
+    elif criterion == 1:
+        return area_inter / area2
+    else:
+        return area_inter
+
+
+@numba.jit(nopython=True, cache=True)
+def half_diagonal(rbboxes):
+    return np.sqrt(rbboxes[:, 2] * rbboxes[:, 2] + rbboxes[:, 3] * rbboxes[:, 3]) / 2
+
+
+@numba.jit(nopython=True, parallel=True, cache=True)
+def rotate_iou_kernel_eval(boxes, query_boxes, iou, criterion=-1):
+    """Kernel of computing rotated IoU on cpu, rows are split across cores
+    with prange. This function is for bev boxes in camera coordinate system
+    ONLY (the rotation is clockwise).
+
+    Args:
+        boxes (np.ndarray): Boxes, shape [N, 5].
+        query_boxes (np.ndarray): Query boxes, shape [K, 5].
+        iou (np.ndarray): Computed iou to return, shape [N, K].
+        criterion (int, optional): Indicate different type of iou.
+            -1 indicate `area_inter / (area1 + area2 - area_inter)`,
+            0 indicate `area_inter / area1`,
+            1 indicate `area_inter / area2`.
+    """
+    N = boxes.shape[0]
+    K = query_boxes.shape[0]
+    box_corners = rbbox_to_corners(boxes)
+    qbox_corners = rbbox_to_corners(query_boxes)
+    box_radius = half_diagonal(boxes)
+    qbox_radius = half_diagonal(query_boxes)
+    for n in numba.prange(N):
+        int_pts = np.zeros((16,), dtype=np.float32)
+        vs = np.zeros((16,), dtype=np.float32)
+        temp_pts = np.zeros((2,), dtype=np.float32)
+        for k in range(K):
+            iou[n, k] = rotate_iou_pair(
+                boxes,
+                query_boxes,
+                box_corners,
+                qbox_corners,
+                box_radius,
+                qbox_radius,
+                n,
+                k,
+                int_pts,
+                vs,
+                temp_pts,
+                criterion,
+            )
+
+
+@numba.jit(nopython=True, parallel=True, cache=True)
+def rotate_iou_kernel_eval_blocks(boxes, query_boxes, box_offsets, qbox_offsets, iou_offsets, iou, criterion=-1):
+    """Kernel of computing the block diagonal of the rotated IoU matrix on
+    cpu, i.e. only pairs inside the same block (frame). Blocks are split
+    across cores with prange.
+
+    Args:
+        boxes (np.ndarray): Boxes, shape [N, 5].
+        query_boxes (np.ndarray): Query boxes, shape [K, 5].
+        box_offsets (np.ndarray): Start of each block in boxes, shape [B + 1].
+        qbox_offsets (np.ndarray): Start of each block in query_boxes,
+            shape [B + 1].
+        iou_offsets (np.ndarray): Start of each block in iou, shape [B + 1].
+        iou (np.ndarray): Computed iou to return, block b is stored row
+            major in iou[iou_offsets[b]:iou_offsets[b + 1]].
+        criterion (int, optional): Indicate different type of iou.
+    """
+    box_corners = rbbox_to_corners(boxes)
+    qbox_corners = rbbox_to_corners(query_boxes)
+    box_radius = half_diagonal(boxes)
+    qbox_radius = half_diagonal(query_boxes)
+    for b in numba.prange(box_offsets.shape[0] - 1):
+        int_pts = np.zeros((16,), dtype=np.float32)
+        vs = np.zeros((16,), dtype=np.float32)
+        temp_pts = np.zeros((2,), dtype=np.float32)
+        num_qbox = qbox_offsets[b + 1] - qbox_offsets[b]
+        for n in range(box_offsets[b], box_offsets[b + 1]):
+            row = iou_offsets[b] + (n - box_offsets[b]) * num_qbox
+            for k in range(qbox_offsets[b], qbox_offsets[b + 1]):
+                iou[row + k - qbox_offsets[b]] = rotate_iou_pair(
+                    boxes,
+                    query_boxes,
+                    box_corners,
+                    qbox_corners,
+                    box_radius,
+                    qbox_radius,
+                    n,
+                    k,
+                    int_pts,
+                    vs,
+                    temp_pts,
+                    criterion,
+                )
+
+
+def rotate_iou_cpu_eval(boxes, query_boxes, criterion=-1):
+    """Rotated box iou running on all cpu cores, used when no cuda device is
+    available. Returns the same result as `rotate_iou_gpu_eval`.
+
+    This function is for bev boxes in camera coordinate system ONLY
+    (the rotation is clockwise).
+
+    Args:
+        boxes (np.ndarray): rbboxes. format: centers, dims,
+            angles(clockwise when positive) with the shape of [N, 5].
+        query_boxes (np.ndarray, shape=(K, 5)):
+            rbboxes to compute iou with boxes.
+        criterion (int, optional): Indicate different type of iou.
+            -1 indicate `area_inter / (area1 + area2 - area_inter)`,
+            0 indicate `area_inter / area1`,
+            1 indicate `area_inter / area2`.
+
+    Returns:
+        np.ndarray: IoU results.
+    """
+    boxes = np.ascontiguousarray(boxes, dtype=np.float32)
+    query_boxes = np.ascontiguousarray(query_boxes, dtype=np.float32)
+    N = boxes.shape[0]
+    K = query_boxes.shape[0]
+    iou = np.zeros((N, K), dtype=np.float32)
+    if N == 0 or K == 0:
+        return iou
+    rotate_iou_kernel_eval(boxes, query_boxes, iou, criterion)
+    return iou
+
+
+def rotate_iou_cpu_eval_blocks(boxes, query_boxes, box_offsets, qbox_offsets, iou_offsets, criterion=-1):
+    """Block diagonal version of `rotate_iou_cpu_eval`, only computes iou
+    between boxes and query boxes of the same block (frame).
+
+    Args:
+        boxes (np.ndarray): rbboxes of all blocks, shape [N, 5].
+        query_boxes (np.ndarray): query rbboxes of all blocks, shape [K, 5].
+        box_offsets (np.ndarray): Start of each block in boxes, shape [B + 1].
+        qbox_offsets (np.ndarray): Start of each block in query_boxes,
+            shape [B + 1].
+        iou_offsets (np.ndarray): Start of each block in the returned flat
+            iou, shape [B + 1].
+        criterion (int, optional): Indicate different type of iou.
+
+    Returns:
+        np.ndarray: Flat iou results, block b reshaped to
+            [num_boxes_b, num_qboxes_b] is its iou matrix.
+    """
+    boxes = np.ascontiguousarray(boxes, dtype=np.float32)
+    query_boxes = np.ascontiguousarray(query_boxes, dtype=np.float32)
+    iou = np.zeros((iou_offsets[-1],), dtype=np.float32)
+    if iou.shape[0] == 0:
+        return iou
+    rotate_iou_kernel_eval_blocks(
+        boxes,
+        query_boxes,
+        box_offsets.astype(np.int64),
+        qbox_offsets.astype(np.int64),
+        iou_offsets.astype(np.int64),
+        iou,
+        criterion,
+    )
+    return iou
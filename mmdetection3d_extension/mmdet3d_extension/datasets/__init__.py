@@ -1,13 +1,33 @@
 # Copyright (c) OpenMMLab. All rights reserved.
 from .usd_dataset import USDDataset
+from .usd_columnar_infos import USDColumnarInfos, dump_usd_columnar_infos
+from .usd_sharded_infos import USDShardedInfos, USDShardedInfosWriter
+from .usd_shards import USDShardIndex, USDShardReader
+from .packed_gt_database import PackedGTDatabase, PackedGTDatabaseWriter
+from .prefetch_backend import PrefetchBackend
 
 from .pipelines import (
     LoadPointsFromPointCloud2,
     LoadPointsFromFileExtension,
+    LoadPointsFromQuantizedFile,
+    LoadPointsFromPCDFile,
+    PackedDataBaseSampler,
 )
 
 __all__ = [
     "USDDataset",
+    "USDColumnarInfos",
+    "dump_usd_columnar_infos",
+    "USDShardedInfos",
+    "USDShardedInfosWriter",
+    "USDShardIndex",
+    "USDShardReader",
+    "PackedGTDatabase",
+    "PackedGTDatabaseWriter",
+    "PrefetchBackend",
     "LoadPointsFromPointCloud2",
     "LoadPointsFromFileExtension",
+    "LoadPointsFromQuantizedFile",
+    "LoadPointsFromPCDFile",
+    "PackedDataBaseSampler",
 ]
@@ -0,0 +1,125 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+import os
+from os import path as osp
+
+import numpy as np
+
+# 打包的gt database的文件名
+PACKED_GT_DATABASE_BLOB = "gt_points_{:03d}.bin"
+
+
+class PackedGTDatabaseWriter(object):
+    """将每个object的点云依次追加到少数几个float32的大文件(blob)中,代替每个object一个 .bin 文件
+
+    每个blob为 [num_points, num_features] 的float32数组,超过 max_blob_bytes 时写入下一个blob,
+    add 返回的 blob offset length 保存在 db_info 中,由 PackedGTDatabase 以memory-map的切片读取
+
+    Args:
+        out_dir (str): blob的保存路径
+        rel_dir (str): db_info 中 blob 相对于 data_root 的路径, 一般为 {info_prefix}_gt_database_packed
+        num_features (int, optional): 每个点的维度. Defaults to 4.
+        max_blob_bytes (int, optional): 每个blob的字节上限. Defaults to 4 GB.
+    """
+
+    def __init__(self, out_dir, rel_dir, num_features=4, max_blob_bytes=4 * 2**30):
+        self.out_dir = out_dir
+        self.rel_dir = rel_dir
+        self.num_features = num_features
+        self.max_blob_bytes = max_blob_bytes
+        os.makedirs(self.out_dir, exist_ok=True)
+        # 删除之前生成的blob,避免残留的blob与新的 db_info 不一致
+        for name in os.listdir(self.out_dir):
+            if name.startswith("gt_points_") and name.endswith(".bin"):
+                os.remove(osp.join(self.out_dir, name))
+        self.blob_id = -1
+        self.file = None
+        self.num_points = 0
+        self._next_blob()
+
+    def _next_blob(self):
+        if self.file is not None:
+            self.file.close()
+        self.blob_id += 1
+        self.blob_name = PACKED_GT_DATABASE_BLOB.format(self.blob_id)
+        self.file = open(osp.join(self.out_dir, self.blob_name), "wb")
+        self.num_points = 0
+
+    def add(self, points):
+        """追加一个object的点云
+
+        Args:
+            points (np.ndarray): [N, num_features] object的点云
+
+        Returns:
+            dict: blob (相对于 data_root 的路径) offset length (单位为点) num_features, 保存在 db_info 中
+        """
+        points = np.ascontiguousarray(points, dtype=np.float32).reshape(-1, self.num_features)
+        point_bytes = 4 * self.num_features
+        if self.num_points > 0 and (self.num_points + len(points)) * point_bytes > self.max_blob_bytes:
+            self._next_blob()
+        offset = self.num_points
+        self.file.write(points.tobytes())
+        self.num_points += len(points)
+        return dict(
+            blob=osp.join(self.rel_dir, self.blob_name),
+            offset=offset,
+            length=len(points),
+            num_features=self.num_features,
+        )
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PackedGTDatabase(object):
+    """以memory-map的方式读取 PackedGTDatabaseWriter 写入的blob,读取一个object只是一次切片,不需要打开文件
+
+    每个blob在每个进程中第一次访问时打开,之后一直保持打开,多个DataLoader worker共享page cache
+
+    Args:
+        data_root (str): db_info 中 blob 路径的根路径
+    """
+
+    def __init__(self, data_root):
+        self.data_root = data_root
+        self._pid = None
+
+    def _get_blob(self, blob, num_features):
+        # memory-map不跨fork使用,在每个进程中重新打开
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._blobs = dict()
+        if blob not in self._blobs:
+            self._blobs[blob] = np.memmap(osp.join(self.data_root, blob), dtype=np.float32, mode="r").reshape(
+                -1, num_features
+            )
+        return self._blobs[blob]
+
+    def get(self, db_info):
+        """读取一个object的点云
+
+        Args:
+            db_info (dict): 包含 blob offset length num_features 的 db_info
+
+        Returns:
+            np.ndarray: [length, num_features] 可写的点云
+        """
+        if db_info["length"] == 0:
+            return np.zeros((0, db_info["num_features"]), dtype=np.float32)
+        blob = self._get_blob(db_info["blob"], db_info["num_features"])
+        # ObjectSample 会原地平移点云,所以返回一份复制
+        return np.array(blob[db_info["offset"] : db_info["offset"] + db_info["length"]])
+
+    def __getstate__(self):
+        return dict(data_root=self.data_root)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
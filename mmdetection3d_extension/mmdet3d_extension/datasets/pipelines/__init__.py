@@ -3,9 +3,33 @@
 from .loading import (
     LoadPointsFromPointCloud2,
     LoadPointsFromFileExtension,
+    LoadPointsFromQuantizedFile,
+    LoadPointsFromPCDFile,
 )
+from .dbsampler import PackedDataBaseSampler
+from .pcd import read_pcd, decode_pcd, encode_pcd, write_pcd, pcd_to_pointcloud2
+from .pointcloud2 import decode_pointcloud2, pointcloud2_to_array
+from .points_cache import SharedPointsCache
+from .pre_crop import get_pre_crop_range, pre_crop_mask, pre_crop_points
+from .quantized_points import encode_quantized_points, decode_quantized_points
 
 __all__ = [
     "LoadPointsFromPointCloud2",
     "LoadPointsFromFileExtension",
+    "LoadPointsFromQuantizedFile",
+    "LoadPointsFromPCDFile",
+    "PackedDataBaseSampler",
+    "read_pcd",
+    "decode_pcd",
+    "encode_pcd",
+    "write_pcd",
+    "pcd_to_pointcloud2",
+    "decode_pointcloud2",
+    "pointcloud2_to_array",
+    "SharedPointsCache",
+    "get_pre_crop_range",
+    "pre_crop_mask",
+    "pre_crop_points",
+    "encode_quantized_points",
+    "decode_quantized_points",
 ]
@@ -0,0 +1,51 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+from os import path as osp
+
+from mmdet3d.core.points import get_points_type
+from mmdet3d.datasets.builder import OBJECTSAMPLERS
+from mmdet3d.datasets.pipelines.dbsampler import DataBaseSampler
+
+from ..packed_gt_database import PackedGTDatabase
+
+
+class _PackedPointsLoader(object):
+    """替代 DataBaseSampler 的 points_loader, db_info 中有 blob 字段时从 PackedGTDatabase 中切片读取,
+    否则使用原来的 points_loader 读取 path 对应的文件
+
+    DataBaseSampler.sample_all 只将 data_root 与 db_info["path"] 拼接后的 pts_filename 传给 points_loader,
+    所以按 pts_filename 查找对应的 db_info
+    """
+
+    def __init__(self, data_root, db_infos, points_loader):
+        self.database = PackedGTDatabase(data_root)
+        self.points_loader = points_loader
+        self.points_class = get_points_type(points_loader.coord_type)
+        self.use_dim = points_loader.use_dim
+        self.db_infos = dict()
+        for infos in db_infos.values():
+            for info in infos:
+                if "blob" in info:
+                    self.db_infos[osp.join(data_root, info["path"]) if data_root else info["path"]] = info
+
+    def __call__(self, results):
+        info = self.db_infos.get(results["pts_filename"])
+        if info is None:
+            return self.points_loader(results)
+        points = self.database.get(info)[:, self.use_dim]
+        results["points"] = self.points_class(points, points_dim=points.shape[-1], attribute_dims=None)
+        return results
+
+
+@OBJECTSAMPLERS.register_module()
+class PackedDataBaseSampler(DataBaseSampler):
+    """支持 create_groundtruth_database(packed=True) 生成的打包的gt database 的 DataBaseSampler
+
+    所有object的点云保存在少数几个blob中, db_info 中的 blob offset length 为点云在blob中的位置,
+    ObjectSample 粘贴gt时只是memory-map的一次切片,不再为每个object打开一个小文件.
+    参数与 DataBaseSampler 相同, 没有 blob 字段的 db_info 仍然由 points_loader 读取 path 对应的文件,
+    通过 ObjectSample 的 db_sampler=dict(type="PackedDataBaseSampler", ...) 使用
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.points_loader = _PackedPointsLoader(self.data_root, self.db_infos, self.points_loader)
@@ -1,4 +1,6 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+from os import path as osp
+
 import mmcv
 import numpy as np
 import time
@@ -7,7 +9,12 @@ from mmdet3d.core.points import BasePoints, get_points_type
 from mmdet.datasets.pipelines import LoadAnnotations, LoadImageFromFile
 from mmdet3d.datasets.builder import PIPELINES
 
-from wadda.pypcd import pypcd
+from ..usd_shards import USDShardReader
+from .pcd import decode_pcd
+from .pointcloud2 import decode_pointcloud2
+from .points_cache import SharedPointsCache
+from .pre_crop import get_pre_crop_range, pre_crop_points
+from .quantized_points import decode_quantized_points
 
 
 @PIPELINES.register_module()
@@ -34,6 +41,13 @@ class LoadPointsFromPointCloud2(object):
             refer to
             https://github.com/open-mmlab/mmcv/blob/master/mmcv/fileio/file_client.py
             for more details. Defaults to dict(backend='disk').
+        fields (list[str], optional): 加载的每一个维度对应的 PointCloud2 的字段名称,长度不小于 load_dim,
+            x y z 之外的字段在点云中不存在时填充为0.
+            Defaults to ("x", "y", "z", "intensity", "ring", "time").
+        pre_crop (dict, optional): 不为None时解码后立即丢弃数据增强之后也不会落在 point_cloud_range 中的点,
+            参数参考 get_pre_crop_range, 例如 dict(point_cloud_range=point_cloud_range, rot_range=[-0.3925, 0.3925],
+            scale_ratio_range=[0.95, 1.05], flip_ratio_bev_horizontal=0.5). 需要 use_dim 的前3维为 x y z.
+            Defaults to None.
     """
 
     def __init__(
@@ -44,6 +58,8 @@ class LoadPointsFromPointCloud2(object):
         shift_height=False,
         use_color=False,
         file_client_args=dict(backend="disk"),
+        fields=("x", "y", "z", "intensity", "ring", "time"),
+        pre_crop=None,
     ):
         self.shift_height = shift_height
         self.use_color = use_color
@@ -57,6 +73,13 @@ class LoadPointsFromPointCloud2(object):
         self.use_dim = use_dim
         self.file_client_args = file_client_args.copy()
         self.file_client = None
+        assert len(fields) >= load_dim, f"Expect at least {load_dim} fields, got {fields}"
+        self.fields = list(fields[:load_dim])
+        self.pre_crop = pre_crop
+        self.pre_crop_range = None
+        if pre_crop is not None:
+            assert list(use_dim[:3]) == [0, 1, 2], f"pre_crop expects use_dim starts with x y z, got {use_dim}"
+            self.pre_crop_range = get_pre_crop_range(**pre_crop)
 
     def _pc_format_converter(self, input_data):
         """将输入的点云数据转换为符合mmdetection3d中模型输入需要的点云格式。
@@ -68,26 +91,16 @@ class LoadPointsFromPointCloud2(object):
             waymo数据集的原始点云是[x, y, z, intensity,ring,未知]6维,
         那么采用waymo数据集的配置文件所实例化的模型就需要提供6维的点云(尽管最后只是使用了其中的前4维参与了训练)
 
+        NOTE : 不经过pypcd,直接将 PointCloud2 的 data 视为structured数组,只取出 use_dim 对应的字段,
+        一次性写入float32的输出中,不需要的字段不会被复制,不存在的字段(例如ring time)填充为0
+
         Args:
             input_data (PointCloud2): 输入的点云数据,来自ros1订阅,为ros1 sensor_msgs 的PointCloud2类型的点云数据
+
+        Returns:
+            np.ndarray: [N, len(use_dim)] float32 的点云
         """
-        pc = pypcd.PointCloud.from_msg(input_data)
-        # 所有点云至少包含xyz这三个维度
-        x = pc.pc_data["x"].flatten()
-        y = pc.pc_data["y"].flatten()
-        z = pc.pc_data["z"].flatten()
-        intensity = pc.pc_data["intensity"].flatten()
-        ring = pc.pc_data["ring"].flatten()
-
-        # 首先将输入的点云数据转换为6维的点云，原始点云中不存在的维度设置为0，然后根据需求转换为需要的维度
-        pc_array_6d = np.zeros((x.shape[0], 6))
-        pc_array_6d[:, 0] = x
-        pc_array_6d[:, 1] = y
-        pc_array_6d[:, 2] = z
-        pc_array_6d[:, 3] = intensity
-        pc_array_6d[:, 4] = ring
-
-        return pc_array_6d
+        return decode_pointcloud2(input_data, [self.fields[i] for i in self.use_dim], dtype=np.float32)
 
     def _load_pointcloud2(self, pointcloud2):
         """Private function to load point clouds data.
@@ -96,10 +109,12 @@ class LoadPointsFromPointCloud2(object):
             pointcloud2 (pointcloud2): pointcloud2 format point clouds data.
 
         Returns:
-            np.ndarray: An array containing point clouds data.
+            np.ndarray: An array containing point clouds data, 只包含 use_dim 对应的维度.
         """
 
         points = self._pc_format_converter(pointcloud2)
+        if self.pre_crop_range is not None:
+            points = pre_crop_points(points, self.pre_crop_range)
 
         return points
 
@@ -118,7 +133,6 @@ class LoadPointsFromPointCloud2(object):
 
         pointcloud2 = results["pointcloud2"]
         points = self._load_pointcloud2(pointcloud2)
-        points = points[:, self.use_dim]
         attribute_dims = None
 
         if self.shift_height:
@@ -154,7 +168,9 @@ class LoadPointsFromPointCloud2(object):
         repr_str += f"use_color={self.use_color}, "
         repr_str += f"file_client_args={self.file_client_args}, "
         repr_str += f"load_dim={self.load_dim}, "
-        repr_str += f"use_dim={self.use_dim})"
+        repr_str += f"use_dim={self.use_dim}, "
+        repr_str += f"fields={self.fields}, "
+        repr_str += f"pre_crop={self.pre_crop})"
         return repr_str
 
 
@@ -185,8 +201,23 @@ class LoadPointsFromFileExtension(object):
             refer to
             https://github.com/open-mmlab/mmcv/blob/master/mmcv/fileio/file_client.py
             for more details. Defaults to dict(backend='disk').
+        use_memmap (bool, optional): 本地的 .bin 文件是否以memory-map的方式读取,不将整个文件读入内存,
+            只有 file_client_args 的backend为disk时生效. Defaults to False.
+        points_cache (dict, optional): 不为None时将解码后的点云缓存在同一台机器上所有worker共享的
+            SharedPointsCache 中, 例如 dict(cache_dir="/dev/shm/mmdet3d_points_cache", max_bytes=16 * 2**30),
+            数据集可以全部放入缓存时,第二个epoch开始不再读取点云文件. Defaults to None.
+        pre_crop (dict, optional): 不为None时在解码时就丢弃数据增强之后也不会落在 point_cloud_range 中的点,
+            之后的数据增强只需要处理剩下的点,参数参考 get_pre_crop_range 与 LoadPointsFromPointCloud2.
+            需要 use_dim 的前3维为 x y z. Defaults to None.
+
+    results 中包含 pts_shard (shard_path, offset, length) 时(USDDataset 的 pts_shard_dir),
+    从 usd_converter.create_usd_shards 生成的shard文件中按位置读取点云,不再打开 pts_filename,
+    use_memmap 为True时以memory-map的切片读取. shard的 payload_format 与 SHARD_PAYLOAD_FORMAT 不一致时抛出 ValueError
     """
 
+    # 能够从shard中解码的样本数据格式, 参考 usd_converter.create_usd_shards
+    SHARD_PAYLOAD_FORMAT = "float32"
+
     def __init__(
         self,
         coord_type,
@@ -195,6 +226,9 @@ class LoadPointsFromFileExtension(object):
         shift_height=False,
         use_color=False,
         file_client_args=dict(backend="disk"),
+        use_memmap=False,
+        points_cache=None,
+        pre_crop=None,
     ):
         self.shift_height = shift_height
         self.use_color = use_color
@@ -208,6 +242,14 @@ class LoadPointsFromFileExtension(object):
         self.use_dim = use_dim
         self.file_client_args = file_client_args.copy()
         self.file_client = None
+        self.use_memmap = use_memmap and self.file_client_args.get("backend", "disk") == "disk"
+        self.shard_reader = USDShardReader(use_memmap=self.use_memmap, payload_format=self.SHARD_PAYLOAD_FORMAT)
+        self.points_cache = SharedPointsCache(**points_cache) if points_cache is not None else None
+        self.pre_crop = pre_crop
+        self.pre_crop_range = None
+        if pre_crop is not None:
+            assert list(use_dim[:3]) == [0, 1, 2], f"pre_crop expects use_dim starts with x y z, got {use_dim}"
+            self.pre_crop_range = get_pre_crop_range(**pre_crop)
 
         # judeg load dims and use dims
         self.dim_diff = 0
@@ -225,6 +267,12 @@ class LoadPointsFromFileExtension(object):
         Returns:
             np.ndarray: An array containing point clouds data.
         """
+        if self.use_memmap and pts_filename.endswith(".bin"):
+            try:
+                return np.memmap(pts_filename, dtype=np.float32, mode="r")
+            except ValueError:
+                # 空文件不能memory-map
+                return np.zeros((0,), dtype=np.float32)
         if self.file_client is None:
             self.file_client = mmcv.FileClient(**self.file_client_args)
         try:
@@ -239,6 +287,74 @@ class LoadPointsFromFileExtension(object):
 
         return points
 
+    def _load_use_dims(self, pts_filename):
+        """加载点云并只保留 use_dim 对应的维度
+
+        Args:
+            pts_filename (str): Filename of point clouds data.
+
+        Returns:
+            np.ndarray: [N, len(use_dim)] float32 的点云
+        """
+        points = self._load_points(pts_filename)
+        return self._gather_dims(points.reshape(-1, self.load_dim))
+
+    def _load_results(self, results):
+        """从shard或者 pts_filename 加载 [N, len(use_dim)] float32 的点云"""
+        if results.get("pts_shard") is not None:
+            return self._decode_buffer(self.shard_reader.read(results["pts_shard"]))
+        return self._load_use_dims(results["pts_filename"])
+
+    def prefetch_filenames(self, results):
+        """file_client 为 PrefetchBackend 时需要预读的文件, memory-map以及shard不经过 file_client,不需要预读
+
+        Args:
+            results (dict): 包含 pts_filename 与 pts_shard 的样本信息
+
+        Returns:
+            list[str]: 需要预读的文件
+        """
+        if results.get("pts_shard") is not None or self.use_memmap:
+            return []
+        return [results["pts_filename"]]
+
+    def _decode_buffer(self, buffer):
+        """将shard中一个样本的原始数据解码为 [N, len(use_dim)] float32 的点云
+
+        Args:
+            buffer (bytes | np.ndarray): 与点云文件内容相同的数据
+
+        Returns:
+            np.ndarray: [N, len(use_dim)] float32 的点云
+        """
+        return self._gather_dims(np.frombuffer(buffer, dtype=np.float32).reshape(-1, self.load_dim))
+
+    def _gather_dims(self, points):
+        """将 use_dim 对应的维度直接写入一个预先分配的float32数组中,超出 load_dim 的维度填充为0,
+        不需要 np.concatenate 补全维度,也不会将点云转换为float64
+
+        设置了 pre_crop 时在同一次遍历中丢弃预裁剪范围外的点,只复制剩下的点
+
+        Args:
+            points (np.ndarray): [N, load_dim] 原始的点云,可以是只读的memory-map
+
+        Returns:
+            np.ndarray: [N, len(use_dim)] float32 的点云
+        """
+        if self.pre_crop_range is not None:
+            return pre_crop_points(points, self.pre_crop_range, self.use_dim)
+        output = np.empty((points.shape[0], len(self.use_dim)), dtype=np.float32)
+        if not self.dim_diff_flag and 0 <= min(self.use_dim) and max(self.use_dim) < self.load_dim:
+            # 上面已经检查过index的范围,mode="clip" 时 np.take 直接写入output,默认的 mode="raise" 会先写入一个临时的副本
+            np.take(points, self.use_dim, axis=1, out=output, mode="clip")
+            return output
+        for i, dim in enumerate(self.use_dim):
+            if dim < self.load_dim:
+                output[:, i] = points[:, dim]
+            else:
+                output[:, i] = 0
+        return output
+
     def __call__(self, results):
         """Call function to load points data from file.
 
@@ -251,15 +367,17 @@ class LoadPointsFromFileExtension(object):
 
                 - points (:obj:`BasePoints`): Point clouds data.
         """
-        pts_filename = results["pts_filename"]
-        points = self._load_points(pts_filename)
-
-        points = points.reshape(-1, self.load_dim)
-
-        if self.dim_diff_flag:
-            points = np.concatenate([points, np.zeros((points.shape[0], self.dim_diff))], axis=1)
-
-        points = points[:, self.use_dim]
+        if self.points_cache is None:
+            points = self._load_results(results)
+        else:
+            # shift_height 与 use_color 在缓存之后处理,不影响缓存的内容
+            key = f"{self.__class__.__name__}:{results['pts_filename']}:{self.load_dim}:{self.use_dim}"
+            if self.pre_crop_range is not None:
+                key += f":{self.pre_crop_range.tolist()}"
+            points = self.points_cache.get(key)
+            if points is None:
+                points = self._load_results(results)
+                self.points_cache.put(key, points)
 
         attribute_dims = None
 
@@ -296,5 +414,100 @@ class LoadPointsFromFileExtension(object):
         repr_str += f"use_color={self.use_color}, "
         repr_str += f"file_client_args={self.file_client_args}, "
         repr_str += f"load_dim={self.load_dim}, "
-        repr_str += f"use_dim={self.use_dim})"
+        repr_str += f"use_dim={self.use_dim}, "
+        repr_str += f"use_memmap={self.use_memmap}, "
+        repr_str += f"points_cache={self.points_cache.__getstate__() if self.points_cache is not None else None}, "
+        repr_str += f"pre_crop={self.pre_crop})"
         return repr_str
+
+
+@PIPELINES.register_module()
+class LoadPointsFromQuantizedFile(LoadPointsFromFileExtension):
+    """加载 tools/data_converter/quantize_points.py 生成的量化点云 .qbin,
+    xyz为定点数, intensity 与 ring 为uint8, 文件大小约为float32的 .bin 的40%~45%
+
+    解码后的维度与原始的 .bin 相同(0 1 2 为 x y z, 3 为 intensity, 4 为 ring),
+    所以 load_dim 与 use_dim 与加载 .bin 时的配置相同即可,只解码 use_dim 中的维度
+
+    Args:
+        file_suffix (str, optional): 量化点云文件的后缀, pts_filename 的后缀会被替换为该后缀.
+            Defaults to ".qbin".
+        其他参数参考 LoadPointsFromFileExtension.
+    """
+
+    SHARD_PAYLOAD_FORMAT = "qbin"
+
+    def __init__(self, coord_type, file_suffix=".qbin", **kwargs):
+        super().__init__(coord_type, **kwargs)
+        self.file_suffix = file_suffix
+
+    def _load_use_dims(self, pts_filename):
+        pts_filename = osp.splitext(pts_filename)[0] + self.file_suffix
+        if self.use_memmap:
+            buffer = np.memmap(pts_filename, dtype=np.uint8, mode="r")
+        else:
+            if self.file_client is None:
+                self.file_client = mmcv.FileClient(**self.file_client_args)
+            buffer = self.file_client.get(pts_filename)
+        return self._decode_buffer(buffer)
+
+    def prefetch_filenames(self, results):
+        return [osp.splitext(f)[0] + self.file_suffix for f in super().prefetch_filenames(results)]
+
+    def _decode_buffer(self, buffer):
+        points = decode_quantized_points(buffer, self.use_dim, dtype=np.float32)
+        if self.pre_crop_range is not None:
+            points = pre_crop_points(points, self.pre_crop_range)
+        return points
+
+    def __repr__(self):
+        """str: Return a string that describes the module."""
+        return super().__repr__()[:-1] + f", file_suffix={self.file_suffix})"
+
+
+@PIPELINES.register_module()
+class LoadPointsFromPCDFile(LoadPointsFromFileExtension):
+    """不依赖 pypcd 加载PCD点云,支持 ascii binary 与 binary_compressed
+
+    header 中的字段解析为structured dtype, binary 不经过复制直接视为structured数组,
+    binary_compressed 使用numba实现的LZF解压, 只将 use_dim 对应的字段写入float32的输出中
+
+    Args:
+        fields (list[str], optional): 加载的每一个维度对应的PCD的字段名称,长度不小于 load_dim,
+            x y z 之外的字段在点云中不存在时填充为0.
+            Defaults to ("x", "y", "z", "intensity", "ring", "time").
+        file_suffix (str, optional): PCD文件的后缀, pts_filename 的后缀会被替换为该后缀. Defaults to ".pcd".
+        其他参数参考 LoadPointsFromFileExtension.
+    """
+
+    # create_usd_shards 不生成PCD的shard
+    SHARD_PAYLOAD_FORMAT = "pcd"
+
+    def __init__(self, coord_type, fields=("x", "y", "z", "intensity", "ring", "time"), file_suffix=".pcd", **kwargs):
+        super().__init__(coord_type, **kwargs)
+        self.fields = fields
+        self.file_suffix = file_suffix
+
+    def _load_use_dims(self, pts_filename):
+        pts_filename = osp.splitext(pts_filename)[0] + self.file_suffix
+        if self.use_memmap:
+            buffer = np.memmap(pts_filename, dtype=np.uint8, mode="r")
+        else:
+            if self.file_client is None:
+                self.file_client = mmcv.FileClient(**self.file_client_args)
+            buffer = self.file_client.get(pts_filename)
+        return self._decode_buffer(buffer)
+
+    def prefetch_filenames(self, results):
+        return [osp.splitext(f)[0] + self.file_suffix for f in super().prefetch_filenames(results)]
+
+    def _decode_buffer(self, buffer):
+        field_names = [self.fields[dim] if dim < len(self.fields) else None for dim in self.use_dim]
+        points = decode_pcd(buffer, field_names, dtype=np.float32)
+        if self.pre_crop_range is not None:
+            points = pre_crop_points(points, self.pre_crop_range)
+        return points
+
+    def __repr__(self):
+        """str: Return a string that describes the module."""
+        return super().__repr__()[:-1] + f", fields={self.fields}, file_suffix={self.file_suffix})"
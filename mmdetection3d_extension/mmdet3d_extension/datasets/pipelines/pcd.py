@@ -0,0 +1,408 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+import io
+import struct
+from collections import namedtuple
+
+import numba
+import numpy as np
+from numpy.lib import recfunctions
+
+from .pointcloud2 import REQUIRED_FIELDS
+
+# PCD header 中 TYPE 与 SIZE 对应的numpy类型
+PCD_TYPES = {
+    ("F", 4): np.float32,
+    ("F", 8): np.float64,
+    ("I", 1): np.int8,
+    ("I", 2): np.int16,
+    ("I", 4): np.int32,
+    ("I", 8): np.int64,
+    ("U", 1): np.uint8,
+    ("U", 2): np.uint16,
+    ("U", 4): np.uint32,
+    ("U", 8): np.uint64,
+}
+PCD_TYPE_CODES = {"f": "F", "i": "I", "u": "U"}
+# sensor_msgs/PointField 中 datatype 的取值
+POINTFIELD_DATATYPES = {
+    np.dtype(np.int8): 1,
+    np.dtype(np.uint8): 2,
+    np.dtype(np.int16): 3,
+    np.dtype(np.uint16): 4,
+    np.dtype(np.int32): 5,
+    np.dtype(np.uint32): 6,
+    np.dtype(np.float32): 7,
+    np.dtype(np.float64): 8,
+}
+PCD_DATA_TYPES = ("ascii", "binary", "binary_compressed")
+
+# 不依赖ros的 PointField 与 PointCloud2, 属性与 sensor_msgs 中的消息相同
+PointFieldData = namedtuple("PointFieldData", ["name", "offset", "datatype", "count"])
+PointCloud2Data = namedtuple(
+    "PointCloud2Data",
+    ["header", "height", "width", "fields", "is_bigendian", "point_step", "row_step", "data", "is_dense"],
+)
+
+
+@numba.jit(nopython=True)
+def _lzf_decompress_kernel(src, dst):
+    ip, op = 0, 0
+    while ip < src.shape[0]:
+        ctrl = np.int64(src[ip])
+        ip += 1
+        if ctrl < 32:
+            # 长度为 ctrl + 1 的原始数据
+            length = ctrl + 1
+            if op + length > dst.shape[0] or ip + length > src.shape[0]:
+                return -1
+            for k in range(length):
+                dst[op + k] = src[ip + k]
+            op += length
+            ip += length
+        else:
+            # 引用之前已经解压的数据, 长度与偏移保存在 ctrl 以及之后的1~2个字节中
+            length = ctrl >> 5
+            ref = op - ((ctrl & 0x1F) << 8) - 1
+            if length == 7:
+                length += np.int64(src[ip])
+                ip += 1
+            ref -= np.int64(src[ip])
+            ip += 1
+            length += 2
+            if ref < 0 or op + length > dst.shape[0]:
+                return -1
+            # 引用的数据可能与输出重叠,需要逐字节复制
+            for k in range(length):
+                dst[op + k] = dst[ref + k]
+            op += length
+    return op
+
+
+@numba.jit(nopython=True)
+def _lzf_compress_kernel(src, dst):
+    hlog = 14
+    htab = np.full(1 << hlog, -1, dtype=np.int64)
+    n = src.shape[0]
+    ip, op, lit = 0, 1, 0
+    while ip + 2 < n:
+        hval = (np.int64(src[ip]) << 16) | (np.int64(src[ip + 1]) << 8) | np.int64(src[ip + 2])
+        slot = ((hval * 2654435761) & 0xFFFFFFFF) >> (32 - hlog)
+        ref = htab[slot]
+        htab[slot] = ip
+        off = ip - ref - 1
+        if (
+            ref >= 0
+            and off < 8192
+            and src[ref] == src[ip]
+            and src[ref + 1] == src[ip + 1]
+            and src[ref + 2] == src[ip + 2]
+        ):
+            if op + 4 > dst.shape[0]:
+                return -1
+            # 结束当前的原始数据段,没有原始数据时去掉预留的控制字节
+            if lit > 0:
+                dst[op - lit - 1] = lit - 1
+            else:
+                op -= 1
+            max_length = min(n - ip, 264)
+            length = 3
+            while length < max_length and src[ref + length] == src[ip + length]:
+                length += 1
+            if length - 2 < 7:
+                dst[op] = (off >> 8) + ((length - 2) << 5)
+                op += 1
+            else:
+                dst[op] = (off >> 8) + (7 << 5)
+                dst[op + 1] = length - 2 - 7
+                op += 2
+            dst[op] = off & 0xFF
+            op += 2
+            ip += length
+            lit = 0
+            continue
+        if op + 2 > dst.shape[0]:
+            return -1
+        dst[op] = src[ip]
+        op += 1
+        ip += 1
+        lit += 1
+        if lit == 32:
+            dst[op - lit - 1] = lit - 1
+            lit = 0
+            op += 1
+    while ip < n:
+        if op + 2 > dst.shape[0]:
+            return -1
+        dst[op] = src[ip]
+        op += 1
+        ip += 1
+        lit += 1
+        if lit == 32:
+            dst[op - lit - 1] = lit - 1
+            lit = 0
+            op += 1
+    if lit > 0:
+        dst[op - lit - 1] = lit - 1
+    else:
+        op -= 1
+    return op
+
+
+def lzf_decompress(data, uncompressed_size):
+    """LZF解压, PCD 的 binary_compressed 使用该格式
+
+    Args:
+        data (bytes | np.ndarray): 压缩的数据
+        uncompressed_size (int): 解压后的字节数
+
+    Returns:
+        np.ndarray: [uncompressed_size] uint8
+    """
+    output = np.empty((uncompressed_size,), dtype=np.uint8)
+    size = _lzf_decompress_kernel(np.frombuffer(data, dtype=np.uint8), output)
+    if size != uncompressed_size:
+        raise ValueError(f"corrupted lzf data, got {size} bytes, expect {uncompressed_size} bytes")
+    return output
+
+
+def lzf_compress(data):
+    """LZF压缩
+
+    Args:
+        data (bytes | np.ndarray): 原始数据
+
+    Returns:
+        bytes: 压缩后的数据
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    output = np.empty((len(data) + len(data) // 32 + 64,), dtype=np.uint8)
+    size = _lzf_compress_kernel(data, output)
+    assert size >= 0, "lzf output buffer overflow"
+    return output[:size].tobytes()
+
+
+def parse_pcd_header(buffer):
+    """解析PCD文件的header
+
+    Args:
+        buffer (bytes | np.ndarray): PCD文件的内容
+
+    Returns:
+        tuple: metadata (dict) 包含 fields size type count width height viewpoint points data,
+            以及数据部分在 buffer 中的起始位置
+    """
+    buffer = memoryview(np.frombuffer(buffer, dtype=np.uint8))
+    metadata, offset = dict(), 0
+    while "data" not in metadata:
+        end = bytes(buffer[offset : offset + 1024]).find(b"\n")
+        if end < 0:
+            raise ValueError("invalid pcd header")
+        line = bytes(buffer[offset : offset + end]).decode("ascii").strip()
+        offset += end + 1
+        if len(line) == 0 or line.startswith("#"):
+            continue
+        key, *values = line.split()
+        metadata[key.lower()] = values
+    for key in ("width", "height", "points"):
+        if key in metadata:
+            metadata[key] = int(metadata[key][0])
+    metadata["size"] = [int(s) for s in metadata["size"]]
+    metadata["count"] = [int(c) for c in metadata.get("count", [1] * len(metadata["fields"]))]
+    metadata["viewpoint"] = [float(v) for v in metadata.get("viewpoint", [0, 0, 0, 1, 0, 0, 0])]
+    metadata.setdefault("points", metadata["width"] * metadata["height"])
+    metadata["data"] = metadata["data"][0].lower()
+    if metadata["data"] not in PCD_DATA_TYPES:
+        raise ValueError(f"unsupported pcd data type {metadata['data']}")
+    return metadata, offset
+
+
+def pcd_dtype(metadata):
+    """根据header构建每个点的structured dtype,各个字段之间没有padding,
+    名称为 _ 的字段(PCL中用于对齐的padding)重命名为 _0 _1 ...
+    """
+    names, formats = [], []
+    for i, (name, size, type_, count) in enumerate(
+        zip(metadata["fields"], metadata["size"], metadata["type"], metadata["count"])
+    ):
+        dtype = np.dtype(PCD_TYPES[(type_, size)]).newbyteorder("<")
+        names.append(f"_{i}" if name == "_" or name in names else name)
+        formats.append(dtype if count == 1 else (dtype, (count,)))
+    return np.dtype(dict(names=names, formats=formats))
+
+
+def _decode_pcd_columns(buffer, metadata, offset, point_dtype):
+    """将PCD的数据部分解析为每个字段对应的数组"""
+    num_points = metadata["points"]
+    if metadata["data"] == "binary":
+        points = np.frombuffer(buffer, dtype=point_dtype, count=num_points, offset=offset)
+        return {name: points[name] for name in point_dtype.names}
+    if metadata["data"] == "binary_compressed":
+        # 数据以字段为主序存储: 所有点的第一个字段, 所有点的第二个字段, ...
+        compressed_size, uncompressed_size = struct.unpack_from("<II", buffer, offset)
+        start = offset + 8
+        data = lzf_decompress(np.frombuffer(buffer, dtype=np.uint8)[start : start + compressed_size], uncompressed_size)
+        columns, column_offset = dict(), 0
+        for name in point_dtype.names:
+            field_dtype = point_dtype.fields[name][0]
+            base, shape = field_dtype.base, field_dtype.shape
+            count = num_points * int(np.prod(shape))
+            column = np.frombuffer(data, dtype=base, count=count, offset=column_offset)
+            columns[name] = column.reshape((num_points,) + shape)
+            column_offset += count * base.itemsize
+        return columns
+    # ascii, 每一行为一个点的所有值
+    # NOTE : 以float64解析文本, 超过2^53的64位整数会损失精度
+    text = io.BytesIO(np.frombuffer(buffer, dtype=np.uint8)[offset:].tobytes())
+    values = np.loadtxt(text, dtype=np.float64, max_rows=num_points, ndmin=2).reshape(num_points, -1)
+    columns, column_offset = dict(), 0
+    for name in point_dtype.names:
+        field_dtype = point_dtype.fields[name][0]
+        count = int(np.prod(field_dtype.shape))
+        column = values[:, column_offset : column_offset + count].astype(field_dtype.base)
+        columns[name] = column.reshape((num_points,) + field_dtype.shape)
+        column_offset += count
+    return columns
+
+
+def read_pcd(pcd):
+    """读取PCD文件,支持 ascii binary 与 binary_compressed
+
+    Args:
+        pcd (str | bytes | np.ndarray): PCD文件的路径或者内容
+
+    Returns:
+        tuple: metadata (dict) 以及 [N] 的structured数组, binary 时不经过复制直接视为structured数组
+    """
+    if isinstance(pcd, str):
+        with open(pcd, "rb") as f:
+            pcd = f.read()
+    metadata, offset = parse_pcd_header(pcd)
+    point_dtype = pcd_dtype(metadata)
+    if metadata["data"] == "binary":
+        return metadata, np.frombuffer(pcd, dtype=point_dtype, count=metadata["points"], offset=offset)
+    columns = _decode_pcd_columns(pcd, metadata, offset, point_dtype)
+    pc_data = np.empty((metadata["points"],), dtype=point_dtype)
+    for name, column in columns.items():
+        pc_data[name] = column
+    return metadata, pc_data
+
+
+def decode_pcd(buffer, field_names, dtype=np.float32, fill_value=0):
+    """只将需要的字段一次性写入 [N, len(field_names)] 的输出中, binary_compressed 时只组合需要的字段
+
+    Args:
+        buffer (bytes | np.ndarray): PCD文件的内容,也可以是memory-map
+        field_names (list[str]): 输出的每一列对应的字段名称, x y z 之外的字段在点云中不存在时填充为 fill_value
+        dtype (np.dtype, optional): 输出的类型. Defaults to np.float32.
+        fill_value (float, optional): 不存在的字段的填充值. Defaults to 0.
+
+    Returns:
+        np.ndarray: [N, len(field_names)] 的点云
+    """
+    metadata, offset = parse_pcd_header(buffer)
+    point_dtype = pcd_dtype(metadata)
+    columns = _decode_pcd_columns(buffer, metadata, offset, point_dtype)
+    output = np.empty((metadata["points"], len(field_names)), dtype=dtype)
+    for i, name in enumerate(field_names):
+        if name in columns:
+            output[:, i] = columns[name]
+        elif name in REQUIRED_FIELDS:
+            raise KeyError(f"PCD has no required field {name}, available fields: {point_dtype.names}")
+        else:
+            output[:, i] = fill_value
+    return output
+
+
+def encode_pcd(pc_data, data="binary_compressed", viewpoint=(0, 0, 0, 1, 0, 0, 0)):
+    """将structured数组编码为PCD文件的内容
+
+    Args:
+        pc_data (np.ndarray): [N] structured数组,每个字段为PCD的一个字段
+        data (str, optional): ascii binary 或 binary_compressed. Defaults to "binary_compressed".
+        viewpoint (tuple, optional): PCD的 VIEWPOINT. Defaults to (0, 0, 0, 1, 0, 0, 0).
+
+    Returns:
+        bytes: PCD文件的内容
+    """
+    assert data in PCD_DATA_TYPES, f"unsupported pcd data type {data}"
+    # 去掉字段之间的padding并转换为小端
+    pc_data = recfunctions.repack_fields(pc_data.reshape(-1))
+    pc_data = pc_data.astype(pc_data.dtype.newbyteorder("<"), copy=False)
+    fields, sizes, types, counts = [], [], [], []
+    for name in pc_data.dtype.names:
+        field_dtype = pc_data.dtype.fields[name][0]
+        fields.append(name)
+        sizes.append(field_dtype.base.itemsize)
+        types.append(PCD_TYPE_CODES[field_dtype.base.kind])
+        counts.append(int(np.prod(field_dtype.shape)))
+    header = (
+        "# .PCD v0.7 - Point Cloud Data file format\n"
+        "VERSION 0.7\n"
+        f"FIELDS {' '.join(fields)}\n"
+        f"SIZE {' '.join(map(str, sizes))}\n"
+        f"TYPE {' '.join(types)}\n"
+        f"COUNT {' '.join(map(str, counts))}\n"
+        f"WIDTH {len(pc_data)}\n"
+        "HEIGHT 1\n"
+        f"VIEWPOINT {' '.join(map(str, viewpoint))}\n"
+        f"POINTS {len(pc_data)}\n"
+        f"DATA {data}\n"
+    ).encode("ascii")
+    if data == "binary":
+        return header + pc_data.tobytes()
+    if data == "binary_compressed":
+        raw = b"".join(np.ascontiguousarray(pc_data[name]).tobytes() for name in fields)
+        compressed = lzf_compress(raw)
+        return header + struct.pack("<II", len(compressed), len(raw)) + compressed
+    columns = []
+    for name, type_ in zip(fields, types):
+        column = pc_data[name].reshape(len(pc_data), -1)
+        columns.extend(np.char.mod("%.8g" if type_ == "F" else "%d", column[:, i]) for i in range(column.shape[1]))
+    lines = [" ".join(values) for values in zip(*columns)] if len(pc_data) > 0 else []
+    return header + "".join(line + "\n" for line in lines).encode("ascii")
+
+
+def write_pcd(filename, pc_data, data="binary_compressed", viewpoint=(0, 0, 0, 1, 0, 0, 0)):
+    """将structured数组保存为PCD文件,参数参考 encode_pcd"""
+    with open(filename, "wb") as f:
+        f.write(encode_pcd(pc_data, data=data, viewpoint=viewpoint))
+
+
+def pcd_to_pointcloud2(pc_data, header=None, msg_class=None, field_class=None):
+    """将PCD的structured数组转换为 PointCloud2, 可以直接输入 LoadPointsFromPointCloud2 或者发布到ros
+
+    Args:
+        pc_data (np.ndarray): [N] structured数组, 例如 read_pcd 的结果
+        header (std_msgs/Header, optional): 消息的header. Defaults to None.
+        msg_class (type, optional): sensor_msgs.msg.PointCloud2, 为None时返回 PointCloud2Data. Defaults to None.
+        field_class (type, optional): sensor_msgs.msg.PointField, 为None时使用 PointFieldData. Defaults to None.
+
+    Returns:
+        PointCloud2 | PointCloud2Data: 一行的点云消息
+    """
+    msg_class = PointCloud2Data if msg_class is None else msg_class
+    field_class = PointFieldData if field_class is None else field_class
+    pc_data = recfunctions.repack_fields(pc_data.reshape(-1))
+    pc_data = pc_data.astype(pc_data.dtype.newbyteorder("<"), copy=False)
+    fields = []
+    for name in pc_data.dtype.names:
+        field_dtype, offset = pc_data.dtype.fields[name][:2]
+        fields.append(
+            field_class(
+                name=name,
+                offset=offset,
+                datatype=POINTFIELD_DATATYPES[field_dtype.base.newbyteorder("=")],
+                count=int(np.prod(field_dtype.shape)),
+            )
+        )
+    return msg_class(
+        header=header,
+        height=1,
+        width=len(pc_data),
+        fields=fields,
+        is_bigendian=False,
+        point_step=pc_data.dtype.itemsize,
+        row_step=pc_data.dtype.itemsize * len(pc_data),
+        data=pc_data.tobytes(),
+        is_dense=False,
+    )
@@ -0,0 +1,84 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+import numpy as np
+
+# sensor_msgs/PointField 中 datatype 对应的numpy类型
+POINTFIELD_DTYPES = {
+    1: np.int8,
+    2: np.uint8,
+    3: np.int16,
+    4: np.uint16,
+    5: np.int32,
+    6: np.uint32,
+    7: np.float32,
+    8: np.float64,
+}
+
+# 所有点云都必须包含的字段
+REQUIRED_FIELDS = ("x", "y", "z")
+
+
+def pointcloud2_dtype(fields, point_step, is_bigendian=False):
+    """根据 PointCloud2 的 fields 与 point_step 构建numpy的structured dtype,
+    每个点占 point_step 个字节,字段之间的padding会被跳过
+
+    Args:
+        fields (list[PointField]): PointCloud2 的 fields
+        point_step (int): 每个点的字节数
+        is_bigendian (bool, optional): 数据是否为大端. Defaults to False.
+
+    Returns:
+        np.dtype: 每个点的structured dtype
+    """
+    byte_order = ">" if is_bigendian else "<"
+    names, formats, offsets = [], [], []
+    for field in fields:
+        dtype = np.dtype(POINTFIELD_DTYPES[field.datatype]).newbyteorder(byte_order)
+        names.append(field.name)
+        formats.append(dtype if field.count <= 1 else (dtype, (field.count,)))
+        offsets.append(field.offset)
+    return np.dtype(dict(names=names, formats=formats, offsets=offsets, itemsize=point_step))
+
+
+def pointcloud2_to_array(msg):
+    """不经过复制的将 PointCloud2 的 data 视为 [N] 的structured数组,每一行的末尾有padding时会发生一次复制
+
+    Args:
+        msg (PointCloud2): 参考 decode_pointcloud2
+
+    Returns:
+        np.ndarray: [N] structured数组,可以直接使用 write_pcd 保存
+    """
+    point_dtype = pointcloud2_dtype(msg.fields, msg.point_step, msg.is_bigendian)
+    num_points = msg.width * msg.height
+    if msg.row_step == msg.width * msg.point_step:
+        return np.frombuffer(msg.data, dtype=point_dtype, count=num_points)
+    # 每一行的末尾有padding时先去掉padding
+    data = np.frombuffer(msg.data, dtype=np.uint8, count=msg.height * msg.row_step).reshape(msg.height, -1)
+    return np.ascontiguousarray(data[:, : msg.width * msg.point_step]).view(point_dtype).reshape(-1)
+
+
+def decode_pointcloud2(msg, field_names, dtype=np.float32, fill_value=0):
+    """不经过复制的将 PointCloud2 的 data 视为structured数组,只将需要的字段一次性写入 [N, len(field_names)] 的输出中
+
+    Args:
+        msg (PointCloud2): ros1 sensor_msgs 的PointCloud2类型的点云数据,
+            也可以是包含 fields point_step row_step width height is_bigendian data 属性的任意对象
+        field_names (list[str]): 输出的每一列对应的字段名称, x y z 之外的字段在点云中不存在时填充为 fill_value
+        dtype (np.dtype, optional): 输出的类型. Defaults to np.float32.
+        fill_value (float, optional): 不存在的字段的填充值. Defaults to 0.
+
+    Returns:
+        np.ndarray: [N, len(field_names)] 的点云
+    """
+    points = pointcloud2_to_array(msg)
+    point_dtype = points.dtype
+
+    output = np.empty((len(points), len(field_names)), dtype=dtype)
+    for i, name in enumerate(field_names):
+        if name in point_dtype.names:
+            output[:, i] = points[name]
+        elif name in REQUIRED_FIELDS:
+            raise KeyError(f"PointCloud2 has no required field {name}, available fields: {point_dtype.names}")
+        else:
+            output[:, i] = fill_value
+    return output
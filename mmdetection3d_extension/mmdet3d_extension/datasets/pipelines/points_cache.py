@@ -0,0 +1,139 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+import fcntl
+import hashlib
+import os
+from contextlib import contextmanager
+from os import path as osp
+
+import numpy as np
+
+
+class SharedPointsCache(object):
+    """同一台机器上所有DataLoader worker(以及多卡训练的所有进程)共享的解码后的点云缓存
+
+    每个点云保存为 cache_dir 中的一个 .npy 文件, cache_dir 默认位于 /dev/shm (内存中的tmpfs),
+    命中时以memory-map打开并复制一次,不再读取与解码原始文件. 缓存的总字节数超过 max_bytes 时,
+    按最近一次访问的时间(文件的mtime,命中时更新)删除最久没有使用的点云,直到低于 max_bytes 的90%.
+    命中 未命中 字节数 删除次数保存在 cache_dir/stats 中,由所有进程通过文件锁共同更新.
+
+    NOTE : 缓存以点云文件的路径以及加载的配置为key,原始点云改变时需要清空 cache_dir
+
+    Args:
+        cache_dir (str, optional): 缓存的文件夹. Defaults to "/dev/shm/mmdet3d_points_cache".
+        max_bytes (int, optional): 缓存的字节上限. Defaults to 16 GB.
+    """
+
+    STAT_FIELDS = ("hits", "misses", "bytes", "evictions")
+
+    def __init__(self, cache_dir="/dev/shm/mmdet3d_points_cache", max_bytes=16 * 2**30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._pid = None
+
+    def _init_process(self):
+        # 文件锁与stats的memory-map不能跨fork使用,在每个进程中第一次使用时重新打开
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._lock_fd = os.open(osp.join(self.cache_dir, "lock"), os.O_RDWR | os.O_CREAT)
+            stats_file = osp.join(self.cache_dir, "stats")
+            with self._locked():
+                if not osp.exists(stats_file):
+                    np.zeros(len(self.STAT_FIELDS), dtype=np.int64).tofile(stats_file)
+            self._stats = np.memmap(stats_file, dtype=np.int64, mode="r+", shape=(len(self.STAT_FIELDS),))
+
+    @contextmanager
+    def _locked(self):
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _add_stats(self, **kwargs):
+        with self._locked():
+            for name, value in kwargs.items():
+                self._stats[self.STAT_FIELDS.index(name)] += value
+
+    def _path(self, key):
+        return osp.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".npy")
+
+    def get(self, key):
+        """获取缓存的点云
+
+        Args:
+            key (str): 点云的key
+
+        Returns:
+            np.ndarray | None: 可写的点云,不在缓存中时为None
+        """
+        self._init_process()
+        path = self._path(key)
+        try:
+            points = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            # 读取时可能正好被其他进程删除
+            self._add_stats(misses=1)
+            return None
+        self._add_stats(hits=1)
+        # pipeline中的数据增强会原地修改点云,所以返回一份复制
+        return np.array(points)
+
+    def put(self, key, points):
+        """将点云写入缓存,超出字节上限时删除最久没有使用的点云
+
+        Args:
+            key (str): 点云的key
+            points (np.ndarray): 解码后的点云
+        """
+        self._init_process()
+        if len(points) == 0 or points.nbytes > self.max_bytes:
+            return
+        path = self._path(key)
+        # 先写入临时文件再重命名,其他进程不会读到写了一半的文件
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, points)
+        os.replace(tmp_path, path)
+        with self._locked():
+            self._stats[self.STAT_FIELDS.index("bytes")] += osp.getsize(path)
+            if self._stats[self.STAT_FIELDS.index("bytes")] > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """在文件锁中调用,按mtime删除最早的点云,并以实际的文件大小更新字节数"""
+        entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".npy")]
+        stats = [entry.stat() for entry in entries]
+        order = np.argsort([s.st_mtime_ns for s in stats])
+        total = sum(s.st_size for s in stats)
+        num_evicted = 0
+        for i in order:
+            if total <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(entries[i].path)
+            except FileNotFoundError:
+                pass
+            total -= stats[i].st_size
+            num_evicted += 1
+        self._stats[self.STAT_FIELDS.index("bytes")] = total
+        self._stats[self.STAT_FIELDS.index("evictions")] += num_evicted
+
+    def stats(self):
+        """所有进程共享的缓存统计
+
+        Returns:
+            dict: hits misses hit_rate bytes evictions
+        """
+        self._init_process()
+        stats = dict(zip(self.STAT_FIELDS, self._stats.tolist()))
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total > 0 else 0.0
+        return stats
+
+    def __getstate__(self):
+        return dict(cache_dir=self.cache_dir, max_bytes=self.max_bytes)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
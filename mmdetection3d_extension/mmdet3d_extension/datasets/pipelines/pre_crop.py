@@ -0,0 +1,135 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+import numba
+import numpy as np
+
+
+def _angle_in_interval(lo, hi, target):
+    """判断 target + 2kπ 是否落在 [lo, hi] 中"""
+    k = np.ceil((lo - target) / (2 * np.pi))
+    return target + 2 * np.pi * k <= hi
+
+
+def _rotated_bev_bounds(x_range, y_range, max_rot):
+    """矩形 x_range x y_range 绕原点旋转 [-max_rot, max_rot] 内的任意角度后,所有结果的并集的轴对齐包围框
+
+    旋转后的矩形的包围框由四个角点决定,所以只需要计算每个角点在旋转范围内扫过的圆弧的范围
+    """
+    x_min, y_min, x_max, y_max = np.inf, np.inf, -np.inf, -np.inf
+    for x in x_range:
+        for y in y_range:
+            r, phi = np.hypot(x, y), np.arctan2(y, x)
+            lo, hi = phi - max_rot, phi + max_rot
+            xs = [r * np.cos(lo), r * np.cos(hi)]
+            ys = [r * np.sin(lo), r * np.sin(hi)]
+            if _angle_in_interval(lo, hi, 0):
+                xs.append(r)
+            if _angle_in_interval(lo, hi, np.pi):
+                xs.append(-r)
+            if _angle_in_interval(lo, hi, np.pi / 2):
+                ys.append(r)
+            if _angle_in_interval(lo, hi, -np.pi / 2):
+                ys.append(-r)
+            x_min, x_max = min(x_min, *xs), max(x_max, *xs)
+            y_min, y_max = min(y_min, *ys), max(y_max, *ys)
+    return x_min, y_min, x_max, y_max
+
+
+def get_pre_crop_range(
+    point_cloud_range,
+    rot_range=(0.0, 0.0),
+    scale_ratio_range=(1.0, 1.0),
+    translation_std=(0.0, 0.0, 0.0),
+    flip_ratio_bev_horizontal=0.0,
+    flip_ratio_bev_vertical=0.0,
+    translation_sigma=3.0,
+    margin=0.01,
+):
+    """计算加载点云时保守的预裁剪范围
+
+    训练时点云依次经过 GlobalRotScaleTrans (先旋转,再缩放,最后平移) RandomFlip3D 与 PointsRangeFilter,
+    这里将 point_cloud_range 依次经过翻转 平移 缩放 旋转的逆变换,得到所有可能的增强参数下
+    最终会落在 point_cloud_range 中的点在原始点云中的范围,范围外的点在加载时就可以丢弃.
+    参数与对应的 GlobalRotScaleTrans 以及 RandomFlip3D 的配置相同
+
+    Args:
+        point_cloud_range (list[float]): PointsRangeFilter 的范围 [x_min, y_min, z_min, x_max, y_max, z_max]
+        rot_range (list[float], optional): 旋转角度的范围. Defaults to (0.0, 0.0).
+        scale_ratio_range (list[float], optional): 缩放比例的范围. Defaults to (1.0, 1.0).
+        translation_std (list[float], optional): 平移的标准差. Defaults to (0.0, 0.0, 0.0).
+        flip_ratio_bev_horizontal (float, optional): 沿y翻转的概率. Defaults to 0.0.
+        flip_ratio_bev_vertical (float, optional): 沿x翻转的概率. Defaults to 0.0.
+        translation_sigma (float, optional): 平移为正态分布,按 translation_sigma 倍的标准差扩大范围.
+            Defaults to 3.0.
+        margin (float, optional): 额外扩大的距离,单位为m. Defaults to 0.01.
+
+    Returns:
+        np.ndarray: [6] 预裁剪的范围 [x_min, y_min, z_min, x_max, y_max, z_max]
+    """
+    lower, upper = np.array(point_cloud_range[:3], dtype=np.float64), np.array(point_cloud_range[3:], dtype=np.float64)
+    # RandomFlip3D: horizontal 翻转y, vertical 翻转x
+    for dim, flip_ratio in ((1, flip_ratio_bev_horizontal), (0, flip_ratio_bev_vertical)):
+        if flip_ratio > 0:
+            lower[dim], upper[dim] = min(lower[dim], -upper[dim]), max(upper[dim], -lower[dim])
+    # 平移
+    pad = translation_sigma * np.abs(np.array(translation_std, dtype=np.float64))
+    lower, upper = lower - pad, upper + pad
+    # 缩放, 取最小与最大的缩放比例下的并集
+    scales = np.array([min(scale_ratio_range), max(scale_ratio_range)], dtype=np.float64)
+    lower, upper = np.minimum(lower / scales[0], lower / scales[1]), np.maximum(upper / scales[0], upper / scales[1])
+    # 旋转只影响 x y, 旋转方向与 rot_range 的符号无关地取对称的范围
+    max_rot = np.abs(rot_range).max()
+    if max_rot > 0:
+        x_min, y_min, x_max, y_max = _rotated_bev_bounds((lower[0], upper[0]), (lower[1], upper[1]), max_rot)
+        lower[:2], upper[:2] = (x_min, y_min), (x_max, y_max)
+    return np.concatenate([lower - margin, upper + margin]).astype(np.float32)
+
+
+def pre_crop_mask(points, crop_range):
+    """点云中落在预裁剪范围内的点
+
+    Args:
+        points (np.ndarray): [N, C] 点云, 前3维为 x y z
+        crop_range (np.ndarray): [6] get_pre_crop_range 的结果
+
+    Returns:
+        np.ndarray: [N] bool
+    """
+    mask = (points[:, 0] >= crop_range[0]) & (points[:, 0] <= crop_range[3])
+    mask &= (points[:, 1] >= crop_range[1]) & (points[:, 1] <= crop_range[4])
+    mask &= (points[:, 2] >= crop_range[2]) & (points[:, 2] <= crop_range[5])
+    return mask
+
+
+@numba.jit(nopython=True)
+def _pre_crop_gather_kernel(points, crop_range, use_dim, output):
+    num_dims = points.shape[1]
+    count = 0
+    for i in range(points.shape[0]):
+        x, y, z = points[i, 0], points[i, 1], points[i, 2]
+        if x < crop_range[0] or y < crop_range[1] or z < crop_range[2]:
+            continue
+        if x > crop_range[3] or y > crop_range[4] or z > crop_range[5]:
+            continue
+        for j in range(use_dim.shape[0]):
+            output[count, j] = points[i, use_dim[j]] if use_dim[j] < num_dims else 0
+        count += 1
+    return count
+
+
+def pre_crop_points(points, crop_range, use_dim=None):
+    """丢弃预裁剪范围外的点,同时只保留 use_dim 对应的维度,一次遍历点云直接写入float32的输出中
+
+    NOTE : 与先计算mask再 np.compress 相比不需要多次遍历点云, 二维数组的bool索引 points[mask] 更慢
+
+    Args:
+        points (np.ndarray): [N, C] 点云, 前3维为 x y z, 可以是只读的memory-map
+        crop_range (np.ndarray): [6] get_pre_crop_range 的结果
+        use_dim (list[int], optional): 保留的维度,不小于C的维度填充为0. Defaults to None, 保留全部维度.
+
+    Returns:
+        np.ndarray: [M, len(use_dim)] float32 预裁剪范围内的点
+    """
+    use_dim = np.arange(points.shape[1]) if use_dim is None else np.asarray(use_dim, dtype=np.int64)
+    output = np.empty((points.shape[0], len(use_dim)), dtype=np.float32)
+    count = _pre_crop_gather_kernel(points, np.asarray(crop_range, dtype=np.float32), use_dim, output)
+    return output[:count]
@@ -0,0 +1,89 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+import struct
+
+import numpy as np
+
+# 量化点云文件 .qbin 的格式:
+#   header: magic(4s) num_points(uint32) xyz_bytes(uint8) has_ring(uint8) padding(2) resolution(float32)
+#           intensity_scale(float32)
+#   body:   x y z (int16 或 int32, 每个维度连续存储 num_points 个值), intensity (uint8), ring (uint8, 可选)
+# 解码后 x y z = 量化值 * resolution, intensity = 量化值 * intensity_scale
+QUANTIZED_MAGIC = b"QPC1"
+QUANTIZED_HEADER = struct.Struct("<4sIBB2xff")
+
+
+def encode_quantized_points(points, resolution=0.005, with_ring=False, xyz_dtype=None):
+    """将 [N, C] 的点云编码为量化的格式, xyz为定点数, intensity 与 ring 为uint8
+
+    Args:
+        points (np.ndarray): [N, C] 点云, 维度依次为 x y z intensity (ring)
+        resolution (float, optional): xyz的量化精度,单位为m. Defaults to 0.005.
+        with_ring (bool, optional): 是否保存ring,需要 C >= 5. Defaults to False.
+        xyz_dtype (str, optional): xyz的存储类型, int16 或 int32. Defaults to None,
+            xyz的范围在int16内时使用int16,否则使用int32.
+
+    Returns:
+        bytes: 编码后的数据
+    """
+    points = np.asarray(points, dtype=np.float32)
+    assert points.ndim == 2 and points.shape[1] >= (5 if with_ring else 4), f"invalid points shape {points.shape}"
+    xyz = np.round(points[:, :3] / resolution)
+    if xyz_dtype is None:
+        xyz_dtype = np.int16 if len(xyz) == 0 or np.abs(xyz).max() <= np.iinfo(np.int16).max else np.int32
+    xyz_dtype = np.dtype(xyz_dtype)
+    info = np.iinfo(xyz_dtype)
+    assert len(xyz) == 0 or (
+        xyz.min() >= info.min and xyz.max() <= info.max
+    ), f"points out of the {xyz_dtype} range at resolution {resolution}"
+
+    intensity = np.maximum(points[:, 3], 0)
+    intensity_scale = float(intensity.max()) / 255 if len(intensity) > 0 and intensity.max() > 0 else 1.0
+    header = QUANTIZED_HEADER.pack(
+        QUANTIZED_MAGIC, len(points), xyz_dtype.itemsize, int(with_ring), resolution, intensity_scale
+    )
+    body = [
+        np.ascontiguousarray(xyz.T).astype(xyz_dtype).tobytes(),
+        np.round(intensity / np.float32(intensity_scale)).clip(0, 255).astype(np.uint8).tobytes(),
+    ]
+    if with_ring:
+        body.append(points[:, 4].clip(0, 255).astype(np.uint8).tobytes())
+    return header + b"".join(body)
+
+
+def decode_quantized_points(buffer, use_dim, dtype=np.float32):
+    """将量化的点云解码为 [N, len(use_dim)] 的点云,只解码 use_dim 中的维度,直接写入预先分配的输出中
+
+    维度的顺序与原始的 .bin 相同: 0 1 2 为 x y z, 3 为 intensity, 4 为 ring,
+    文件中不存在的维度(没有保存的ring以及超出的维度)填充为0
+
+    Args:
+        buffer (bytes | np.ndarray): encode_quantized_points 编码得到的数据,也可以是memory-map
+        use_dim (list[int]): 需要的维度
+        dtype (np.dtype, optional): 输出的类型. Defaults to np.float32.
+
+    Returns:
+        np.ndarray: [N, len(use_dim)] 的点云
+    """
+    buffer = np.frombuffer(buffer, dtype=np.uint8)
+    magic, num_points, xyz_bytes, has_ring, resolution, intensity_scale = QUANTIZED_HEADER.unpack_from(buffer)
+    assert magic == QUANTIZED_MAGIC, "not a quantized point cloud"
+    xyz_dtype = np.dtype(f"<i{xyz_bytes}")
+    offset = QUANTIZED_HEADER.size
+    xyz = np.frombuffer(buffer, dtype=xyz_dtype, count=3 * num_points, offset=offset).reshape(3, num_points)
+    offset += 3 * num_points * xyz_bytes
+    # 每个uint8的维度及其缩放比例
+    uint8_dims = {3: (buffer[offset : offset + num_points], intensity_scale)}
+    if has_ring:
+        uint8_dims[4] = (buffer[offset + num_points : offset + 2 * num_points], 1.0)
+
+    dtype = np.dtype(dtype)
+    output = np.empty((num_points, len(use_dim)), dtype=dtype)
+    for i, dim in enumerate(use_dim):
+        if dim < 3:
+            np.multiply(xyz[dim], dtype.type(resolution), out=output[:, i])
+        elif dim in uint8_dims:
+            values, scale = uint8_dims[dim]
+            np.multiply(values, dtype.type(scale), out=output[:, i])
+        else:
+            output[:, i] = 0
+    return output
@@ -0,0 +1,113 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+import os
+import time
+from collections import OrderedDict
+from concurrent import futures
+
+from mmcv.fileio import BaseStorageBackend, FileClient
+
+
+@FileClient.register_backend("prefetch")
+class PrefetchBackend(BaseStorageBackend):
+    """带有预读的存储后端,通过 file_client_args=dict(backend="prefetch", backend_args=...) 使用
+
+    prefetch 提交的文件由一个小的线程池提前读取到有字节上限的缓存中,之后 get 直接从缓存中取出,
+    不在缓存中的文件由 backend_args 对应的后端同步读取. 每个文件预读一次只会被 get 使用一次.
+    USDDataset 的 prefetch_num 大于0时,在读取每个样本之前对之后的样本调用 prefetch
+
+    同时读取的文件数量不超过 max_inflight, 缓存已满时不再提交新的预读, 被跳过的文件在之后的 prefetch 中重新提交,
+    所以缓存占用的内存不超过 max_cache_bytes 加上 max_inflight 个文件的大小
+
+    Args:
+        backend_args (dict, optional): 实际读取文件的后端. Defaults to dict(backend="disk").
+        num_threads (int, optional): 预读的线程数. Defaults to 4.
+        max_cache_bytes (int, optional): 缓存的字节上限,超出时丢弃最晚提交的预读. Defaults to 256 MB.
+        max_inflight (int, optional): 最多同时读取的文件数量. Defaults to None, 与 num_threads 相同.
+    """
+
+    def __init__(
+        self, backend_args=dict(backend="disk"), num_threads=4, max_cache_bytes=256 * 2**20, max_inflight=None
+    ):
+        self.backend_args = backend_args.copy()
+        self.num_threads = num_threads
+        self.max_cache_bytes = max_cache_bytes
+        self.max_inflight = num_threads if max_inflight is None else max_inflight
+        self.client = FileClient(**self.backend_args)
+        self._pid = None
+        self.reset_stats()
+
+    def _init_executor(self):
+        # 线程池不能跨fork使用,在每个DataLoader worker中第一次使用时重新创建
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = futures.ThreadPoolExecutor(self.num_threads)
+            # filepath -> Future, 按提交的顺序排列, 只在worker的主线程中访问
+            self._cache = OrderedDict()
+
+    def _cache_bytes(self):
+        return sum(len(f.result()) for f in self._cache.values() if f.done() and f.exception() is None)
+
+    def _num_inflight(self):
+        return sum(not f.done() for f in self._cache.values())
+
+    def prefetch(self, filepaths):
+        """提交需要预读的文件,已经在缓存中的文件会被跳过
+
+        Args:
+            filepaths (list[str]): 之后将要读取的文件
+        """
+        self._init_executor()
+        # 最早提交的预读是接下来 get 需要的文件,超出字节上限时从最晚提交的一端丢弃,至少保留最早的一个
+        while len(self._cache) > 1 and self._cache_bytes() > self.max_cache_bytes:
+            self._cache.popitem(last=True)[1].cancel()
+            self.num_evicted += 1
+        for filepath in filepaths:
+            if filepath in self._cache:
+                continue
+            # 同时读取的文件达到上限或者缓存已满时停止提交,剩下的文件在之后的 prefetch 中重新提交
+            if self._num_inflight() >= self.max_inflight or self._cache_bytes() >= self.max_cache_bytes:
+                break
+            self._cache[filepath] = self._executor.submit(self.client.get, filepath)
+
+    def get(self, filepath):
+        """读取文件,在缓存中时为命中,还没有读取完成时等待的时间计入 stall_time"""
+        self._init_executor()
+        if filepath not in self._cache:
+            self.num_misses += 1
+            return self.client.get(filepath)
+        future = self._cache[filepath]
+        self.num_hits += 1
+        if not future.done():
+            start = time.perf_counter()
+            futures.wait([future])
+            self.stall_time += time.perf_counter() - start
+        del self._cache[filepath]
+        return future.result()
+
+    def get_text(self, filepath, encoding="utf-8"):
+        return self.client.get_text(filepath, encoding=encoding)
+
+    def get_local_path(self, filepath):
+        return self.client.get_local_path(filepath)
+
+    def reset_stats(self):
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_evicted = 0
+        self.stall_time = 0.0
+
+    def stats(self):
+        """当前进程中的预读统计
+
+        Returns:
+            dict: hits misses hit_rate evicted stall_time(s) cache_bytes
+        """
+        total = self.num_hits + self.num_misses
+        return dict(
+            hits=self.num_hits,
+            misses=self.num_misses,
+            hit_rate=self.num_hits / total if total > 0 else 0.0,
+            evicted=self.num_evicted,
+            stall_time=self.stall_time,
+            cache_bytes=self._cache_bytes() if self._pid == os.getpid() else 0,
+        )
@@ -0,0 +1,135 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+import json
+import os
+from os import path as osp
+
+import numpy as np
+
+# 列式标注格式的版本,格式改变时需要修改
+USD_COLUMNAR_VERSION = 1
+
+# 每一帧一个值的字段
+FRAME_FIELDS = ("scene_name", "seq", "file_name", "box_type_3d")
+# 每一个object一个值的字段,第i帧的object为 [offsets[i], offsets[i+1])
+OBJECT_FIELDS = ("class_names", "track_ids", "bbox2d", "bbox3d", "truncated", "occluded", "num_points_in_gt")
+
+
+def is_usd_columnar_infos(path):
+    """判断path是否为 dump_usd_columnar_infos 保存的列式标注"""
+    return osp.isdir(path) and osp.isfile(osp.join(path, "meta.json"))
+
+
+def dump_usd_columnar_infos(infos, out_dir):
+    """将 usd_infos_xxx.pkl 格式的标注(list[dict])保存为列式的标注,每个字段保存为一个 .npy 文件,
+    读取时可以直接memory-map,多个DataLoader worker之间共享同一份物理内存
+
+    保存的格式:
+    out_dir/
+        meta.json  # 版本 帧数 object数量
+        offsets.npy  # [num_frames + 1] int64, 第i帧的object为 [offsets[i], offsets[i+1])
+        scene_name.npy seq.npy file_name.npy box_type_3d.npy  # [num_frames] 定长字符串
+        class_names.npy track_ids.npy  # [M] 定长字符串
+        bbox2d.npy  # [M, 4] int32
+        bbox3d.npy  # [M, box_dim] float32
+        truncated.npy occluded.npy num_points_in_gt.npy  # [M]
+
+    NOTE : 只保存 USDDataset 用到的 LIDAR 的信息, images 与 calib 暂时没有保存
+
+    Args:
+        infos (list[dict]): usd_infos_xxx.pkl 格式的标注
+        out_dir (str): 保存的文件夹
+    """
+    frames = {k: [] for k in FRAME_FIELDS}
+    objects = {k: [] for k in OBJECT_FIELDS}
+    sizes = np.zeros((len(infos),), dtype=np.int64)
+    for i, info in enumerate(infos):
+        lidar_info = info["point_clouds"]["LIDAR"]
+        annos = lidar_info["annos"]
+        sizes[i] = len(annos["class_names"])
+        frames["scene_name"].append(info["scene_name"])
+        frames["seq"].append(info["seq"])
+        frames["file_name"].append(lidar_info["file_name"])
+        frames["box_type_3d"].append(annos["box_type_3d"])
+        for k in OBJECT_FIELDS:
+            objects[k].append(np.asarray(annos[k]))
+
+    # 没有object的帧的数组可能是一维的空数组,直接跳过,二维字段的维度以有object的帧为准
+    columns = dict()
+    for k, values in objects.items():
+        values = [v.reshape(size, -1) if v.ndim > 1 else v for v, size in zip(values, sizes) if size]
+        if len(values) > 0:
+            columns[k] = np.concatenate(values)
+        else:
+            columns[k] = np.zeros((0,) + dict(bbox2d=(4,), bbox3d=(7,)).get(k, ()))
+    for k in ("class_names", "track_ids"):
+        columns[k] = columns[k].astype(str)
+    columns["bbox2d"] = columns["bbox2d"].astype(np.int32)
+    columns["bbox3d"] = columns["bbox3d"].astype(np.float32)
+    for k in ("truncated", "occluded", "num_points_in_gt"):
+        columns[k] = columns[k].astype(np.int32)
+    for k, values in frames.items():
+        columns[k] = np.array(values, dtype=str).reshape(-1)
+    columns["offsets"] = np.zeros((len(infos) + 1,), dtype=np.int64)
+    np.cumsum(sizes, out=columns["offsets"][1:])
+
+    os.makedirs(out_dir, exist_ok=True)
+    for k, v in columns.items():
+        np.save(osp.join(out_dir, f"{k}.npy"), v)
+    # meta.json 最后写入,作为保存完成的标志
+    with open(osp.join(out_dir, "meta.json"), "w") as f:
+        json.dump(dict(version=USD_COLUMNAR_VERSION, num_frames=len(infos), num_objects=int(sizes.sum())), f)
+
+
+class USDColumnarInfos(object):
+    """以memory-map方式读取 dump_usd_columnar_infos 保存的列式标注,可以替代 usd_infos_xxx.pkl 读取得到的 list[dict]
+
+    所有字段都以只读的memory-map打开,不会被读入每个进程的内存,多个DataLoader worker共享同一份物理内存,
+    也不会因为引用计数的修改而触发copy-on-write. 通过index获取的每一帧与pkl中的dict结构相同,
+    其中object的字段都是memory-map的切片,不会发生复制
+
+    Args:
+        path (str): dump_usd_columnar_infos 保存的文件夹
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(osp.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        assert (
+            meta["version"] == USD_COLUMNAR_VERSION
+        ), f"unsupported columnar infos version {meta['version']}, please regenerate {path}"
+        for k in FRAME_FIELDS + OBJECT_FIELDS + ("offsets",):
+            setattr(self, k, np.load(osp.join(path, f"{k}.npy"), mmap_mode="r"))
+
+    def __getstate__(self):
+        # 以spawn方式启动的worker中重新打开memory-map,而不是将数组序列化
+        return dict(path=self.path)
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        """获取一帧的标注,结构与 usd_infos_xxx.pkl 中的一帧相同"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"index {index} out of range for {len(self)} frames")
+        start, end = self.offsets[index], self.offsets[index + 1]
+        annos = {k: getattr(self, k)[start:end] for k in OBJECT_FIELDS}
+        annos["box_type_3d"] = str(self.box_type_3d[index])
+        return {
+            "scene_name": str(self.scene_name[index]),
+            "seq": str(self.seq[index]),
+            "images": None,
+            "point_clouds": {
+                "LIDAR": {
+                    "frame_id": "LIDAR",
+                    "file_name": str(self.file_name[index]),
+                    "annos": annos,
+                },
+            },
+            "calib": None,
+        }
@@ -1,18 +1,27 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+import os
 import tempfile
 import warnings
+from concurrent import futures
 from os import path as osp
 
 import mmcv
 import numpy as np
+import torch
 from torch.utils.data import Dataset
 from mmcv.utils import print_log
 
 from mmdet3d.core.bbox import get_box_type
 from mmdet3d.datasets.builder import DATASETS
-from mmdet3d.datasets.pipelines import Compose
+from mmdet3d.datasets.pipelines import Compose, LoadPointsFromMultiSweeps
 from mmdet3d.datasets.utils import extract_result_dict, get_loading_pipeline
 
+from .pipelines.pcd import parse_pcd_header
+from .pipelines.quantized_points import QUANTIZED_HEADER, QUANTIZED_MAGIC
+from .usd_columnar_infos import USDColumnarInfos, is_usd_columnar_infos
+from .usd_sharded_infos import USD_SHARDED_INFOS_INDEX_FILE, USDShardedInfos, is_usd_sharded_infos
+from .usd_shards import USD_SHARD_INDEX_FILE, USDShardIndex, check_usd_shard_payload_format, get_usd_sample_key
+
 
 @DATASETS.register_module()
 class USDDataset(Dataset):
@@ -68,7 +77,8 @@ class USDDataset(Dataset):
 
     Args:
         data_root (str): Path of dataset root.
-        ann_file (str): Path of annotation file.
+        ann_file (str): Path of annotation file. 也可以是 dump_usd_columnar_infos 保存的列式标注的文件夹,
+            此时以memory-map的方式读取; 或者是 USDShardedInfosWriter 保存的分片标注的文件夹,此时按需读取每个分片.
         pipeline (list[dict], optional): Pipeline used for data processing.
             Defaults to None.
         classes (tuple[str], optional): Classes used in the dataset.
@@ -87,8 +97,32 @@ class USDDataset(Dataset):
             Defaults to True.
         test_mode (bool, optional): Whether the dataset is in test mode.
             Defaults to False.
+        gt_table_cache (bool, optional): 是否将列式的gt表保存在标注文件旁边,下次初始化时直接读取.
+            Defaults to False.
+        sample_index_cache (bool, optional): 是否将初始化时扫描得到的样本索引(点云文件大小 点的数量 gt数量)
+            保存在标注文件旁边,下次初始化时直接读取. 点云文件有增删时需要删除该缓存,
+            使用 pts_shard_dir 时重新生成shard后缓存自动失效. Defaults to False.
+        pts_load_dim (int, optional): .bin 点云文件中每个点的维度,用于由文件大小计算点的数量,
+            pipeline 中的加载步骤替换了点云文件的后缀(file_suffix, 例如 .qbin .pcd)时,
+            扫描替换后的文件,点的数量从文件的header中读取. Defaults to 4.
+        scan_workers (int, optional): 初始化时并行扫描点云文件的线程数. Defaults to 16.
+        point_buckets (int | list[int], optional): 训练时按点云中点的数量将样本分组,
+            GroupSampler/DistributedGroupSampler 的每个batch只包含同一组的样本.
+            为int时按点的数量的分位数分为样本数量大致相同的若干组,为list时为各组点数的分界.
+            Defaults to 1, 所有样本为同一组.
+        pts_shard_dir (str, optional): usd_converter.create_usd_shards 生成的点云shard所在的文件夹.
+            设置时点云从shard中按位置读取(results 中的 pts_shard),初始化时也不再扫描点云文件,
+            shard中的样本与 data_infos 的顺序相同,按顺序遍历时对shard文件是连续的读取. Defaults to None.
+        prefetch_num (int, optional): DataLoader 的worker获取一个batch时,在读取每个样本之前预读该batch中
+            之后的 prefetch_num 个样本的点云(包括sweeps),只对 file_client_args 的backend为 prefetch
+            (PrefetchBackend) 的加载步骤生效, 需要torch>=2.0 的 __getitems__. Defaults to 0, 不预读.
     """
 
+    # gt表缓存文件的版本,gt表的格式改变时需要修改
+    GT_TABLE_VERSION = 2
+    # 样本索引缓存文件的版本,样本索引的格式改变时需要修改
+    SAMPLE_INDEX_VERSION = 2
+
     def __init__(
         self,
         data_root,
@@ -100,6 +134,13 @@ class USDDataset(Dataset):
         filter_empty_gt=True,
         test_mode=False,
         file_client_args=dict(backend="disk"),
+        gt_table_cache=False,
+        sample_index_cache=False,
+        pts_load_dim=4,
+        scan_workers=16,
+        point_buckets=1,
+        pts_shard_dir=None,
+        prefetch_num=0,
     ):
         super().__init__()
         self.data_root = data_root
@@ -114,7 +155,13 @@ class USDDataset(Dataset):
         self.cat2id = {name: i for i, name in enumerate(self.CLASSES)}
 
         # load annotations
-        if hasattr(self.file_client, "get_local_path"):
+        if is_usd_columnar_infos(self.ann_file):
+            # 列式的标注以memory-map的方式读取,多个worker之间共享内存
+            self.data_infos = USDColumnarInfos(self.ann_file)
+        elif is_usd_sharded_infos(self.ann_file):
+            # 分片的标注按需读取每个分片
+            self.data_infos = self.load_annotations(self.ann_file)
+        elif hasattr(self.file_client, "get_local_path"):
             with self.file_client.get_local_path(self.ann_file) as local_path:
                 self.data_infos = self.load_annotations(open(local_path, "rb"))
         else:
@@ -126,11 +173,55 @@ class USDDataset(Dataset):
             )
             self.data_infos = self.load_annotations(self.ann_file)
 
+        # 初始化时一次性构建列式的gt表,get_data_info 以及每次 evaluate 都复用该表
+        self.gt_table = self._load_cached_arrays(
+            "gt_table", self._build_gt_table, gt_table_cache, [self.GT_TABLE_VERSION, self.box_mode_3d.name]
+        )
+
+        # 初始化时一次性扫描所有的点云文件,得到可用的样本,之后 __len__ sampler 以及 get_data_info 都不再访问文件系统
+        self.pts_load_dim = pts_load_dim
+        self.scan_workers = scan_workers
+        self.pts_shard_dir = pts_shard_dir
+        if self.pts_shard_dir is not None:
+            # 每一帧在shard索引中的位置,不在shard中的帧为-1
+            self.pts_shards = USDShardIndex(self.pts_shard_dir)
+            self.pts_shard_rows = self.pts_shards.lookup([get_usd_sample_key(raw_info) for raw_info in self.data_infos])
+
         # process pipeline
+        self.pts_file_suffix = None
         if pipeline is not None:
             self.pipeline = Compose(pipeline)
+            for transform in self.pipeline.transforms:
+                if not hasattr(transform, "SHARD_PAYLOAD_FORMAT"):
+                    continue
+                # 加载步骤实际读取的点云文件的后缀,扫描时需要读取相同的文件
+                self.pts_file_suffix = getattr(transform, "file_suffix", None)
+                if self.pts_shard_dir is not None:
+                    # 初始化时检查加载步骤与shard的格式是否一致,而不是在worker中解码出错误的点云
+                    check_usd_shard_payload_format(
+                        self.pts_shards.payload_format, transform.SHARD_PAYLOAD_FORMAT, self.pts_shard_dir
+                    )
+
+        sample_index_key = [
+            self.SAMPLE_INDEX_VERSION,
+            self.data_root,
+            self.pts_load_dim,
+            self.pts_shard_dir,
+            self.pts_file_suffix,
+        ]
+        if self.pts_shard_dir is not None:
+            # shard原地重新生成时 shard_index.npz 的大小与mtime会改变,缓存随之失效
+            shard_index_stat = os.stat(osp.join(self.pts_shard_dir, USD_SHARD_INDEX_FILE))
+            sample_index_key += [shard_index_stat.st_size, shard_index_stat.st_mtime_ns]
+        self.sample_index = self._load_cached_arrays(
+            "sample_index", self._scan_samples, sample_index_cache, sample_index_key
+        )
+        self.sample_indices = self._get_sample_indices()
+
+        self.prefetch_num = prefetch_num
 
         # set group flag for the samplers
+        self.point_buckets = point_buckets
         if not self.test_mode:
             self._set_group_flag()
 
@@ -138,20 +229,246 @@ class USDDataset(Dataset):
         """Load annotations from ann_file.
 
         Args:
-            ann_file (str): Path of the annotation file.
+            ann_file (str): Path of the annotation file. 也可以是 USDShardedInfosWriter 保存的分片标注的文件夹.
 
         Returns:
-            list[dict]: List of annotations.
+            list[dict] | USDShardedInfos: List of annotations. 分片标注时为按需读取分片的 USDShardedInfos.
         """
+        if isinstance(ann_file, str) and is_usd_sharded_infos(ann_file):
+            return USDShardedInfos(ann_file)
         # loading data from a file-like object needs file format
         return mmcv.load(ann_file, file_format="pkl")
 
+    def _load_cached_arrays(self, name, build_func, use_cache=False, key=()):
+        """获取由标注文件得到的一组数组,如果 use_cache 为True,优先读取标注文件旁边的缓存,缓存无效时重新构建并保存
+
+        Args:
+            name (str): 缓存的名称,缓存文件为 {ann_file}_{name}.npz
+            build_func (callable): 构建数组的函数,返回 dict[str, np.ndarray]
+            use_cache (bool, optional): 是否使用缓存文件. Defaults to False.
+            key (list, optional): 缓存有效性的其他判断条件,例如版本. Defaults to ().
+
+        Returns:
+            dict[str, np.ndarray]: build_func 的返回值
+        """
+        # 只有本地的标注文件才能缓存,并通过标注文件的 size 与 mtime 判断缓存是否有效,
+        # 列式的标注以最后写入的 meta.json 为准, 分片的标注以最后写入的 index.json 为准
+        if is_usd_columnar_infos(self.ann_file):
+            ann_path = self.ann_file.rstrip("/")
+            stat_file = osp.join(ann_path, "meta.json")
+        elif is_usd_sharded_infos(self.ann_file):
+            ann_path = self.ann_file.rstrip("/")
+            stat_file = osp.join(ann_path, USD_SHARDED_INFOS_INDEX_FILE)
+        else:
+            ann_path = osp.splitext(self.ann_file)[0]
+            stat_file = self.ann_file
+        if not use_cache or not osp.isfile(stat_file):
+            return build_func()
+        cache_file = f"{ann_path}_{name}.npz"
+        stat = os.stat(stat_file)
+        key = np.array([str(stat.st_size), str(stat.st_mtime_ns)] + [str(k) for k in key] + list(self.CLASSES))
+        if osp.isfile(cache_file):
+            with np.load(cache_file) as cache:
+                if np.array_equal(cache["key"], key):
+                    return {k: cache[k] for k in cache.files if k != "key"}
+        arrays = build_func()
+        np.savez(cache_file, key=key, **arrays)
+        return arrays
+
+    def _get_pts_filename(self, raw_info):
+        """点云文件的路径"""
+        return osp.join(self.data_root, raw_info["scene_name"], "LIDAR", raw_info["point_clouds"]["LIDAR"]["file_name"])
+
+    def _get_pts_info(self, index):
+        """get_data_info 中与点云加载相关的字段, prefetch 也使用这些字段得到需要预读的文件
+
+        Args:
+            index (int): 数据在 data_infos 中的index
+
+        Returns:
+            dict: pts_filename pts_shard sweeps
+        """
+        raw_info = self.data_infos[index]
+        # 点云在shard中的位置 (shard_path, offset, length), 不使用shard或者不在shard中的帧(只会出现在test时)为None
+        pts_shard = None
+        if self.pts_shard_dir is not None and self.pts_shard_rows[index] >= 0:
+            pts_shard = self.pts_shards.get(self.pts_shard_rows[index])
+        return {
+            "pts_filename": self._get_pts_filename(raw_info),
+            "pts_shard": pts_shard,
+            "sweeps": [],
+        }
+
+    def _scan_samples(self):
+        """并行的获取所有点云文件的大小与点的数量,以及每一帧中属于 CLASSES 的gt的数量,
+        使用shard时点云的大小与点的数量直接从shard索引中获取
+
+        .bin 的点的数量由文件大小计算, .qbin 与 .pcd 只读取文件的header,从中获取点的数量
+
+        Returns:
+            dict:
+                - file_size (np.ndarray): [num_frames] int64, 点云文件的字节数,文件不存在时为-1
+                - num_points (np.ndarray): [num_frames] int64, 点云中点的数量,文件不存在时为0
+                - num_gt (np.ndarray): [num_frames] int64, 属于 CLASSES 的gt的数量
+        """
+
+        def get_file_stat(pts_filename):
+            try:
+                file_size = os.stat(pts_filename).st_size
+            except OSError:
+                return -1, 0
+            if pts_filename.endswith(".qbin"):
+                with open(pts_filename, "rb") as f:
+                    magic, num_points = QUANTIZED_HEADER.unpack(f.read(QUANTIZED_HEADER.size))[:2]
+                assert magic == QUANTIZED_MAGIC, f"{pts_filename} is not a quantized point cloud"
+                return file_size, num_points
+            if pts_filename.endswith(".pcd"):
+                # header只有十几行,4096字节足够包含完整的header
+                with open(pts_filename, "rb") as f:
+                    metadata, _ = parse_pcd_header(f.read(4096))
+                return file_size, metadata["points"]
+            return file_size, file_size // (4 * self.pts_load_dim)
+
+        if self.pts_shard_dir is not None:
+            in_shard = self.pts_shard_rows >= 0
+            rows = self.pts_shard_rows[in_shard]
+            file_size = np.full(len(self.pts_shard_rows), -1, dtype=np.int64)
+            file_size[in_shard] = self.pts_shards.lengths[rows]
+            num_points = np.zeros(len(self.pts_shard_rows), dtype=np.int64)
+            num_points[in_shard] = self.pts_shards.num_points[rows]
+        else:
+            pts_filenames = [self._get_pts_filename(raw_info) for raw_info in self.data_infos]
+            if self.pts_file_suffix is not None:
+                pts_filenames = [osp.splitext(f)[0] + self.pts_file_suffix for f in pts_filenames]
+            print(f"Scanning {len(pts_filenames)} point cloud files")
+            with futures.ThreadPoolExecutor(self.scan_workers) as executor:
+                file_stats = np.array(list(executor.map(get_file_stat, pts_filenames)), dtype=np.int64).reshape(-1, 2)
+            file_size, num_points = file_stats[:, 0], file_stats[:, 1]
+
+        offsets = self.gt_table["offsets"]
+        frame_of_gt = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        valid_gt = self.gt_table["columns"][:, 8] != -1
+        return dict(
+            file_size=file_size,
+            num_points=num_points,
+            num_gt=np.bincount(frame_of_gt[valid_gt], minlength=len(offsets) - 1).astype(np.int64),
+        )
+
+    def _get_sample_indices(self):
+        """根据样本索引得到实际使用的样本在 data_infos 中的index
+
+        训练时跳过点云文件不存在或者为空的样本,filter_empty_gt 为True时也跳过没有属于 CLASSES 的gt的样本,
+        test时需要与 data_infos 一一对应,所以使用全部的样本
+
+        Returns:
+            np.ndarray: [num_samples] int64
+        """
+        missing = self.sample_index["file_size"] < 0
+        if missing.any():
+            warnings.warn(f"{missing.sum()} point cloud files of {self.ann_file} are missing")
+        if self.test_mode:
+            return np.arange(len(self.data_infos), dtype=np.int64)
+        valid = self.sample_index["num_points"] > 0
+        if self.filter_empty_gt:
+            valid &= self.sample_index["num_gt"] > 0
+        return np.flatnonzero(valid).astype(np.int64)
+
+    def _build_gt_table(self):
+        """将所有帧的gt转换为一个列式的表,box已经转换为 box_mode_3d,类别名称已经转换为label
+
+        Returns:
+            dict:
+                - columns (np.ndarray): [M, 9] float32, x y z x_size y_size z_size yaw score(0) label
+                - box_extras (np.ndarray): [M, box_dim - 7] float32, box中yaw之后的维度(例如速度)
+                - offsets (np.ndarray): [num_frames + 1] int64, 第i帧的gt为 columns[offsets[i]:offsets[i+1]]
+                - num_points_in_gt (np.ndarray): [M,] 用于eval时按难度过滤gt
+                - occluded (np.ndarray): [M,] 用于eval时按难度过滤gt
+        """
+        if isinstance(self.data_infos, USDColumnarInfos):
+            # 列式标注中的字段已经是所有帧拼接好的数组,不需要遍历每一帧
+            infos = self.data_infos
+            offsets, boxes, names = np.asarray(infos.offsets), np.asarray(infos.bbox3d), np.asarray(infos.class_names)
+            box_types, num_points_in_gt = np.asarray(infos.box_type_3d), np.asarray(infos.num_points_in_gt)
+            occluded = np.asarray(infos.occluded)
+        else:
+            offsets, boxes, names, box_types, num_points_in_gt, occluded = self._concat_gt_infos()
+
+        box_dim = boxes.shape[-1]
+        columns = np.zeros((offsets[-1], 9), dtype=np.float32)
+        box_extras = np.zeros((offsets[-1], box_dim - 7), dtype=np.float32)
+        if offsets[-1] == 0:
+            return dict(
+                columns=columns,
+                box_extras=box_extras,
+                offsets=offsets,
+                num_points_in_gt=num_points_in_gt,
+                occluded=occluded,
+            )
+
+        # 每一种原始box类型只做一次box的转换
+        box_types = np.repeat(box_types, np.diff(offsets))
+        for box_type in np.unique(box_types):
+            mask = box_types == box_type
+            ori_box_type_3d, _ = get_box_type(str(box_type))
+            converted = (
+                ori_box_type_3d(boxes[mask], box_dim=box_dim, origin=(0.5, 0.5, 0.5))
+                .convert_to(self.box_mode_3d)
+                .tensor.numpy()
+            )
+            columns[mask, :7] = converted[:, :7]
+            box_extras[mask] = converted[:, 7:]
+
+        # 不在 CLASSES 中的类别的label为-1
+        unique_names, inverse = np.unique(names, return_inverse=True)
+        name_to_label = np.array([self.cat2id.get(name, -1) for name in unique_names])
+        columns[:, 8] = name_to_label[inverse.reshape(-1)]
+        return dict(
+            columns=columns,
+            box_extras=box_extras,
+            offsets=offsets,
+            num_points_in_gt=num_points_in_gt,
+            occluded=occluded,
+        )
+
+    def _concat_gt_infos(self):
+        """将 list[dict] 格式的标注中每一帧的gt拼接为所有帧的数组,格式与 USDColumnarInfos 中的字段相同
+
+        Returns:
+            tuple: offsets [num_frames + 1], bbox3d [M, box_dim], class_names [M], box_type_3d [num_frames],
+                num_points_in_gt [M], occluded [M]
+        """
+        boxes, names, box_types, num_points_in_gt, occluded = [], [], [], [], []
+        sizes = np.zeros((len(self.data_infos),), dtype=np.int64)
+        for i, raw_info in enumerate(self.data_infos):
+            annos = raw_info["point_clouds"]["LIDAR"]["annos"]
+            sizes[i] = len(annos["class_names"])
+            boxes.append(np.asarray(annos["bbox3d"], dtype=np.float32))
+            names.append(np.asarray(annos["class_names"]).reshape(-1))
+            box_types.append(annos["box_type_3d"])  # default: LiDAR
+            num_points_in_gt.append(np.asarray(annos["num_points_in_gt"]).reshape(-1))
+            occluded.append(np.asarray(annos["occluded"]).reshape(-1))
+
+        offsets = np.zeros((len(sizes) + 1,), dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        # 没有gt的帧的 bbox3d 可能是一维的空数组,box的维度以有gt的帧为准
+        box_dim = max([b.shape[-1] for b, size in zip(boxes, sizes) if size] + [7])
+        boxes = [b.reshape(size, box_dim) for b, size in zip(boxes, sizes)]
+        return (
+            offsets,
+            np.concatenate([np.zeros((0, box_dim), dtype=np.float32)] + boxes),
+            np.concatenate([np.zeros((0,), dtype=str)] + names),
+            np.array(box_types, dtype=str),
+            np.concatenate([np.zeros((0,), dtype=np.int64)] + num_points_in_gt),
+            np.concatenate([np.zeros((0,), dtype=np.int64)] + occluded),
+        )
+
     def get_data_info(self, index):
         """从标注文件中获取满足条件的数据信息
         返回的数据格式示例：
         {
             "seq": "0000", # 该数据在该scene中的序列号
             "pts_filename" : "path/000000.bin", # 点云文件路径
+            "pts_shard" : ("path/usd_points_00000.shard", offset, length), # 使用shard时点云的位置,否则为None
             "ann_info":{
                 "gt_bboxes_3d":<np.ndarray> (N, 7),
                 "gt_labels_3d":<np.ndarray> (N, 1)
@@ -160,6 +477,9 @@ class USDDataset(Dataset):
             "timestamp": 0.0, # 如果点云是5维且最后一维包含的是时间戳,则返回时间戳,否则返回0.0
             "sweeps":[] # 如果包含多帧点云,则返回多帧点云的路径，否则返回空列表
         }
+
+        Args:
+            index (int): 数据在 data_infos 中的index, 不是 sample_indices 中的index.
         """
         raw_info = self.data_infos[index]
 
@@ -170,44 +490,31 @@ class USDDataset(Dataset):
         # - parse point_clouds_info
         # TODO: support multi-lidar，暂时只使用一个默认的lidar
         # -- lidar是否应该只有一个呢？如果有多个，那么应该如何处理呢？
-        point_clouds_info = raw_info["point_clouds"]
-        pts_filename = osp.join(
-            self.data_root, raw_info["scene_name"], "LIDAR", point_clouds_info["LIDAR"]["file_name"]
-        )
-        # 如果点云文件不存在，直接返回None,会跳过并进行下一个数据的选择
-        if not osp.exists(pts_filename):
-            return None
+        # NOTE : 点云文件是否存在已经在初始化时扫描过,不存在的样本不会出现在 sample_indices 中
+        pts_info = self._get_pts_info(index)
 
         # - parse annotations_info
         # TODO : 解析图像的标注信息
-        raw_gt_bboxes_3d = point_clouds_info["LIDAR"]["annos"]["bbox3d"]
-        raw_gt_names_3d = point_clouds_info["LIDAR"]["annos"]["class_names"]
-        gt_labels_3d = []
-        for cat in raw_gt_names_3d:
-            if cat in self.CLASSES:
-                gt_labels_3d.append(self.CLASSES.index(cat))
-            else:
-                gt_labels_3d.append(-1)
-        gt_labels_3d = np.array(gt_labels_3d)
-        ##  对3d bbox 进行转换
-        ori_box_type_3d = point_clouds_info["LIDAR"]["annos"]["box_type_3d"]  # default: LiDAR
-        ori_box_type_3d, _ = get_box_type(ori_box_type_3d)
-        # turn original box type to target box type
-
-        gt_bboxes_3d = ori_box_type_3d(
-            raw_gt_bboxes_3d, box_dim=raw_gt_bboxes_3d.shape[-1], origin=(0.5, 0.5, 0.5)
-        ).convert_to(self.box_mode_3d)
+        # gt直接从初始化时构建的gt表中获取,box已经转换为 box_mode_3d, 类别名称已经转换为label
+        # NOTE : pipeline中的数据增强会原地修改box,拼接得到的box是新的数组,不会修改gt表
+        start, end = self.gt_table["offsets"][index], self.gt_table["offsets"][index + 1]
+        gt_columns = self.gt_table["columns"][start:end]
+        gt_bboxes_3d = np.concatenate([gt_columns[:, :7], self.gt_table["box_extras"][start:end]], axis=1)
         ann_info = {
-            "gt_bboxes_3d": gt_bboxes_3d,
-            "gt_labels_3d": gt_labels_3d,
+            "gt_bboxes_3d": self.box_type_3d(gt_bboxes_3d, box_dim=gt_bboxes_3d.shape[-1]),
+            "gt_labels_3d": gt_columns[:, 8].astype(np.int64),
+            # NOTE : 以下字段仅在eval时用于按难度过滤gt
+            "num_points_in_gt": self.gt_table["num_points_in_gt"][start:end],
+            "occluded": self.gt_table["occluded"][start:end],
         }
 
         result = {
             "seq": raw_info["seq"],
-            "pts_filename": pts_filename,
+            "pts_filename": pts_info["pts_filename"],
+            "pts_shard": pts_info["pts_shard"],
             "ann_info": ann_info,
             "timestamp": 0.0,
-            "sweeps": [],
+            "sweeps": pts_info["sweeps"],
         }
         return result
 
@@ -328,56 +635,110 @@ class USDDataset(Dataset):
         # TODO ： 针对eval任务的不同，需要做一些修改，目前仅仅针对的是3d检测的任务
         # - 增加对3d检测任务的判断以及处理支持
         # - 增加对3d分割任务的判断以及处理支持
-        result_annos = []
+        # 每一帧只做一次tensor到numpy的转换,所有帧拼接为一个列式的数组之后再统一查表得到类别名称
         print("\nConverting prediction to lidar format")
-        for idx, pred_dicts in enumerate(mmcv.track_iter_progress(dt_annos)):
+        columns = [self._dt_to_columns(pred_dicts) for pred_dicts in mmcv.track_iter_progress(dt_annos)]
+        return self._columns_to_annos(columns)
 
-            annos = []
-            # info = self.data_infos[idx]
-            # sample_idx = info["point_cloud"]["idx"]  # 不知sample_idx的用途是什么
-            sample_idx = -1
+    def format_dt_anno(self, pred_dicts):
+        """将一帧的检测结果格式化,格式参考 format_dt_annos
 
+        Args:
+            pred_dicts (dict): test模式下一帧的输出结果.
+        Returns:
+            (dict): 格式化后的dt
+        """
+        return self._columns_to_annos([self._dt_to_columns(pred_dicts)])[0]
+
+    @staticmethod
+    def _dt_to_columns(pred_dicts):
+        """将一帧的检测结果转换为列式的数组,只做一次tensor到numpy的转换
+
+        Args:
+            pred_dicts (dict): test模式下一帧的输出结果.
+        Returns:
+            np.ndarray: [N, 9] x y z x_size y_size z_size yaw score label
+        """
+        # 点云的3d检测任务的结果有时候存放在 pts_bbox 这个key中，所以需呀要做一下判断
+        if "pts_bbox" in pred_dicts:
+            pred_dicts = pred_dicts["pts_bbox"]
+        boxes_3d = pred_dicts["boxes_3d"].tensor[:, :7]
+        columns = torch.cat(
+            [
+                boxes_3d,
+                pred_dicts["scores_3d"].reshape(-1, 1).to(boxes_3d.dtype),
+                pred_dicts["labels_3d"].reshape(-1, 1).to(boxes_3d.dtype),
+            ],
+            dim=1,
+        )
+        return columns.detach().cpu().numpy()
+
+    def _columns_to_annos(self, columns, extra_fields=None):
+        """将每一帧的列式数组拼接为整个数据集的一个数组,然后切分为eval所需的每一帧的dict
+
+        Args:
+            columns (list[np.ndarray]): 每一帧的 [N, 9] 数组,格式参考 _dt_to_columns
+            extra_fields (list[dict], optional): 每一帧额外的字段,会直接合并到该帧的结果中. Defaults to None.
+        Returns:
+            (list[dict]): 格式化后的每一帧的结果
+        """
+        if len(columns) == 0:
+            return []
+        offsets = np.zeros((len(columns) + 1,), dtype=np.int64)
+        np.cumsum([len(c) for c in columns], out=offsets[1:])
+        if extra_fields is not None:
+            extra_fields = {k: np.concatenate([fields[k] for fields in extra_fields]) for k in extra_fields[0]}
+        return self._flat_columns_to_annos(np.concatenate(columns, 0), offsets, extra_fields)
+
+    def _flat_columns_to_annos(self, flat, offsets, extra_fields=None):
+        """将整个数据集的列式数组切分为eval所需的每一帧的dict,每一帧的字段都是整个数组的view,类别名称通过一次查表得到
+
+        Args:
+            flat (np.ndarray): [M, 9] 所有帧拼接之后的数组,格式参考 _dt_to_columns
+            offsets (np.ndarray): [num_frames + 1] 第i帧为 flat[offsets[i]:offsets[i+1]]
+            extra_fields (dict[str, np.ndarray], optional): 与 flat 的每一行对应的额外字段. Defaults to None.
+        Returns:
+            (list[dict]): 格式化后的每一帧的结果
+        """
+        # NOTE : 与 self.CLASSES[int(label)] 相同, label为-1时对应最后一个类别
+        names = np.array(self.CLASSES)[flat[:, 8].astype(np.int64)]
+        annos = []
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            frame = flat[start:end]
             anno = {
-                "name": [],
-                "location": [],
-                "dimensions": [],
-                "rotation_y": [],
-                "score": [],
+                "name": names[start:end],
+                "location": frame[:, 0:3],
+                "dimensions": frame[:, 3:6],
+                "rotation_y": frame[:, 6],
+                "score": frame[:, 7],
+                # 不知sample_idx的用途是什么
+                "sample_idx": np.full((len(frame),), -1, dtype=np.int64),
             }
+            if extra_fields is not None:
+                anno.update({k: v[start:end] for k, v in extra_fields.items()})
+            annos.append(anno)
+        return annos
+
+    def get_gt_annos(self, indices=None):
+        """从初始化时构建的gt表中获取eval所需格式的gt,格式参考 format_gt_annos,
+        不需要再对每一帧调用 get_data_info 构建box以及查找类别
 
-            # 在3d检测任务中，pred_dicts中包含了多个类别的检测结果
-            # 点云的3d检测任务的结果有时候存放在 pts_bbox 这个key中，所以需呀要做一下判断
-            if "pts_bbox" in pred_dicts:
-                pred_dicts = pred_dicts["pts_bbox"]
-
-            if len(pred_dicts["boxes_3d"]) > 0:
-                boxes_3d = pred_dicts["boxes_3d"]
-                scores_3d = pred_dicts["scores_3d"]
-                labels_3d = pred_dicts["labels_3d"]
-
-                # TODO：这个填充的方式太丑陋了，不应该需要循环，有待改进
-                for (box_3d, score_3d, label_3d) in zip(boxes_3d, scores_3d, labels_3d):
-                    anno["name"].append(self.CLASSES[int(label_3d)])
-                    anno["location"].append(box_3d[:3])
-                    anno["dimensions"].append(box_3d[3:6])
-                    anno["rotation_y"].append(box_3d[6])
-                    anno["score"].append(score_3d)
-                anno = {k: np.stack(v) for k, v in anno.items()}
-                annos.append(anno)
-            else:
-                anno = {
-                    "name": np.array([]),
-                    "location": np.zeros([0, 3]),
-                    "dimensions": np.zeros([0, 3]),
-                    "rotation_y": np.array([]),
-                    "score": np.array([]),
-                }
-                annos.append(anno)
-            annos[-1]["sample_idx"] = np.array([sample_idx] * len(annos[-1]["score"]), dtype=np.int64)
-
-            result_annos += annos
-
-        return result_annos
+        Args:
+            indices (list[int], optional): 需要获取的数据的index. Defaults to None, 获取所有的数据.
+        Returns:
+            (list[dict]): 格式化后的gt
+        """
+        columns, offsets = self.gt_table["columns"], self.gt_table["offsets"]
+        extra_fields = {k: self.gt_table[k] for k in ("num_points_in_gt", "occluded")}
+        if indices is None:
+            return self._flat_columns_to_annos(columns, offsets, extra_fields)
+        # 将需要的帧的行收集为一个新的表
+        indices = np.asarray(indices, dtype=np.int64)
+        starts, ends = offsets[indices], offsets[indices + 1]
+        rows = np.concatenate([np.zeros((0,), dtype=np.int64)] + [np.arange(s, e) for s, e in zip(starts, ends)])
+        sub_offsets = np.zeros((len(starts) + 1,), dtype=np.int64)
+        np.cumsum(ends - starts, out=sub_offsets[1:])
+        return self._flat_columns_to_annos(columns[rows], sub_offsets, {k: v[rows] for k, v in extra_fields.items()})
 
     def format_gt_annos(self, gt_annos):
         """将gt格式化,便于进行eval计算.
@@ -391,6 +752,8 @@ class USDDataset(Dataset):
                     "dimensions": <np.ndarray> (N, 3),
                     "rotation_y": <np.ndarray> (N, 1),
                     "score": <np.ndarray> (N, 1), # gt中没有该字段,全部填充为0
+                    "num_points_in_gt": <np.ndarray> (N,), # 用于按难度过滤gt
+                    "occluded": <np.ndarray> (N,), # 用于按难度过滤gt
                 },
                 ...
             ]
@@ -409,50 +772,39 @@ class USDDataset(Dataset):
         # TODO ： 针对eval任务的不同，需要做一些修改，目前仅仅针对的是3d检测的任务
         # - 增加对3d检测任务的判断以及处理支持
         # - 增加对3d分割任务的判断以及处理支持
-        result_annos = []
-        print("\nConverting prediction to lidar format")
-        for idx, gt_dicts in enumerate(mmcv.track_iter_progress(gt_annos)):
+        print("\nConverting gt to lidar format")
+        columns, extra_fields = [], []
+        for gt_dicts in mmcv.track_iter_progress(gt_annos):
+            columns.append(self._gt_to_columns(gt_dicts))
+            extra_fields.append(self._gt_extra_fields(gt_dicts))
+        return self._columns_to_annos(columns, extra_fields)
 
-            annos = []
-            # info = self.data_infos[idx]
-            # sample_idx = info["point_cloud"]["idx"]  # 不知sample_idx的用途是什么
-            sample_idx = -1
+    def format_gt_anno(self, gt_dicts):
+        """将一帧的gt格式化,格式参考 format_gt_annos
 
-            anno = {
-                "name": [],
-                "location": [],
-                "dimensions": [],
-                "rotation_y": [],
-                "score": [],
-            }
-
-            if len(gt_dicts["gt_bboxes_3d"]) > 0:
-                boxes_3d = gt_dicts["gt_bboxes_3d"]
-                # scores_3d = gt_dicts["scores_3d"] 没有scores_3d字段
-                labels_3d = gt_dicts["gt_labels_3d"]
-
-                for (box_3d, label_3d) in zip(boxes_3d, labels_3d):
-                    anno["name"].append(self.CLASSES[int(label_3d)])
-                    anno["location"].append(box_3d[:3])
-                    anno["dimensions"].append(box_3d[3:6])
-                    anno["rotation_y"].append(box_3d[6])
-                    anno["score"].append(0)
-                anno = {k: np.stack(v) for k, v in anno.items()}
-                annos.append(anno)
-            else:
-                anno = {
-                    "name": np.array([]),
-                    "location": np.zeros([0, 3]),
-                    "dimensions": np.zeros([0, 3]),
-                    "rotation_y": np.array([]),
-                    "score": np.array([]),
-                }
-                annos.append(anno)
-            annos[-1]["sample_idx"] = np.array([sample_idx] * len(annos[-1]["score"]), dtype=np.int64)
-
-            result_annos += annos
-
-        return result_annos
+        Args:
+            gt_dicts (dict): get_data_info 返回的 ann_info.
+        Returns:
+            (dict): 格式化后的gt
+        """
+        return self._columns_to_annos([self._gt_to_columns(gt_dicts)], [self._gt_extra_fields(gt_dicts)])[0]
+
+    @staticmethod
+    def _gt_to_columns(gt_dicts):
+        """将一帧的gt转换为列式的数组,格式参考 _dt_to_columns, gt中没有score字段,全部填充为0"""
+        boxes_3d = gt_dicts["gt_bboxes_3d"].tensor[:, :7].numpy()
+        columns = np.zeros((len(boxes_3d), 9), dtype=np.float32)
+        columns[:, :7] = boxes_3d
+        columns[:, 8] = gt_dicts["gt_labels_3d"]
+        return columns
+
+    @staticmethod
+    def _gt_extra_fields(gt_dicts):
+        """gt中用于按难度过滤的字段"""
+        return {
+            "num_points_in_gt": np.asarray(gt_dicts["num_points_in_gt"]).reshape(-1),
+            "occluded": np.asarray(gt_dicts["occluded"]).reshape(-1),
+        }
 
     def evaluate(
         self,
@@ -462,6 +814,8 @@ class USDDataset(Dataset):
         show=False,
         out_dir=None,
         pipeline=None,
+        difficulties=None,
+        num_workers=None,
     ):
         """Evaluate.
 
@@ -476,14 +830,17 @@ class USDDataset(Dataset):
                 Default: None.
             pipeline (list[dict], optional): raw data loading for showing.
                 Default: None.
+            difficulties (list[dict], optional): 评估难度的过滤条件,可以按距离、gt中点的数量、遮挡程度定义,
+                例如 [dict(name="near", range=(0, 30)), dict(name="far", range=(30, 80))],
+                参考 usd_utils.eval.DEFAULT_DIFFICULTIES. Default: None.
+            num_workers (int, optional): eval时并行计算使用的线程数. Default: None, 使用numba的全部线程.
 
         Returns:
             dict: Evaluation results.
         """
-        gt_annos = [self.get_data_info(i)["ann_info"] for i in range(len(self.data_infos))]
-
         dt_annos_after_format = self.format_dt_annos(results)
-        gt_annos_after_format = self.format_gt_annos(gt_annos)
+        # gt直接从初始化时构建的gt表中获取,每次evaluate都复用
+        gt_annos_after_format = self.get_gt_annos()
         from mmdet3d_extension.core.evaluation import usd_eval
 
         ap_result_str, ap_dict = usd_eval(
@@ -491,6 +848,8 @@ class USDDataset(Dataset):
             dt_annos=dt_annos_after_format,
             current_classes=self.CLASSES,
             eval_types=metric,  # default evaluate bev and 3d
+            difficulties=difficulties,
+            num_workers=num_workers,
         )
 
         print_log("\n" + ap_result_str, logger=logger)
@@ -501,6 +860,44 @@ class USDDataset(Dataset):
 
         return ap_dict
 
+    def build_online_evaluator(
+        self, metric=["bev", "3d"], difficulties=None, chunk_size=64, num_score_bins=None, **kwargs
+    ):
+        """构建在线的evaluator,在test的过程中通过 update_online_evaluator 逐批送入检测结果,
+        最后调用 evaluator.evaluate() 得到与 evaluate 相同的结果,不需要保存所有的检测结果
+
+        Args:
+            metric (str | list[str], optional): Metrics to be evaluated.Defaults to ["bev", "3d"].
+            difficulties (list[dict], optional): 评估难度的过滤条件. Default: None.
+            chunk_size (int, optional): 每积累多少帧计算一次. Default: 64.
+            num_score_bins (int, optional): score量化的bin的数量,设置后每个cell保存的状态有上界. Default: None.
+            kwargs: evaluate 的其他参数(logger num_workers 等),在线eval中不使用.
+
+        Returns:
+            USDOnlineEvaluator: 在线的evaluator
+        """
+        from mmdet3d_extension.core.evaluation import USDOnlineEvaluator
+
+        return USDOnlineEvaluator(
+            self.CLASSES,
+            eval_types=metric,
+            difficulties=difficulties,
+            chunk_size=chunk_size,
+            num_score_bins=num_score_bins,
+        )
+
+    def update_online_evaluator(self, evaluator, indices, results):
+        """将一批检测结果及其对应的gt送入在线的evaluator
+
+        Args:
+            evaluator (USDOnlineEvaluator): build_online_evaluator 构建的evaluator
+            indices (list[int]): 检测结果对应的数据的index
+            results (list[dict]): test模式下的检测结果.
+        """
+        gt_annos = self.get_gt_annos(indices)
+        dt_annos = [self.format_dt_anno(result) for result in results]
+        evaluator.update(gt_annos, dt_annos)
+
     def _build_default_pipeline(self):
         """Build the default pipeline for this dataset."""
         raise NotImplementedError(
@@ -557,12 +954,12 @@ class USDDataset(Dataset):
         return data
 
     def __len__(self):
-        """Return the length of data infos.
+        """Return the length of usable samples.
 
         Returns:
-            int: Length of data infos.
+            int: Length of usable samples, 参考 _get_sample_indices.
         """
-        return len(self.data_infos)
+        return len(self.sample_indices)
 
     def _rand_another(self, idx):
         """Randomly get another item with the same flag.
@@ -579,21 +976,68 @@ class USDDataset(Dataset):
         Returns:
             dict: Data dictionary of the corresponding index.
         """
+        # idx 为可用样本的index, sample_indices 将其映射为 data_infos 中的index
         if self.test_mode:
-            return self.prepare_test_data(idx)
+            return self.prepare_test_data(self.sample_indices[idx])
         while True:
-            data = self.prepare_train_data(idx)
+            data = self.prepare_train_data(self.sample_indices[idx])
             if data is None:
                 idx = self._rand_another(idx)
                 continue
 
             return data
 
+    def __getitems__(self, indices):
+        """DataLoader 的worker一次获取一个batch时调用(torch>=2.0), indices 为sampler给出的该batch中的样本,
+        读取每个样本之前先预读之后的 prefetch_num 个样本
+
+        Returns:
+            list[dict]: 每个样本的数据
+        """
+        data = []
+        for i, idx in enumerate(indices):
+            if self.prefetch_num > 0:
+                self.prefetch(indices[i : i + self.prefetch_num + 1])
+            data.append(self[idx])
+        return data
+
+    def prefetch(self, indices):
+        """让pipeline中使用 PrefetchBackend 的点云加载步骤提前读取 indices 中样本的点云文件以及sweeps
+
+        Args:
+            indices (list[int]): 可用样本的index,与 __getitem__ 相同
+        """
+        pipeline = getattr(self, "pipeline", None)
+        if pipeline is None:
+            return
+        pts_infos = [self._get_pts_info(self.sample_indices[idx]) for idx in indices]
+        for transform in pipeline.transforms:
+            if getattr(transform, "file_client_args", {}).get("backend") != "prefetch":
+                continue
+            if getattr(transform, "file_client", None) is None:
+                transform.file_client = mmcv.FileClient(**transform.file_client_args)
+            filenames = []
+            for pts_info in pts_infos:
+                if isinstance(transform, LoadPointsFromMultiSweeps):
+                    filenames.extend(sweep["data_path"] for sweep in pts_info["sweeps"])
+                elif hasattr(transform, "prefetch_filenames"):
+                    filenames.extend(transform.prefetch_filenames(pts_info))
+            transform.file_client.client.prefetch(filenames)
+
     def _set_group_flag(self):
-        """Set flag according to image aspect ratio.
+        """Set flag according to the number of points.
 
-        Images with aspect ratio greater than 1 will be set as group 1,
-        otherwise group 0. In 3D datasets, they are all the same, thus are all
-        zeros.
+        按点云中点的数量设置分组, mmdet的 GroupSampler 与 DistributedGroupSampler 保证每个batch中的样本属于同一组,
+        避免同一个batch中点数相差很大的样本导致voxelization以及 max_voxels 的截断不均匀,
+        点的数量来自初始化时扫描得到的样本索引, point_buckets 为1时所有样本都为group 0.
         """
         self.flag = np.zeros(len(self), dtype=np.uint8)
+        if isinstance(self.point_buckets, int) and self.point_buckets <= 1:
+            return
+        num_points = self.sample_index["num_points"][self.sample_indices]
+        if isinstance(self.point_buckets, int):
+            # 按分位数划分,每一组的样本数量大致相同
+            bounds = np.quantile(num_points, np.linspace(0, 1, self.point_buckets + 1)[1:-1])
+        else:
+            bounds = np.sort(np.asarray(self.point_buckets))
+        self.flag = np.searchsorted(bounds, num_points, side="right").astype(np.uint8)
@@ -0,0 +1,168 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+import json
+import os
+import pickle
+import shutil
+import warnings
+from collections import OrderedDict
+from os import path as osp
+
+import numpy as np
+
+# 分片标注格式的版本,格式改变时需要修改
+USD_SHARDED_INFOS_VERSION = 1
+USD_SHARDED_INFOS_INDEX_FILE = "index.json"
+
+
+def is_usd_sharded_infos(path):
+    """判断path是否为 USDShardedInfosWriter 保存的分片标注"""
+    return osp.isdir(path) and osp.isfile(osp.join(path, USD_SHARDED_INFOS_INDEX_FILE))
+
+
+class USDShardedInfosWriter(object):
+    """将 usd_infos_xxx.pkl 格式的标注按固定的帧数分片,边生成边写入,不需要在内存中保存所有帧
+
+    保存的格式:
+    out_dir/
+        index.json  # 版本 帧数 每个分片的文件名与帧数 是否写入完成
+        shard_000000.pkl shard_000001.pkl ...  # 每个分片为 list[dict], 与pkl中的帧的结构相同
+
+    所有分片先写入 {out_dir}.tmp, 每写完一个分片更新一次 index.json, 中途退出时已经写入的分片
+    仍然可以通过 USDShardedInfos 读取. close 时将 {out_dir}.tmp 重命名为 out_dir, 所以生成时
+    可以同时读取 out_dir 中旧的分片
+
+    Args:
+        out_dir (str): 保存的文件夹
+        shard_size (int, optional): 每个分片的帧数. Defaults to 1024.
+    """
+
+    def __init__(self, out_dir, shard_size=1024):
+        self.out_dir = out_dir.rstrip("/")
+        self.shard_size = shard_size
+        self.tmp_dir = f"{self.out_dir}.tmp"
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+        self.shards = []
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # 出现异常时保留 {out_dir}.tmp 中已经写入的分片,不覆盖 out_dir
+        if exc_type is None:
+            self.close()
+
+    def __len__(self):
+        return sum(shard["num_frames"] for shard in self.shards) + len(self.buffer)
+
+    def append(self, info):
+        """写入一帧的标注,缓存的帧数达到 shard_size 时写入一个分片"""
+        self.buffer.append(info)
+        if len(self.buffer) >= self.shard_size:
+            self._flush()
+
+    def extend(self, infos):
+        """按顺序写入多帧的标注, infos 可以是生成器"""
+        for info in infos:
+            self.append(info)
+
+    def _flush(self):
+        file_name = f"shard_{len(self.shards):06d}.pkl"
+        with open(osp.join(self.tmp_dir, file_name), "wb") as f:
+            pickle.dump(self.buffer, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.shards.append(dict(file_name=file_name, num_frames=len(self.buffer)))
+        self.buffer = []
+        self._write_index(complete=False)
+
+    def _write_index(self, complete):
+        index = dict(
+            version=USD_SHARDED_INFOS_VERSION,
+            num_frames=sum(shard["num_frames"] for shard in self.shards),
+            shard_size=self.shard_size,
+            shards=self.shards,
+            complete=complete,
+        )
+        # 先写入临时文件再重命名,读取时不会读到写了一半的 index.json
+        index_file = osp.join(self.tmp_dir, USD_SHARDED_INFOS_INDEX_FILE)
+        with open(f"{index_file}.tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(f"{index_file}.tmp", index_file)
+
+    def close(self):
+        """写入剩余的帧以及最终的 index.json, 并替换 out_dir"""
+        if len(self.buffer) > 0:
+            self._flush()
+        self._write_index(complete=True)
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+        os.replace(self.tmp_dir, self.out_dir)
+
+
+class USDShardedInfos(object):
+    """按需读取 USDShardedInfosWriter 保存的分片标注,可以替代 usd_infos_xxx.pkl 读取得到的 list[dict]
+
+    初始化时只读取 index.json, 访问某一帧时才读取其所在的分片,最近使用的 max_cached_shards 个分片保存在内存中.
+    USDDataset 初始化时按顺序遍历所有帧,每个分片只读取一次;训练时随机访问的分片数较多时,
+    可以增大 max_cached_shards 或者使用列式的标注
+
+    Args:
+        path (str): USDShardedInfosWriter 保存的文件夹
+        max_cached_shards (int, optional): 内存中保存的分片数量. Defaults to 16.
+    """
+
+    def __init__(self, path, max_cached_shards=16):
+        self.path = path
+        self.max_cached_shards = max_cached_shards
+        with open(osp.join(path, USD_SHARDED_INFOS_INDEX_FILE)) as f:
+            index = json.load(f)
+        assert (
+            index["version"] == USD_SHARDED_INFOS_VERSION
+        ), f"unsupported sharded infos version {index['version']}, please regenerate {path}"
+        if not index["complete"]:
+            warnings.warn(f"{path} is not completely written, only {index['num_frames']} frames are available")
+        self.shard_files = [shard["file_name"] for shard in index["shards"]]
+        # 第i个分片的帧为 [offsets[i], offsets[i+1])
+        self.offsets = np.zeros((len(index["shards"]) + 1,), dtype=np.int64)
+        np.cumsum([shard["num_frames"] for shard in index["shards"]], out=self.offsets[1:])
+        self._cache = OrderedDict()
+
+    def __getstate__(self):
+        # DataLoader 的worker中重新读取分片,而不是将已经读取的分片序列化
+        return dict(path=self.path, max_cached_shards=self.max_cached_shards)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _load_shard(self, shard_id):
+        with open(osp.join(self.path, self.shard_files[shard_id]), "rb") as f:
+            return pickle.load(f)
+
+    def _get_shard(self, shard_id):
+        if shard_id in self._cache:
+            self._cache.move_to_end(shard_id)
+            return self._cache[shard_id]
+        shard = self._load_shard(shard_id)
+        self._cache[shard_id] = shard
+        while len(self._cache) > self.max_cached_shards:
+            self._cache.popitem(last=False)
+        return shard
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index):
+        """获取一帧的标注,结构与 usd_infos_xxx.pkl 中的一帧相同"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"index {index} out of range for {len(self)} frames")
+        shard_id = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        return self._get_shard(shard_id)[index - self.offsets[shard_id]]
+
+    def __iter__(self):
+        """按顺序遍历所有帧,每次只读取一个分片,不占用缓存"""
+        for shard_id in range(len(self.shard_files)):
+            if shard_id in self._cache:
+                yield from self._cache[shard_id]
+            else:
+                yield from self._load_shard(shard_id)
@@ -0,0 +1,159 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+import os
+import struct
+from os import path as osp
+
+import numpy as np
+
+# 点云shard文件的格式:
+#   header: magic(4s) version(uint32) num_samples(uint32) payload_format(8s)
+#   index:  num_samples 个 (offset uint64, length uint64), offset 为样本数据在shard文件中的绝对位置
+#   body:   各个样本的原始文件内容依次拼接, payload_format 为 float32 (.bin) 或 qbin (量化点云)
+# 所有shard共用一个全局的索引 shard_index.npz, 记录每个样本所在的shard以及位置
+USD_SHARD_MAGIC = b"USDS"
+USD_SHARD_VERSION = 1
+USD_SHARD_HEADER = struct.Struct("<4sII8s")
+USD_SHARD_INDEX_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u8")])
+USD_SHARD_INDEX_FILE = "shard_index.npz"
+
+
+def get_usd_sample_key(raw_info):
+    """样本在shard索引中的key,与点云文件相对于 data_root 的路径相同"""
+    return osp.join(raw_info["scene_name"], "LIDAR", raw_info["point_clouds"]["LIDAR"]["file_name"])
+
+
+def read_usd_shard_header(shard_path):
+    """读取shard文件的header以及索引
+
+    Args:
+        shard_path (str): shard文件的路径
+
+    Returns:
+        tuple: payload_format (str), index (np.ndarray) [num_samples] 包含 offset length 字段
+    """
+    with open(shard_path, "rb") as f:
+        magic, version, num_samples, payload_format = USD_SHARD_HEADER.unpack(f.read(USD_SHARD_HEADER.size))
+        assert magic == USD_SHARD_MAGIC, f"{shard_path} is not a usd shard"
+        assert version == USD_SHARD_VERSION, f"unsupported usd shard version {version}"
+        index = np.frombuffer(f.read(num_samples * USD_SHARD_INDEX_DTYPE.itemsize), dtype=USD_SHARD_INDEX_DTYPE)
+    return payload_format.rstrip(b"\0").decode(), index
+
+
+def check_usd_shard_payload_format(payload_format, expected, source):
+    """检查shard中样本数据的格式与加载步骤能够解码的格式是否一致
+
+    Args:
+        payload_format (str): shard中样本数据的格式, float32 或 qbin
+        expected (str): 加载步骤能够解码的格式
+        source (str): shard文件或者shard文件夹的路径,用于错误信息
+
+    Raises:
+        ValueError: 格式不一致
+    """
+    if payload_format != expected:
+        raise ValueError(
+            f"{source} stores {payload_format} points but the loader decodes {expected}, "
+            "use LoadPointsFromFileExtension for float32 shards and LoadPointsFromQuantizedFile for qbin shards"
+        )
+
+
+class USDShardIndex(object):
+    """usd_converter.create_usd_shards 生成的全局shard索引
+
+    Args:
+        shard_dir (str): shard文件所在的文件夹
+
+    Attributes:
+        payload_format (str): 样本数据的格式, float32 或 qbin
+        shard_paths (list[str]): 所有shard文件的路径
+        keys (np.ndarray): [num_samples] 样本的key, 参考 get_usd_sample_key
+        shard_ids offsets lengths num_points (np.ndarray): [num_samples] 样本所在的shard以及位置,点的数量
+    """
+
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        with np.load(osp.join(shard_dir, USD_SHARD_INDEX_FILE)) as index:
+            self.payload_format = str(index["payload_format"])
+            self.shard_paths = [osp.join(shard_dir, name) for name in index["shard_names"]]
+            self.keys = index["keys"]
+            self.shard_ids = index["shard_ids"]
+            self.offsets = index["offsets"]
+            self.lengths = index["lengths"]
+            self.num_points = index["num_points"]
+
+    def lookup(self, keys):
+        """获取每个key在索引中的位置,不存在的key为-1
+
+        Args:
+            keys (list[str]): 样本的key
+
+        Returns:
+            np.ndarray: [len(keys)] int64
+        """
+        key_to_row = {key: row for row, key in enumerate(self.keys.tolist())}
+        return np.array([key_to_row.get(key, -1) for key in keys], dtype=np.int64).reshape(-1)
+
+    def get(self, row):
+        """获取一个样本在shard中的位置, 格式为 pipeline 中使用的 (shard_path, offset, length)"""
+        return self.shard_paths[self.shard_ids[row]], int(self.offsets[row]), int(self.lengths[row])
+
+
+class USDShardReader(object):
+    """读取shard中的一个样本,每个shard文件只打开一次
+
+    use_memmap 为True时将整个shard以memory-map打开,返回样本对应的切片,
+    否则使用 os.pread 按位置读取,多个线程或进程共享文件描述符时也不会互相影响读取的位置.
+    按shard内的顺序读取时,操作系统的预读可以得到连续的I/O
+
+    Args:
+        use_memmap (bool, optional): 是否使用memory-map. Defaults to False.
+        payload_format (str, optional): 加载步骤能够解码的样本数据格式, float32 或 qbin, 不为None时
+            第一次打开每个shard时检查header中的 payload_format, 不一致时抛出 ValueError,
+            避免将另一种格式的数据解码为错误的点云. Defaults to None, 不检查.
+    """
+
+    def __init__(self, use_memmap=False, payload_format=None):
+        self.use_memmap = use_memmap
+        self.payload_format = payload_format
+        self._shards = dict()
+
+    def _open(self, shard_path):
+        if shard_path not in self._shards:
+            if self.payload_format is not None:
+                payload_format, _ = read_usd_shard_header(shard_path)
+                check_usd_shard_payload_format(payload_format, self.payload_format, shard_path)
+            if self.use_memmap:
+                self._shards[shard_path] = np.memmap(shard_path, dtype=np.uint8, mode="r")
+            else:
+                fd = os.open(shard_path, os.O_RDONLY)
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                self._shards[shard_path] = fd
+        return self._shards[shard_path]
+
+    def read(self, pts_shard):
+        """读取一个样本的数据
+
+        Args:
+            pts_shard (tuple): (shard_path, offset, length)
+
+        Returns:
+            bytes | np.ndarray: 样本的原始数据
+        """
+        shard_path, offset, length = pts_shard
+        shard = self._open(shard_path)
+        if self.use_memmap:
+            return shard[offset : offset + length]
+        return os.pread(shard, length, offset)
+
+    def __getstate__(self):
+        # 文件描述符与memory-map不能跨进程传递,在每个worker中重新打开
+        return dict(use_memmap=self.use_memmap, payload_format=self.payload_format)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __del__(self):
+        if not self.use_memmap:
+            for fd in self._shards.values():
+                os.close(fd)
@@ -0,0 +1,82 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+"""对比 USDDataset 的 point_buckets 不同时训练数据读取以及voxelization的吞吐量
+
+每个batch的耗时取决于batch中点数最多的样本,所以同时统计每个batch中点数的 max / mean,
+该值越接近1,batch内的样本越均匀
+
+Example:
+    python tools/analysis_tools/benchmark_dataloader.py \\
+        configs/centerpoint/centerpoint_02pillar_second_secfpn_4x8_cyclic_20e_usd.py --buckets 1 4 --num-batches 200
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from mmcv import Config
+from mmcv.ops import Voxelization
+
+from mmdet3d.datasets import build_dataloader, build_dataset
+from mmdet3d_extension.datasets import *  # noqa: F401, F403
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the train dataloader with point-count buckets")
+    parser.add_argument("config", help="train config file path")
+    parser.add_argument("--buckets", type=int, nargs="+", default=[1, 4], help="point_buckets to compare")
+    parser.add_argument("--num-batches", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=None, help="override workers_per_gpu")
+    parser.add_argument("--no-voxelize", action="store_true", help="only benchmark data loading")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def benchmark(point_buckets, args):
+    cfg = Config.fromfile(args.config)
+    cfg.data.train.point_buckets = point_buckets
+    dataset = build_dataset(cfg.data.train)
+    data_loader = build_dataloader(
+        dataset,
+        cfg.data.samples_per_gpu,
+        args.workers if args.workers is not None else cfg.data.workers_per_gpu,
+        dist=False,
+        shuffle=True,
+        seed=args.seed,
+    )
+    voxel_layer = None if args.no_voxelize else Voxelization(**cfg.model.pts_voxel_layer)
+
+    num_samples, imbalance, voxel_time = 0, [], 0.0
+    start = None
+    for i, data in enumerate(data_loader):
+        if i == 0:
+            # 第一个batch包含worker启动的耗时,不计入
+            start = time.perf_counter()
+            continue
+        if i > args.num_batches:
+            break
+        points = data["points"].data[0]
+        num_points = np.array([len(p) for p in points])
+        num_samples += len(points)
+        imbalance.append(num_points.max() / max(num_points.mean(), 1))
+        if voxel_layer is not None:
+            voxel_start = time.perf_counter()
+            with torch.no_grad():
+                for p in points:
+                    voxel_layer(p)
+            voxel_time += time.perf_counter() - voxel_start
+    cost = time.perf_counter() - start
+    print(
+        f"  point_buckets={point_buckets}: {num_samples / cost:8.2f} samples/s, "
+        f"voxelize {voxel_time:7.2f}s, batch max/mean points {np.mean(imbalance):.2f}"
+    )
+
+
+def main():
+    args = parse_args()
+    print(f"{args.num_batches} batches per run")
+    for point_buckets in args.buckets:
+        benchmark(point_buckets, args)
+
+
+if __name__ == "__main__":
+    main()
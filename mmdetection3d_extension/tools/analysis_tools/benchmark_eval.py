@@ -0,0 +1,105 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+"""测试 eval_class 中 (class, difficulty, overlap) 并行计算在不同线程数下的扩展性
+
+默认为10个类别 x 2组overlap,每个类别使用不同的overlap,避免相同的cell被合并计算
+
+Example:
+    python tools/analysis_tools/benchmark_eval.py --num-frames 2000 --workers 1 2 4 8 16
+"""
+import argparse
+import time
+
+import numba
+import numpy as np
+
+from mmdet3d_extension.core.evaluation.usd_utils.eval import DEFAULT_DIFFICULTIES, eval_class
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark eval_class on synthetic annotations")
+    parser.add_argument("--num-frames", type=int, default=2000)
+    parser.add_argument("--num-classes", type=int, default=10)
+    parser.add_argument("--max-boxes", type=int, default=40, help="max gt boxes per frame")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="worker numbers to test")
+    parser.add_argument("--metric", type=int, default=1, help="1: bev, 2: 3d")
+    parser.add_argument("--repeat", type=int, default=3, help="take the best of repeat runs")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def random_annos(num_frames, num_classes, max_boxes, rng):
+    """生成camera坐标系下的随机gt和dt,dt由gt加噪声以及随机的误检组成"""
+
+    def make_anno(loc, dims, rots, labels, scores):
+        num = len(loc)
+        return dict(
+            name=labels,
+            location=loc,
+            dimensions=dims,
+            rotation_y=rots,
+            score=scores,
+            alpha=np.zeros((num,)),
+            bbox=np.zeros((num, 4)),
+        )
+
+    gt_annos, dt_annos = [], []
+    for _ in range(num_frames):
+        num_gt = rng.integers(0, max_boxes + 1)
+        loc = rng.uniform(-50, 50, (num_gt, 3))
+        dims = rng.uniform(0.5, 5.0, (num_gt, 3))
+        rots = rng.uniform(-np.pi, np.pi, (num_gt,))
+        labels = rng.integers(0, num_classes, (num_gt,))
+        gt_annos.append(make_anno(loc, dims, rots, labels, np.zeros((num_gt,))))
+
+        keep = rng.random(num_gt) < 0.8
+        num_fp = rng.integers(0, max_boxes // 2 + 1)
+        dt_loc = np.concatenate([loc[keep] + rng.normal(0, 0.3, (keep.sum(), 3)), rng.uniform(-50, 50, (num_fp, 3))])
+        dt_dims = np.concatenate(
+            [dims[keep] * rng.uniform(0.85, 1.15, (keep.sum(), 3)), rng.uniform(0.5, 5, (num_fp, 3))]
+        )
+        dt_rots = np.concatenate(
+            [rots[keep] + rng.normal(0, 0.1, (keep.sum(),)), rng.uniform(-np.pi, np.pi, (num_fp,))]
+        )
+        dt_labels = np.concatenate([labels[keep], rng.integers(0, num_classes, (num_fp,))])
+        dt_annos.append(make_anno(dt_loc, dt_dims, dt_rots, dt_labels, rng.random(len(dt_loc))))
+    return gt_annos, dt_annos
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    gt_annos, dt_annos = random_annos(args.num_frames, args.num_classes, args.max_boxes, rng)
+    # [num_overlap, metric, class]
+    class_offsets = np.arange(args.num_classes) * 0.01
+    min_overlaps = np.stack(
+        [np.tile(0.7 - class_offsets, (3, 1)), np.tile(0.5 - class_offsets, (3, 1))],
+        axis=0,
+    )
+    current_classes = list(range(args.num_classes))
+    workers = sorted({w for w in args.workers if w <= numba.config.NUMBA_NUM_THREADS})
+
+    # 预热,排除jit编译的耗时
+    eval_class(gt_annos[:8], dt_annos[:8], current_classes, DEFAULT_DIFFICULTIES, args.metric, min_overlaps)
+
+    print(
+        f"{args.num_frames} frames, {args.num_classes} classes x {len(min_overlaps)} overlap sets, "
+        f"{numba.config.NUMBA_NUM_THREADS} threads available"
+    )
+    base = None
+    ref = None
+    for w in workers:
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            ret = eval_class(
+                gt_annos, dt_annos, current_classes, DEFAULT_DIFFICULTIES, args.metric, min_overlaps, num_workers=w
+            )
+            best = min(best, time.perf_counter() - start)
+        base = base or best
+        ref = ret["precision"] if ref is None else ref
+        assert np.array_equal(ref, ret["precision"], equal_nan=True), "results differ between worker numbers"
+        print(f"  {w:3d} workers: {best:8.3f}s  speedup x{base / best:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+"""统计生成info时计算 num_points_in_gt 的吞吐量(读取点云 + 统计每个gt内的点数),
+对比 BEV网格预筛选的 points_in_boxes_count 与逐个box测试所有点的 box_np_ops.points_in_rbbox
+
+默认使用随机生成的64线与128线点云,每帧 --num-boxes 个gt, --workers 大于1时同时测试多进程的吞吐量
+
+Example:
+    python tools/analysis_tools/benchmark_num_points_in_gt.py --num-frames 100 --num-boxes 60 --workers 8
+"""
+import argparse
+import functools
+import tempfile
+import time
+from concurrent import futures
+from os import path as osp
+
+import numpy as np
+
+from mmdet3d.core.bbox import box_np_ops
+from mmdet3d_extension.core.bbox import points_in_boxes_count
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark num_points_in_gt computation")
+    parser.add_argument("--num-frames", type=int, default=100)
+    parser.add_argument("--num-beams", type=int, nargs="+", default=[64, 128])
+    parser.add_argument("--num-columns", type=int, default=1800, help="points per beam in one sweep")
+    parser.add_argument("--num-boxes", type=int, default=60)
+    parser.add_argument("--num-features", type=int, default=4)
+    parser.add_argument("--cell-size", type=float, default=2.0)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def random_frame(num_beams, num_columns, num_boxes, num_features, rng):
+    """一帧点云以及其中的gt, gt附近额外加入一些点,模拟车辆等物体上的点"""
+    num_points = num_beams * num_columns
+    azimuth = np.tile(np.linspace(-np.pi, np.pi, num_columns, endpoint=False), num_beams)
+    elevation = np.repeat(np.deg2rad(np.linspace(-25, 15, num_beams)), num_columns)
+    distance = rng.uniform(1, 120, num_points)
+    points = np.zeros((num_points, num_features), dtype=np.float32)
+    points[:, 0] = distance * np.cos(elevation) * np.cos(azimuth)
+    points[:, 1] = distance * np.cos(elevation) * np.sin(azimuth)
+    points[:, 2] = distance * np.sin(elevation) + 1.8
+    boxes = np.zeros((num_boxes, 7), dtype=np.float32)
+    boxes[:, :2] = rng.uniform(-60, 60, (num_boxes, 2))
+    boxes[:, 2] = rng.uniform(-1, 1, num_boxes)
+    boxes[:, 3:6] = rng.uniform(1, 12, (num_boxes, 3))
+    boxes[:, 6] = rng.uniform(-np.pi, np.pi, num_boxes)
+    object_points = np.zeros((num_boxes * 200, num_features), dtype=np.float32)
+    object_points[:, :3] = np.repeat(boxes[:, :3], 200, axis=0) + rng.uniform(-0.5, 0.5, (num_boxes * 200, 3)) * 4
+    return np.concatenate([points, object_points]), boxes
+
+
+def count_grid(task, num_features, cell_size):
+    pts_filename, boxes = task
+    points = np.fromfile(pts_filename, dtype=np.float32).reshape(-1, num_features)
+    return points_in_boxes_count(points, boxes, cell_size)
+
+
+def count_brute_force(task, num_features):
+    pts_filename, boxes = task
+    points = np.fromfile(pts_filename, dtype=np.float32).reshape(-1, num_features)
+    return box_np_ops.points_in_rbbox(points[:, :3], boxes, origin=(0.5, 0.5, 0.5)).sum(0)
+
+
+def run(func, tasks, workers):
+    start = time.perf_counter()
+    if workers <= 1:
+        results = [func(task) for task in tasks]
+    else:
+        with futures.ProcessPoolExecutor(workers) as executor:
+            # 每个进程第一次调用时完成kernel的编译,不计入时间
+            list(executor.map(func, tasks[:workers]))
+            start = time.perf_counter()
+            results = list(executor.map(func, tasks, chunksize=4))
+    return results, time.perf_counter() - start
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    grid_func = functools.partial(count_grid, num_features=args.num_features, cell_size=args.cell_size)
+    brute_force_func = functools.partial(count_brute_force, num_features=args.num_features)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_beams in args.num_beams:
+            tasks = []
+            for i in range(args.num_frames):
+                points, boxes = random_frame(num_beams, args.num_columns, args.num_boxes, args.num_features, rng)
+                tasks.append((osp.join(tmp_dir, f"{num_beams}_{i:06d}.bin"), boxes))
+                points.tofile(tasks[-1][0])
+            print(f"{num_beams} beams, {len(points)} points/frame, {args.num_boxes} boxes/frame:")
+            grid_func(tasks[0])
+            grid_counts, grid_cost = run(grid_func, tasks, 1)
+            # 逐个box测试所有点很慢,只测试少量的帧
+            num_brute_force = max(1, args.num_frames // 10)
+            brute_force_counts, brute_force_cost = run(brute_force_func, tasks[:num_brute_force], 1)
+            for a, b in zip(grid_counts, brute_force_counts):
+                if not np.array_equal(a, b):
+                    print(f"  WARNING: {np.abs(a - b).sum()} points differ on the box boundary")
+            print(f"  points_in_rbbox        : {num_brute_force / brute_force_cost:8.1f} frames/s")
+            print(f"  bev grid, 1 process    : {len(tasks) / grid_cost:8.1f} frames/s")
+            if args.workers > 1:
+                _, cost = run(grid_func, tasks, args.workers)
+                print(f"  bev grid, {args.workers:2d} processes: {len(tasks) / cost:8.1f} frames/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+"""对比项目中的PCD读取与 pypcd 在128线点云上的吞吐量, 分别测试 ascii binary 与 binary_compressed
+
+默认使用随机生成的128线点云(x y z intensity ring time),也可以通过 --files 指定真实的PCD文件,
+没有安装 pypcd 时只测试项目中的实现
+
+Example:
+    python tools/analysis_tools/benchmark_pcd.py --num-frames 20 --num-beams 128 --num-columns 1800
+    python tools/analysis_tools/benchmark_pcd.py --files data/USD/scene_0/LIDAR/*.pcd
+"""
+import argparse
+import os
+import tempfile
+import time
+from os import path as osp
+
+import numpy as np
+
+from mmdet3d_extension.datasets.pipelines.pcd import PCD_DATA_TYPES, decode_pcd, encode_pcd, parse_pcd_header
+
+try:
+    from pypcd import pypcd
+except ImportError:
+    pypcd = None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the native PCD reader against pypcd")
+    parser.add_argument("--files", nargs="+", default=None, help="real .pcd files, use random points if not given")
+    parser.add_argument("--num-frames", type=int, default=20)
+    parser.add_argument("--num-beams", type=int, default=128)
+    parser.add_argument("--num-columns", type=int, default=1800, help="points per beam in one sweep")
+    parser.add_argument("--fields", nargs="+", default=["x", "y", "z", "intensity"])
+    parser.add_argument("--repeat", type=int, default=3, help="take the best of repeat runs")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def random_sweep(num_beams, num_columns, rng):
+    """一次扫描的点云,按线束为主序排列, 与驱动输出的点的顺序相同"""
+    point_dtype = np.dtype(
+        [("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("intensity", "<f4"), ("ring", "<u2"), ("time", "<f8")]
+    )
+    num_points = num_beams * num_columns
+    azimuth = np.tile(np.linspace(-np.pi, np.pi, num_columns, endpoint=False), num_beams)
+    elevation = np.repeat(np.deg2rad(np.linspace(-25, 15, num_beams)), num_columns)
+    distance = rng.uniform(1, 200, num_points)
+    points = np.empty((num_points,), dtype=point_dtype)
+    points["x"] = distance * np.cos(elevation) * np.cos(azimuth)
+    points["y"] = distance * np.cos(elevation) * np.sin(azimuth)
+    points["z"] = distance * np.sin(elevation)
+    points["intensity"] = rng.integers(0, 256, num_points)
+    points["ring"] = np.repeat(np.arange(num_beams), num_columns)
+    points["time"] = np.tile(np.linspace(0, 0.1, num_columns, endpoint=False), num_beams)
+    return points
+
+
+def load_native(filename, fields):
+    with open(filename, "rb") as f:
+        return decode_pcd(f.read(), fields)
+
+
+def load_pypcd(filename, fields):
+    pc_data = pypcd.PointCloud.from_path(filename).pc_data
+    return np.stack([pc_data[name] for name in fields], axis=1).astype(np.float32)
+
+
+def timeit(func, filenames, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for filename in filenames:
+            func(filename)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    # 第一次调用时完成LZF kernel的编译
+    decode_pcd(encode_pcd(random_sweep(1, 16, rng)), ["x"])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        groups = dict()
+        if args.files is not None:
+            for filename in args.files:
+                with open(filename, "rb") as f:
+                    groups.setdefault(parse_pcd_header(f.read())[0]["data"], []).append(filename)
+        else:
+            for data in PCD_DATA_TYPES:
+                # ascii 的解析很慢,只使用少量的帧
+                num_frames = max(1, args.num_frames // 10) if data == "ascii" else args.num_frames
+                groups[data] = []
+                for i in range(num_frames):
+                    groups[data].append(osp.join(tmp_dir, f"{data}_{i:06d}.pcd"))
+                    with open(groups[data][-1], "wb") as f:
+                        f.write(encode_pcd(random_sweep(args.num_beams, args.num_columns, rng), data))
+
+        if pypcd is None:
+            print("pypcd is not installed, only benchmark the native reader")
+        for data, filenames in groups.items():
+            size = sum(os.path.getsize(f) for f in filenames) / len(filenames)
+            print(f"{data} ({len(filenames)} frames, {size / 2**20:.1f} MB/frame):")
+            loaders = [("native", load_native)] + ([("pypcd", load_pypcd)] if pypcd is not None else [])
+            for name, loader in loaders:
+                # NOTE : 文件都在page cache中,测得的是解析与解码的开销
+                cost = timeit(lambda f: loader(f, args.fields), filenames, args.repeat)
+                print(
+                    f"  {name:6s}: {len(filenames) / cost:8.1f} frames/s, {cost / len(filenames) * 1000:8.2f} ms/frame"
+                )
+
+
+if __name__ == "__main__":
+    main()
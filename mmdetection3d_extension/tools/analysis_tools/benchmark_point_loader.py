@@ -0,0 +1,99 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+"""对比float32的 .bin 与量化的 .qbin 点云的文件大小以及加载的吞吐量
+
+默认使用随机生成的点云,也可以通过 --files 指定真实的 .bin 文件
+
+Example:
+    python tools/analysis_tools/benchmark_point_loader.py --num-frames 200 --num-points 120000
+    python tools/analysis_tools/benchmark_point_loader.py --files data/USD/scene_0/LIDAR/*.bin --load-dim 4
+"""
+import argparse
+import os
+import tempfile
+import time
+from os import path as osp
+
+import numpy as np
+
+from mmdet3d_extension.datasets.pipelines.quantized_points import decode_quantized_points, encode_quantized_points
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark raw and quantized point cloud loading")
+    parser.add_argument("--files", nargs="+", default=None, help="real .bin files, use random points if not given")
+    parser.add_argument("--num-frames", type=int, default=100)
+    parser.add_argument("--num-points", type=int, default=120000)
+    parser.add_argument("--load-dim", type=int, default=4)
+    parser.add_argument("--use-dim", type=int, nargs="+", default=[0, 1, 2, 3, 4])
+    parser.add_argument("--resolution", type=float, default=0.005)
+    parser.add_argument("--repeat", type=int, default=3, help="take the best of repeat runs")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def random_points(num_points, load_dim, rng):
+    points = np.zeros((num_points, load_dim), dtype=np.float32)
+    points[:, :2] = rng.uniform(-100, 100, (num_points, 2))
+    points[:, 2] = rng.uniform(-3, 5, num_points)
+    points[:, 3] = rng.uniform(0, 255, num_points)
+    if load_dim > 4:
+        points[:, 4] = rng.integers(0, 64, num_points)
+    return points
+
+
+def load_raw(filename, load_dim, use_dim):
+    points = np.fromfile(filename, dtype=np.float32).reshape(-1, load_dim)
+    output = np.zeros((len(points), len(use_dim)), dtype=np.float32)
+    for i, dim in enumerate(use_dim):
+        if dim < load_dim:
+            output[:, i] = points[:, dim]
+    return output
+
+
+def load_quantized(filename, use_dim):
+    with open(filename, "rb") as f:
+        return decode_quantized_points(f.read(), use_dim)
+
+
+def timeit(func, filenames, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for filename in filenames:
+            func(filename)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bin_files = args.files
+        if bin_files is None:
+            bin_files = []
+            for i in range(args.num_frames):
+                bin_files.append(osp.join(tmp_dir, f"{i:06d}.bin"))
+                random_points(args.num_points, args.load_dim, rng).tofile(bin_files[-1])
+        qbin_files = []
+        for i, filename in enumerate(bin_files):
+            points = np.fromfile(filename, dtype=np.float32).reshape(-1, args.load_dim)
+            qbin_files.append(osp.join(tmp_dir, f"{i:06d}.qbin"))
+            with open(qbin_files[-1], "wb") as f:
+                f.write(encode_quantized_points(points, args.resolution, with_ring=args.load_dim > 4))
+
+        raw_size = sum(os.path.getsize(f) for f in bin_files)
+        quantized_size = sum(os.path.getsize(f) for f in qbin_files)
+        print(
+            f"{len(bin_files)} frames, size: raw {raw_size / 2**20:.1f} MB, "
+            f"quantized {quantized_size / 2**20:.1f} MB ({quantized_size / raw_size:.1%})"
+        )
+        # NOTE : 文件都在page cache中,测得的是解码的开销,在共享存储上I/O的节省与文件大小成正比
+        raw_cost = timeit(lambda f: load_raw(f, args.load_dim, args.use_dim), bin_files, args.repeat)
+        quantized_cost = timeit(lambda f: load_quantized(f, args.use_dim), qbin_files, args.repeat)
+        for name, cost in (("raw", raw_cost), ("quantized", quantized_cost)):
+            print(f"  {name:9s}: {len(bin_files) / cost:8.1f} frames/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+"""对比训练pipeline中 LoadPointsFromFileExtension 是否使用 pre_crop 时每个样本的处理时间
+
+pre_crop 的参数由config的 train_pipeline 中的 GlobalRotScaleTrans RandomFlip3D 与 PointsRangeFilter 得到,
+两次运行使用相同的随机种子,所以数据增强的参数相同
+
+Example:
+    python tools/analysis_tools/benchmark_pre_crop.py configs/pointpillars/hv_pointpillars_fpn_sbn-all_4x8_2x_usd-3d.py \\
+        --num-samples 200
+"""
+import argparse
+import copy
+import time
+
+import numpy as np
+from mmcv import Config
+
+from mmdet3d.datasets import build_dataset
+from mmdet3d_extension.datasets import *  # noqa: F401, F403
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the train pipeline with and without pre_crop")
+    parser.add_argument("config", help="train config file path")
+    parser.add_argument("--num-samples", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3, help="take the best of repeat runs")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def get_pre_crop_cfg(pipeline):
+    """由pipeline中的数据增强以及 PointsRangeFilter 得到 pre_crop 的参数"""
+    pre_crop = dict()
+    for transform in pipeline:
+        if transform["type"] == "GlobalRotScaleTrans":
+            for key in ("rot_range", "scale_ratio_range", "translation_std"):
+                if key in transform:
+                    pre_crop[key] = transform[key]
+        elif transform["type"] == "RandomFlip3D":
+            for key in ("flip_ratio_bev_horizontal", "flip_ratio_bev_vertical"):
+                pre_crop[key] = transform.get(key, 0.0)
+        elif transform["type"] == "PointsRangeFilter":
+            pre_crop["point_cloud_range"] = transform["point_cloud_range"]
+    assert "point_cloud_range" in pre_crop, "no PointsRangeFilter in the pipeline"
+    return pre_crop
+
+
+def benchmark(cfg, args):
+    dataset = build_dataset(cfg)
+    num_samples = min(args.num_samples, len(dataset))
+    best = float("inf")
+    num_points = 0
+    for _ in range(args.repeat):
+        np.random.seed(args.seed)
+        start = time.perf_counter()
+        for i in range(num_samples):
+            data = dataset[i]
+            num_points += len(data["points"].data)
+        best = min(best, time.perf_counter() - start)
+    return best / num_samples, num_points / (num_samples * args.repeat)
+
+
+def main():
+    args = parse_args()
+    cfg = Config.fromfile(args.config)
+    train_cfg = cfg.data.train.dataset if cfg.data.train.type == "CBGSDataset" else cfg.data.train
+    loader = train_cfg.pipeline[0]
+    assert loader["type"] == "LoadPointsFromFileExtension", f"unsupported loader {loader['type']}"
+
+    pre_crop_cfg = copy.deepcopy(train_cfg)
+    pre_crop_cfg.pipeline[0]["pre_crop"] = get_pre_crop_cfg(train_cfg.pipeline)
+    print(f"pre_crop: {pre_crop_cfg.pipeline[0]['pre_crop']}")
+    for name, dataset_cfg in (("baseline", train_cfg), ("pre_crop", pre_crop_cfg)):
+        cost, num_points = benchmark(dataset_cfg, args)
+        print(f"  {name:8s}: {cost * 1000:7.2f} ms/sample, {num_points:9.0f} points/sample after the pipeline")
+
+
+if __name__ == "__main__":
+    main()
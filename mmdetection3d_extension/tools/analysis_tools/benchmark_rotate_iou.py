@@ -0,0 +1,77 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+"""对比 rotate iou 的 cpu 版本与 gpu 版本的耗时,以及 cpu 版本在不同线程数下的扩展性
+
+Example:
+    python tools/analysis_tools/benchmark_rotate_iou.py --num-boxes 1000 10000 --threads 1 4 16
+"""
+import argparse
+import time
+
+import numba
+import numpy as np
+from numba import cuda
+
+from mmdet3d_extension.core.evaluation.usd_utils.rotate_iou_cpu import rotate_iou_cpu_eval
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark rotated iou on synthetic boxes")
+    parser.add_argument("--num-boxes", type=int, nargs="+", default=[1000, 10000], help="N for N x N boxes")
+    parser.add_argument("--threads", type=int, nargs="+", default=None, help="cpu thread numbers to test")
+    parser.add_argument("--range", type=float, default=100.0, help="boxes are spread in [0, range) x [0, range)")
+    parser.add_argument("--repeat", type=int, default=3, help="take the best of repeat runs")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def random_boxes(num, spread, rng):
+    """生成随机的bev box,格式为 x, y, x_size, y_size, rot"""
+    centers = rng.uniform(0, spread, (num, 2))
+    dims = rng.uniform(0.5, 5.0, (num, 2))
+    rots = rng.uniform(-np.pi, np.pi, (num, 1))
+    return np.concatenate([centers, dims, rots], axis=1).astype(np.float32)
+
+
+def timeit(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    threads = args.threads or [1, numba.config.NUMBA_NUM_THREADS]
+    threads = sorted({t for t in threads if t <= numba.config.NUMBA_NUM_THREADS})
+    use_gpu = cuda.is_available()
+    if use_gpu:
+        from mmdet3d_extension.core.evaluation.usd_utils.rotate_iou import rotate_iou_gpu_eval
+
+    # 预热,排除jit编译的耗时
+    warm = random_boxes(8, args.range, rng)
+    rotate_iou_cpu_eval(warm, warm)
+    if use_gpu:
+        rotate_iou_gpu_eval(warm, warm)
+
+    for num in args.num_boxes:
+        boxes = random_boxes(num, args.range, rng)
+        qboxes = random_boxes(num, args.range, rng)
+        print(f"{num} x {num} boxes")
+        base = None
+        for t in threads:
+            numba.set_num_threads(t)
+            cost = timeit(lambda: rotate_iou_cpu_eval(boxes, qboxes), args.repeat)
+            base = base or cost
+            print(f"  cpu {t:3d} threads: {cost:8.3f}s  speedup x{base / cost:.2f}")
+        if use_gpu:
+            cost = timeit(lambda: rotate_iou_gpu_eval(boxes, qboxes), args.repeat)
+            print(f"  gpu            : {cost:8.3f}s")
+            diff = np.abs(rotate_iou_cpu_eval(boxes, qboxes) - rotate_iou_gpu_eval(boxes, qboxes)).max()
+            print(f"  max |cpu - gpu|: {diff:.3e}")
+
+
+if __name__ == "__main__":
+    main()
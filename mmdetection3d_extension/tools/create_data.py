@@ -4,11 +4,12 @@ from os import path as osp
 
 from data_converter import lidar_converter as lidar
 from data_converter import usd_converter as usd
-from data_converter.create_gt_database import create_groundtruth_database
+from data_converter.create_gt_database import create_groundtruth_database, create_usd_groundtruth_database
+from data_converter.quantize_points import create_quantized_point_clouds
 from mmdet3d_extension import datasets
 
 
-def lidar_data_prep(root_path, info_prefix="lidar"):
+def lidar_data_prep(root_path, info_prefix="lidar", packed_gt_database=False):
     """准备lidar数据集
     目标生成三种类型的数据:
     1. lidar_infos_xxx.pkl 文件,其内容为符合自定义dataset class的中间格式文件,一般情况下有四个文件,分别为:
@@ -22,6 +23,8 @@ def lidar_data_prep(root_path, info_prefix="lidar"):
     Args:
         root_path (str): 数据集的根路径.
         info_prefix (str): 生成info文件时候指定的前缀,默认为 lidar.
+        packed_gt_database (bool): 是否将gt的点云打包保存在 lidar_gt_database_packed 中,
+            通过 PackedDataBaseSampler 使用,默认为 False.
     """
     # 创建 lidar_infos_xxx.pkl 文件
     lidar.create_lidar_info_file(data_path=root_path, pkl_prefix=info_prefix)
@@ -32,10 +35,23 @@ def lidar_data_prep(root_path, info_prefix="lidar"):
         data_path=root_path,
         info_prefix=info_prefix,
         info_path=f"{root_path}/{info_prefix}_infos_train.pkl",
+        packed=packed_gt_database,
     )
 
 
-def usd_data_prep(root_path, info_prefix="usd"):
+def usd_data_prep(
+    root_path,
+    info_prefix="usd",
+    columnar=False,
+    quantize_resolution=None,
+    shard_size=None,
+    workers=4,
+    rebuild_infos=False,
+    info_shard_size=None,
+    packed_gt_database=False,
+    num_points_in_gt=True,
+    num_features=4,
+):
     """准备lidar数据集
     目标生成三种类型的数据:
     1. usd_infos_xxx.pkl 文件,其内容为符合自定义dataset class的中间格式文件,一般情况下有四个文件,分别为:
@@ -49,17 +65,63 @@ def usd_data_prep(root_path, info_prefix="usd"):
     Args:
         root_path (str): 数据集的根路径.
         info_prefix (str): 生成info文件时候指定的前缀,默认为 usd.
+        columnar (bool): 是否同时生成可以memory-map读取的列式标注 usd_infos_xxx_columnar,默认为 False.
+        quantize_resolution (float): 不为None时将所有点云转换为该精度的量化点云 .qbin,
+            使用 LoadPointsFromQuantizedFile 加载,默认为 None.
+        shard_size (int): 不为None时将每个split的点云(量化点云)按每 shard_size 帧打包为一个shard,
+            保存在 usd_points_xxx_shards 中,通过 USDDataset 的 pts_shard_dir 使用,默认为 None.
+        workers (int): 解析label的进程数,默认为 4.
+        rebuild_infos (bool): 是否忽略 usd_infos_manifest.pkl 重新解析所有的label,默认为 False,
+            只解析新增或者改变的label.
+        info_shard_size (int): 不为None时边解析边将标注按每 info_shard_size 帧写入分片标注 usd_infos_xxx_shards,
+            不再生成 usd_infos_xxx.pkl,默认为 None.
+        packed_gt_database (bool): 是否将gt的点云打包保存在 usd_gt_database_packed 中,
+            通过 PackedDataBaseSampler 使用,默认为 False.
+        num_points_in_gt (bool): 是否读取点云计算每个gt内的点的数量,默认为 True.
+        num_features (int): 点云文件中每个点的维度,默认为 4.
     """
     # 创建 usd_infos_xxx.pkl 文件
-    usd.create_usd_info_file(data_path=root_path, pkl_prefix=info_prefix)
+    usd.create_usd_info_file(
+        data_path=root_path,
+        pkl_prefix=info_prefix,
+        columnar=columnar,
+        num_worker=workers,
+        incremental=not rebuild_infos,
+        shard_size=info_shard_size,
+        num_points_in_gt=num_points_in_gt,
+        num_features=num_features,
+    )
+    info_suffix = ".pkl" if info_shard_size is None else "_shards"
+
+    # 创建量化的点云文件
+    if quantize_resolution is not None:
+        for split in ("train", "val", "test"):
+            create_quantized_point_clouds(
+                data_path=root_path,
+                info_path=f"{root_path}/{info_prefix}_infos_{split}{info_suffix}",
+                resolution=quantize_resolution,
+            )
+
+    # 将点云打包为shard
+    if shard_size is not None:
+        for split in ("train", "val", "test"):
+            usd.create_usd_shards(
+                data_path=root_path,
+                info_path=f"{root_path}/{info_prefix}_infos_{split}{info_suffix}",
+                out_dir=f"{root_path}/{info_prefix}_points_{split}_shards",
+                samples_per_shard=shard_size,
+                file_suffix=".bin" if quantize_resolution is None else ".qbin",
+            )
 
-    # # 创建 lidar_dbinfos_train.pkl 文件和 lidar_gt_database 文件夹
-    # create_groundtruth_database(
-    #     dataset_class_name="USDDataset",
-    #     data_path=root_path,
-    #     info_prefix=info_prefix,
-    #     info_path=f"{root_path}/{info_prefix}_infos_train.pkl",
-    # )
+    # 创建 usd_dbinfos_train.pkl 文件和 usd_gt_database 文件夹
+    create_usd_groundtruth_database(
+        data_path=root_path,
+        info_prefix=info_prefix,
+        info_path=f"{root_path}/{info_prefix}_infos_train{info_suffix}",
+        num_features=num_features,
+        packed=packed_gt_database,
+        num_worker=workers,
+    )
 
 
 parser = argparse.ArgumentParser(description="Data converter arg parser")
@@ -67,6 +129,25 @@ parser.add_argument("dataset", type=str, help="name of the dataset")
 parser.add_argument("--root-path", type=str, help="specify the root path of dataset")
 parser.add_argument("--extra-tag", type=str)
 parser.add_argument("--workers", type=int, default=4, help="number of threads to be used")
+parser.add_argument("--columnar", action="store_true", help="also dump memory-mappable columnar infos (usd only)")
+parser.add_argument(
+    "--quantize-resolution", type=float, default=None, help="also write quantized .qbin point clouds (usd only)"
+)
+parser.add_argument(
+    "--shard-size", type=int, default=None, help="also pack point clouds into shards of this many frames (usd only)"
+)
+parser.add_argument(
+    "--rebuild-infos", action="store_true", help="re-parse all labels instead of only the changed ones (usd only)"
+)
+parser.add_argument(
+    "--info-shard-size", type=int, default=None, help="stream infos into shards of this many frames (usd only)"
+)
+parser.add_argument(
+    "--packed-gt-database", action="store_true", help="pack gt database points into a few mmap-able blobs"
+)
+parser.add_argument(
+    "--skip-num-points-in-gt", action="store_true", help="do not read point clouds to fill num_points_in_gt (usd only)"
+)
 args = parser.parse_args()
 
 if __name__ == "__main__":
@@ -74,9 +155,18 @@ if __name__ == "__main__":
         lidar_data_prep(
             root_path=args.root_path,
             info_prefix=args.extra_tag,
+            packed_gt_database=args.packed_gt_database,
         )
     elif args.dataset == "usd":
         usd_data_prep(
             root_path=args.root_path,
             info_prefix=args.extra_tag,
+            columnar=args.columnar,
+            quantize_resolution=args.quantize_resolution,
+            shard_size=args.shard_size,
+            workers=args.workers,
+            rebuild_infos=args.rebuild_infos,
+            info_shard_size=args.info_shard_size,
+            packed_gt_database=args.packed_gt_database,
+            num_points_in_gt=not args.skip_num_points_in_gt,
         )
@@ -1,5 +1,9 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+import functools
+import itertools
+import os
 import pickle
+from concurrent import futures
 from os import path as osp
 
 import mmcv
@@ -13,6 +17,11 @@ from pycocotools.coco import COCO
 from mmdet3d.core.bbox import box_np_ops as box_np_ops
 from mmdet3d.datasets import build_dataset
 from mmdet.core.evaluation.bbox_overlaps import bbox_overlaps
+from mmdet3d_extension.core.bbox import points_in_boxes_mask
+from mmdet3d_extension.datasets import PackedGTDatabaseWriter
+from mmdet3d_extension.datasets.usd_columnar_infos import USDColumnarInfos, is_usd_columnar_infos
+from mmdet3d_extension.datasets.usd_sharded_infos import USDShardedInfos, is_usd_sharded_infos
+from mmdet3d_extension.datasets.usd_shards import get_usd_sample_key
 
 
 def create_groundtruth_database(
@@ -23,6 +32,8 @@ def create_groundtruth_database(
     used_classes=None,
     database_save_path=None,
     db_info_save_path=None,
+    packed=False,
+    max_blob_bytes=4 * 2**30,
 ):
     """通过标注数据 原始数据等构建 lidar_gt_database.pkl 文件
     NOTE : 此函数是为了配合自定义的lidar数据集而写的,目前仅支持 lidar 一种数据集,目前没有计划支持其他数据集
@@ -38,6 +49,11 @@ def create_groundtruth_database(
                 "num_points_in_gt": int,
                 "difficulty": int (0,1,2),
                 "group_id": int, # 0,1,2,...
+                # packed=True 时额外保存以下字段, path 不再对应实际的文件
+                "blob": str, # path to the packed blob
+                "offset": int, # first point of the gt in the blob
+                "length": int, # number of points, equal to num_points_in_gt
+                "num_features": int,
             },
             ...
         ],
@@ -52,6 +68,9 @@ def create_groundtruth_database(
         used_classes (list[str], optional): Classes have been used. Default: None.
         database_save_path (str, optional): 保存gt_database的路径,默认为None.
         db_info_save_path (str, optional): Path to save db_info.
+        packed (bool, optional): 是否将所有gt的点云追加到 {info_prefix}_gt_database_packed 中少数几个blob,
+            代替每个gt一个 .bin 文件, 训练时通过 PackedDataBaseSampler 以memory-map的切片读取. Defaults to False.
+        max_blob_bytes (int, optional): packed=True 时每个blob的字节上限. Defaults to 4 GB.
     """
     print(f"Create GT Database of {dataset_class_name}")
 
@@ -89,9 +108,12 @@ def create_groundtruth_database(
     dataset = build_dataset(dataset_cfg)
 
     # 确保待保存的文件夹存在
-    database_save_path = osp.join(data_path, f"{info_prefix}_gt_database")
+    database_dir = f"{info_prefix}_gt_database_packed" if packed else f"{info_prefix}_gt_database"
+    database_save_path = osp.join(data_path, database_dir)
     db_info_save_path = osp.join(data_path, f"{info_prefix}_dbinfos_train.pkl")
     mmcv.mkdir_or_exist(database_save_path)
+    # 与 LoadPointsFromFile 的 use_dim 一致
+    writer = PackedGTDatabaseWriter(database_save_path, database_dir, 4, max_blob_bytes) if packed else None
 
     # TODO : 应该先创建该数据结构,后续往其中填充。或者直接在dataset中实现一个方法，将需要进行的操作进行封装。这样方便理解代码
     all_db_infos = dict()
@@ -114,15 +136,17 @@ def create_groundtruth_database(
         for i in range(num_obj):
             filename = f"{idx}_{names[i]}_{i}.bin"  # {raw_filename}_{class_name}_{gt_bbox_id}.bin
             abs_filepath = osp.join(database_save_path, filename)
-            rel_filepath = osp.join(f"{info_prefix}_gt_database", filename)
+            rel_filepath = osp.join(database_dir, filename)
 
             # save point clouds  for each object
             gt_points = points[point_indices[:, i]]
             gt_points[:, :3] -= gt_boxes_3d[i, :3]  # shift to center (每个点坐标减去对应的gt_box的中心)
 
             # save points which in gt_box to disk
-            with open(abs_filepath, "w") as f:
-                gt_points.tofile(f)
+            # packed 时只保存会写入db_info的gt, rel_filepath 只作为 PackedDataBaseSampler 查找db_info的key
+            if writer is None:
+                with open(abs_filepath, "w") as f:
+                    gt_points.tofile(f)
 
             if (used_classes is None) or names[i] in used_classes:
                 local_group_id = group_ids[i]
@@ -140,14 +164,198 @@ def create_groundtruth_database(
                     "difficulty": 0,  # 给一个固定的difficulty
                     "group_id": group_dict[local_group_id],
                 }
+                if writer is not None:
+                    db_info.update(writer.add(gt_points))
 
                 if names[i] in all_db_infos:
                     all_db_infos[names[i]].append(db_info)
                 else:
                     all_db_infos[names[i]] = [db_info]
 
+    if writer is not None:
+        writer.close()
+
     for k, v in all_db_infos.items():
         print(f"load {len(v)} {k} database infos")
 
     with open(db_info_save_path, "wb") as f:
         pickle.dump(all_db_infos, f)
+
+
+def create_usd_groundtruth_database(
+    data_path,
+    info_prefix,
+    info_path=None,
+    used_classes=None,
+    num_features=4,
+    packed=False,
+    max_blob_bytes=4 * 2**30,
+    num_worker=8,
+    chunk_size=16,
+):
+    """直接从 USDDataset 的info中读取点云与box,构建 usd_dbinfos_train.pkl 与 usd_gt_database,
+    db_info 的格式与 create_groundtruth_database 相同
+
+    不经过训练的pipeline, 每 num_worker * chunk_size 帧交给进程池并行提取gt内的点,进程之间只传递点云路径与box.
+    每一帧通过 points_in_boxes_mask 的BEV网格预筛选,每个box只测试附近的点. 进程池按帧的顺序返回结果,
+    group_id 在主进程中按帧以及gt的顺序分配,所以结果与进程数无关. 点云文件不存在的帧会被跳过
+
+    NOTE : info中的box为中心点在box中心的LiDAR box, box3d_lidar 与 USDDataset 的gt一致,转换为底面中心,
+        gt内的点减去底面中心的坐标. 只支持LiDAR box, 其他box类型在启动进程池之前抛出 ValueError
+
+    Args:
+        data_path (str): 数据集根路径.
+        info_prefix (str): 数据集前缀,默认为usd.
+        info_path (str, optional): usd_infos_train.pkl, 列式标注或者分片标注的路径.
+            Defaults to None, 使用 {data_path}/{info_prefix}_infos_train.pkl.
+        used_classes (list[str], optional): 需要保存的类别. Defaults to None, 保存所有类别.
+        num_features (int, optional): 点云文件中每个点的维度. Defaults to 4.
+        packed (bool, optional): 是否将gt的点云打包保存在 {info_prefix}_gt_database_packed 中,
+            参考 create_groundtruth_database. Defaults to False.
+        max_blob_bytes (int, optional): packed=True 时每个blob的字节上限. Defaults to 4 GB.
+        num_worker (int, optional): 并行处理的进程数,不大于1时在当前进程中处理. Defaults to 8.
+        chunk_size (int, optional): 每个进程一次处理的帧数. Defaults to 16.
+    """
+    if info_path is None:
+        info_path = osp.join(data_path, f"{info_prefix}_infos_train.pkl")
+    print(f"Create GT Database of USDDataset from {info_path}")
+    if is_usd_columnar_infos(info_path):
+        infos = USDColumnarInfos(info_path)
+    elif is_usd_sharded_infos(info_path):
+        infos = USDShardedInfos(info_path)
+    else:
+        infos = mmcv.load(info_path)
+
+    database_dir = f"{info_prefix}_gt_database_packed" if packed else f"{info_prefix}_gt_database"
+    database_save_path = osp.join(data_path, database_dir)
+    db_info_save_path = osp.join(data_path, f"{info_prefix}_dbinfos_train.pkl")
+    mmcv.mkdir_or_exist(database_save_path)
+    writer = PackedGTDatabaseWriter(database_save_path, database_dir, num_features, max_blob_bytes) if packed else None
+
+    # 不打包时每个gt的点云在进程中直接写入文件,只返回db_info
+    extract_func = functools.partial(
+        _extract_usd_gt_objects,
+        data_path=data_path,
+        database_dir=database_dir,
+        num_features=num_features,
+        used_classes=None if used_classes is None else set(used_classes),
+        save=not packed,
+    )
+    # 在启动进程池之前检查所有帧的box类型,只支持中心点在box中心的LiDAR box
+    unsupported = sorted(_get_usd_box_types(infos) - {"LiDAR"})
+    if len(unsupported) > 0:
+        raise ValueError(f"{info_path} contains unsupported box_type_3d {unsupported}, only LiDAR is supported")
+
+    num_worker = min(num_worker, os.cpu_count() or 1)
+    executor = futures.ProcessPoolExecutor(num_worker) if num_worker > 1 else None
+
+    all_db_infos = dict()
+    group_counter = 0
+    prog_bar = mmcv.ProgressBar(len(infos))
+    try:
+        infos = iter(infos)
+        while True:
+            # 按块提交,不需要一次读取所有的info
+            chunk = list(itertools.islice(infos, max(num_worker, 1) * chunk_size))
+            if len(chunk) == 0:
+                break
+            tasks = [_get_usd_gt_task(info) for info in chunk]
+            if executor is None:
+                results = map(extract_func, tasks)
+            else:
+                results = executor.map(extract_func, tasks, chunksize=chunk_size)
+            for objects in results:
+                # 每个gt为一个group, group_id 按帧以及gt的顺序递增
+                for db_info, gt_points in objects:
+                    db_info["group_id"] = group_counter
+                    group_counter += 1
+                    if writer is not None:
+                        db_info.update(writer.add(gt_points))
+                    all_db_infos.setdefault(db_info["name"], []).append(db_info)
+                prog_bar.update()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if writer is not None:
+            writer.close()
+
+    for k, v in all_db_infos.items():
+        print(f"load {len(v)} {k} database infos")
+
+    with open(db_info_save_path, "wb") as f:
+        pickle.dump(all_db_infos, f)
+
+
+def _get_usd_box_types(infos):
+    """所有有点云标注的帧的 box_type_3d, 列式标注直接读取 box_type_3d 列,其他格式遍历一次所有帧
+
+    Returns:
+        set[str]: 不重复的box类型
+    """
+    if isinstance(infos, USDColumnarInfos):
+        return set(np.unique(np.asarray(infos.box_type_3d)).tolist())
+    return {info["point_clouds"]["LIDAR"]["annos"]["box_type_3d"] for info in infos if info["point_clouds"]}
+
+
+def _get_usd_gt_task(info):
+    """一帧中需要传递给进程池的数据: 点云文件相对于数据集根路径的路径, 样本名, box, 类别名称"""
+    lidar_info = info["point_clouds"]["LIDAR"] if info["point_clouds"] else None
+    if lidar_info is None:
+        return None
+    annos = lidar_info["annos"]
+    sample_idx = f"{info['scene_name']}_{info['seq']}"
+    return get_usd_sample_key(info), sample_idx, annos["bbox3d"], annos["class_names"]
+
+
+def _extract_usd_gt_objects(task, data_path, database_dir, num_features=4, used_classes=None, save=True):
+    """提取一帧中每个gt内的点, 在进程池中调用所以定义在模块中
+
+    Args:
+        task (tuple | None): _get_usd_gt_task 的结果, 没有点云标注的帧为None
+        data_path (str): 数据集根路径
+        database_dir (str): gt点云的保存路径,相对于 data_path
+        num_features (int, optional): 点云文件中每个点的维度. Defaults to 4.
+        used_classes (set[str], optional): 需要保存的类别. Defaults to None, 保存所有类别.
+        save (bool, optional): 是否将每个gt的点云保存为 {database_dir}/{sample_idx}_{class_name}_{gt_idx}.bin.
+            Defaults to True.
+
+    Returns:
+        list[tuple]: 每个需要保存的gt的 (db_info, gt_points), save=True 时 gt_points 为None,
+            点云文件不存在时为空list
+    """
+    if task is None:
+        return []
+    pts_path, sample_idx, bbox3d, class_names = task
+    names = np.asarray(class_names).reshape(-1)
+    if len(names) == 0:
+        return []
+    try:
+        points = np.fromfile(osp.join(data_path, pts_path), dtype=np.float32).reshape(-1, num_features)
+    except FileNotFoundError:
+        return []
+    boxes = np.asarray(bbox3d, dtype=np.float32).reshape(len(names), -1)
+    point_indices = points_in_boxes_mask(points, boxes[:, :7])
+    # 与 USDDataset 中的gt相同,转换为底面中心
+    boxes_lidar = boxes.copy()
+    boxes_lidar[:, 2] -= boxes_lidar[:, 5] / 2
+
+    objects = []
+    for i, name in enumerate(names):
+        if used_classes is not None and name not in used_classes:
+            continue
+        filename = f"{sample_idx}_{name}_{i}.bin"  # {sample_idx}_{class_name}_{gt_bbox_id}.bin
+        gt_points = points[point_indices[i]]
+        gt_points[:, :3] -= boxes_lidar[i, :3]  # shift to bottom center
+        if save:
+            gt_points.tofile(osp.join(data_path, database_dir, filename))
+        db_info = {
+            "name": str(name),
+            "path": osp.join(database_dir, filename),
+            "idx": sample_idx,
+            "gt_idx": i,
+            "box3d_lidar": boxes_lidar[i],
+            "num_points_in_gt": gt_points.shape[0],
+            "difficulty": 0,  # 给一个固定的difficulty
+        }
+        objects.append((db_info, None if save else gt_points))
+    return objects
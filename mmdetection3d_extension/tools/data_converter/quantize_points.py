@@ -0,0 +1,55 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+import os
+from concurrent import futures as futures
+from os import path as osp
+
+import mmcv
+import numpy as np
+
+from mmdet3d_extension.datasets.pipelines.quantized_points import encode_quantized_points
+from mmdet3d_extension.datasets.usd_columnar_infos import USDColumnarInfos, is_usd_columnar_infos
+from mmdet3d_extension.datasets.usd_sharded_infos import USDShardedInfos, is_usd_sharded_infos
+
+
+def create_quantized_point_clouds(
+    data_path, info_path, num_features=4, resolution=0.005, with_ring=False, file_suffix=".qbin", num_worker=8
+):
+    """将info中所有帧的float32点云 .bin 转换为量化的点云,保存在 .bin 的同一目录下,后缀为 file_suffix
+    训练时使用 LoadPointsFromQuantizedFile 加载
+
+    Args:
+        data_path (str): 数据集的根路径
+        info_path (str): usd_infos_xxx.pkl, 列式标注或者分片标注的路径
+        num_features (int, optional): .bin 中每个点的维度. Defaults to 4.
+        resolution (float, optional): xyz的量化精度,单位为m. Defaults to 0.005.
+        with_ring (bool, optional): 是否保存ring(第5维). Defaults to False.
+        file_suffix (str, optional): 量化点云文件的后缀. Defaults to ".qbin".
+        num_worker (int, optional): 并行处理的数量. Defaults to 8.
+    """
+    if is_usd_columnar_infos(info_path):
+        infos = USDColumnarInfos(info_path)
+    elif is_usd_sharded_infos(info_path):
+        infos = USDShardedInfos(info_path)
+    else:
+        infos = mmcv.load(info_path)
+    pts_filenames = [
+        osp.join(data_path, info["scene_name"], "LIDAR", info["point_clouds"]["LIDAR"]["file_name"]) for info in infos
+    ]
+
+    def map_func(pts_filename):
+        if not osp.exists(pts_filename):
+            return 0, 0
+        points = np.fromfile(pts_filename, dtype=np.float32).reshape(-1, num_features)
+        out_filename = osp.splitext(pts_filename)[0] + file_suffix
+        with open(out_filename, "wb") as f:
+            f.write(encode_quantized_points(points, resolution=resolution, with_ring=with_ring))
+        return os.path.getsize(pts_filename), os.path.getsize(out_filename)
+
+    print(f"Quantize {len(pts_filenames)} point clouds of {info_path}")
+    with futures.ThreadPoolExecutor(num_worker) as executor:
+        sizes = np.array(list(mmcv.track_iter_progress((executor.map(map_func, pts_filenames), len(pts_filenames)))))
+    raw_size, quantized_size = sizes.sum(0) if len(sizes) > 0 else (0, 0)
+    print(
+        f"\nraw {raw_size / 2**20:.1f} MB -> quantized {quantized_size / 2**20:.1f} MB "
+        f"({quantized_size / max(raw_size, 1):.1%})"
+    )
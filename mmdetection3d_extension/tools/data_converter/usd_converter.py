@@ -1,15 +1,49 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+import functools
+import itertools
+import os
 from collections import OrderedDict
+from concurrent import futures as futures
+from os import path as osp
 from pathlib import Path
 
 import mmcv
 import numpy as np
 
 from mmdet3d.core.bbox import box_np_ops, points_cam2img
-from .usd_data_utils import get_usd_info
+from mmdet3d_extension.core.bbox import points_in_boxes_count
+from mmdet3d_extension.datasets.pipelines.quantized_points import QUANTIZED_HEADER
+from mmdet3d_extension.datasets.usd_columnar_infos import (
+    USDColumnarInfos,
+    dump_usd_columnar_infos,
+    is_usd_columnar_infos,
+)
+from mmdet3d_extension.datasets.usd_sharded_infos import (
+    USDShardedInfos,
+    USDShardedInfosWriter,
+    is_usd_sharded_infos,
+)
+from mmdet3d_extension.datasets.usd_shards import (
+    USD_SHARD_HEADER,
+    USD_SHARD_INDEX_DTYPE,
+    USD_SHARD_INDEX_FILE,
+    USD_SHARD_MAGIC,
+    USD_SHARD_VERSION,
+    get_usd_sample_key,
+)
+from .usd_data_utils import get_usd_info_incremental
 
 
-def create_usd_info_file(data_path, pkl_prefix="lidar"):
+def create_usd_info_file(
+    data_path,
+    pkl_prefix="lidar",
+    columnar=False,
+    num_worker=8,
+    incremental=True,
+    shard_size=None,
+    num_points_in_gt=True,
+    num_features=4,
+):
     """解析数据集,创建中间格式 usd_info_xxx.pkl 文件并存储
     数据格式：
     [
@@ -60,40 +94,170 @@ def create_usd_info_file(data_path, pkl_prefix="lidar"):
     Args:
         data_path (str): Path of the data root.
         pkl_prefix (str, optional): Default: 'lidar'.
+        columnar (bool, optional): 是否同时保存列式的标注 {pkl_prefix}_infos_xxx_columnar,
+            USDDataset 可以以memory-map的方式读取. Default: False.
+        num_worker (int, optional): 解析label的进程数. Default: 8.
+        incremental (bool, optional): 是否增量更新, 每个split的label路径以及对应的mtime与大小保存在
+            {pkl_prefix}_infos_manifest.pkl 中,再次运行时只重新解析新增或者改变的label,
+            其余的info从已有的 {pkl_prefix}_infos_xxx.pkl 中复用. 每个split的info写入完成后立即更新manifest,
+            写入之前先从manifest中删除该split,中途退出时manifest不会与新写入的info错误的对应. Default: True.
+        shard_size (int, optional): 不为None时不再保存单个pkl,而是边解析边按每 shard_size 帧写入分片标注
+            {pkl_prefix}_infos_xxx_shards, 内存中最多只保存一个分片,中途退出时已经写入的分片不会丢失.
+            USDDataset 的 ann_file 可以直接指定该文件夹. Default: None.
+        num_points_in_gt (bool, optional): 是否读取点云计算每个gt内的点的数量,用于按难度过滤gt以及
+            gt database 的过滤, 增量更新时只计算重新解析的label. Default: True.
+        num_features (int, optional): 计算 num_points_in_gt 时读取点云文件的维度. Default: 4.
     """
     data_path = Path(data_path)
-    train_label_path_list = _read_file(str(data_path / "train.txt"))
-    val_label_path_list = _read_file(str(data_path / "val.txt"))
-    test_label_path_list = _read_file(str(data_path / "test.txt"))
+    save_path = Path(data_path)  # 默认保存在data_path下
+    manifest_path = save_path / f"{pkl_prefix}_infos_manifest.pkl"
+    manifests = mmcv.load(manifest_path) if incremental and manifest_path.exists() else dict()
+    # 之前生成的info中没有计算 num_points_in_gt 时需要全部重新生成
+    if num_points_in_gt and not manifests.get("num_points_in_gt", False):
+        manifests = dict()
+    manifests["num_points_in_gt"] = num_points_in_gt
+    postprocess = None
+    if num_points_in_gt:
+        postprocess = functools.partial(
+            _calculate_num_points_in_gt, str(data_path), num_features=num_features, num_worker=num_worker
+        )
 
     print("Generate info. this may take several minutes.")
-    save_path = Path(data_path)  # 默认保存在data_path下
+    # 暂时不知道为什么要保存trainval, 所以只生成 train val test
+    for split in ("train", "val", "test"):
+        label_path_list = _read_file(str(data_path / f"{split}.txt"))
+        if shard_size is None:
+            filename = save_path / f"{pkl_prefix}_infos_{split}.pkl"
+            infos = mmcv.load(filename) if split in manifests and filename.exists() else None
+        else:
+            filename = save_path / f"{pkl_prefix}_infos_{split}_shards"
+            infos = USDShardedInfos(str(filename)) if split in manifests and is_usd_sharded_infos(filename) else None
+        lidar_infos, manifest, num_changed = get_usd_info_incremental(
+            path=data_path,
+            label_path_list=label_path_list,
+            manifest=manifests.get(split),
+            infos=infos,
+            num_worker=num_worker,
+            postprocess=postprocess,
+        )
+        print(f"USD info {split}: {num_changed} of {len(label_path_list)} labels are parsed")
+        print(f"USD info {split} file is saved to {filename}")
+        if shard_size is None:
+            lidar_infos = list(lidar_infos)
+        # info写入的过程中退出时,该split之前的manifest已经不能与写入的info对应,下次运行时全部重新解析
+        manifests.pop(split, None)
+        mmcv.dump(manifests, manifest_path)
+        if shard_size is None:
+            mmcv.dump(lidar_infos, filename)
+        else:
+            with USDShardedInfosWriter(str(filename), shard_size=shard_size) as writer:
+                writer.extend(lidar_infos)
+        manifests[split] = manifest
+        mmcv.dump(manifests, manifest_path)
+        if columnar:
+            # 列式标注需要所有帧,使用分片标注时从写入的分片中按顺序读取
+            lidar_infos = lidar_infos if shard_size is None else USDShardedInfos(str(filename))
+            _dump_columnar(lidar_infos, save_path / f"{pkl_prefix}_infos_{split}_columnar")
+
+
+def _dump_columnar(infos, path):
+    print(f"USD columnar info is saved to {path}")
+    dump_usd_columnar_infos(infos, str(path))
+
+
+def create_usd_shards(
+    data_path, info_path, out_dir, samples_per_shard=1024, file_suffix=".bin", num_features=4, num_worker=8
+):
+    """将info中所有帧的点云按info的顺序打包为若干个shard文件,每个shard包含 samples_per_shard 帧,
+    并在 out_dir 中保存全局的索引 shard_index.npz, 训练时通过 USDDataset 的 pts_shard_dir 使用.
+    shard的格式参考 mmdet3d_extension/datasets/usd_shards.py
+
+    大量的小文件在NFS等共享存储上的打开与元数据访问开销很大,打包后每个worker只需要打开少数几个大文件
+
+    Args:
+        data_path (str): 数据集的根路径
+        info_path (str): usd_infos_xxx.pkl, 列式标注或者分片标注的路径
+        out_dir (str): shard文件的保存路径
+        samples_per_shard (int, optional): 每个shard包含的帧数. Defaults to 1024.
+        file_suffix (str, optional): 打包的点云文件的后缀, .bin 或者量化点云 .qbin. Defaults to ".bin".
+        num_features (int, optional): .bin 中每个点的维度,用于计算点的数量. Defaults to 4.
+        num_worker (int, optional): 并行写入shard的数量. Defaults to 8.
+    """
+    if is_usd_columnar_infos(info_path):
+        infos = USDColumnarInfos(info_path)
+    elif is_usd_sharded_infos(info_path):
+        infos = USDShardedInfos(info_path)
+    else:
+        infos = mmcv.load(info_path)
+    payload_format = "qbin" if file_suffix == ".qbin" else "float32"
+    # 点云文件不存在的帧不写入shard,加载时仍然访问 pts_filename
+    samples = []
+    for info in infos:
+        key = get_usd_sample_key(info)
+        pts_filename = osp.splitext(osp.join(data_path, key))[0] + file_suffix
+        if osp.exists(pts_filename):
+            samples.append((key, pts_filename))
+    chunks = [samples[i : i + samples_per_shard] for i in range(0, len(samples), samples_per_shard)]
+    shard_names = [f"usd_points_{i:05d}.shard" for i in range(len(chunks))]
+    mmcv.mkdir_or_exist(out_dir)
+
+    def map_func(shard_id):
+        filenames = [pts_filename for _, pts_filename in chunks[shard_id]]
+        index = _write_usd_shard(osp.join(out_dir, shard_names[shard_id]), filenames, payload_format)
+        return index, _get_shard_num_points(
+            osp.join(out_dir, shard_names[shard_id]), index, payload_format, num_features
+        )
+
+    print(f"Pack {len(samples)} point clouds of {info_path} into {len(chunks)} shards")
+    with futures.ThreadPoolExecutor(num_worker) as executor:
+        results = list(mmcv.track_iter_progress((executor.map(map_func, range(len(chunks))), len(chunks))))
+
+    index = np.concatenate([r[0] for r in results]) if results else np.zeros((0,), dtype=USD_SHARD_INDEX_DTYPE)
+    np.savez(
+        osp.join(out_dir, USD_SHARD_INDEX_FILE),
+        payload_format=np.array(payload_format),
+        shard_names=np.array(shard_names, dtype=str),
+        keys=np.array([key for key, _ in samples], dtype=str),
+        shard_ids=np.repeat(np.arange(len(chunks), dtype=np.int32), [len(chunk) for chunk in chunks]),
+        offsets=index["offset"],
+        lengths=index["length"],
+        num_points=np.concatenate([r[1] for r in results]) if results else np.zeros((0,), dtype=np.int64),
+    )
+    print(f"\nUSD shard index is saved to {osp.join(out_dir, USD_SHARD_INDEX_FILE)}")
+
+
+def _write_usd_shard(shard_path, filenames, payload_format):
+    """将多个点云文件的内容依次写入一个shard文件,header与索引在所有数据写入之后回填
+
+    Returns:
+        np.ndarray: [len(filenames)] 每个文件在shard中的 offset 与 length
+    """
+    index = np.zeros((len(filenames),), dtype=USD_SHARD_INDEX_DTYPE)
+    with open(shard_path, "wb") as f:
+        offset = USD_SHARD_HEADER.size + index.nbytes
+        f.seek(offset)
+        for i, filename in enumerate(filenames):
+            with open(filename, "rb") as src:
+                data = src.read()
+            f.write(data)
+            index[i] = (offset, len(data))
+            offset += len(data)
+        f.seek(0)
+        f.write(USD_SHARD_HEADER.pack(USD_SHARD_MAGIC, USD_SHARD_VERSION, len(filenames), payload_format.encode()))
+        f.write(index.tobytes())
+    return index
+
 
-    # save train info
-    lidar_infos_train = get_usd_info(path=data_path, label_path_list=train_label_path_list)
-    # _calculate_num_points_in_gt(lidar_infos_train) # 不知道为啥要计算gt中点的数量
-    filename = save_path / f"{pkl_prefix}_infos_train.pkl"
-    print(f"USD info train file is saved to {filename}")
-    mmcv.dump(lidar_infos_train, filename)
-
-    # save val info
-    lidar_infos_val = get_usd_info(path=data_path, label_path_list=val_label_path_list)
-    # _calculate_num_points_in_gt(lidar_infos_val)
-    filename = save_path / f"{pkl_prefix}_infos_val.pkl"
-    print(f"USD info val file is saved to {filename}")
-    mmcv.dump(lidar_infos_val, filename)
-
-    # 暂时不知道为什么要保存trainval
-    # # save trainval info (train_info + val_info)
-    # filename = save_path / f"{pkl_prefix}_infos_trainval.pkl"
-    # print(f"USD info trainval file is saved to {filename}")
-    # mmcv.dump(lidar_infos_train + lidar_infos_val, filename)
-
-    # test info
-    lidar_infos_test = get_usd_info(path=data_path, label_path_list=test_label_path_list)
-    filename = save_path / f"{pkl_prefix}_infos_test.pkl"
-    print(f"USD info test file is saved to {filename}")
-    mmcv.dump(lidar_infos_test, filename)
+def _get_shard_num_points(shard_path, index, payload_format, num_features):
+    """每个样本中点的数量, .bin 由数据的长度计算,量化点云从其header中读取"""
+    if payload_format == "float32":
+        return (index["length"] // (4 * num_features)).astype(np.int64)
+    num_points = np.zeros((len(index),), dtype=np.int64)
+    with open(shard_path, "rb") as f:
+        for i, offset in enumerate(index["offset"]):
+            f.seek(int(offset))
+            num_points[i] = QUANTIZED_HEADER.unpack(f.read(QUANTIZED_HEADER.size))[1]
+    return num_points
 
 
 def _read_file(path):
@@ -104,36 +268,74 @@ def _read_file(path):
     return [str(line) for line in lines]
 
 
-def _calculate_num_points_in_gt(infos, num_features=4):
-    """计算在ground truth box内的点的 indices, 并保存在info["annos"]["num_points_in_gt"]中.
+def _calculate_num_points_in_gt(data_path, infos, num_features=4, num_worker=8, chunk_size=64):
+    """按顺序逐个生成填充了 num_points_in_gt 的info, 每一帧的gt内点的数量保存在
+    info["point_clouds"]["LIDAR"]["annos"]["num_points_in_gt"] 中
+
+    每 num_worker * chunk_size 帧交给进程池并行计算,进程之间只传递点云路径与box,
+    每一帧通过 points_in_boxes_count 的BEV网格预筛选,每个box只测试附近的点. 点云文件不存在的帧保持原来的值
 
     Args:
-        infos (list[dict]): Info of the input lidar data.
+        data_path (str): 数据集的根路径
+        infos (Iterable[dict]): usd_infos_xxx.pkl 格式的info, 可以是生成器
         num_features (int, optional): 读取点云文件的维度. Default: 4.
+        num_worker (int, optional): 并行计算的进程数,不大于1时在当前进程中计算. Default: 8.
+        chunk_size (int, optional): 每个进程一次处理的帧数. Default: 64.
 
-    但是因为我们的label是在lidar坐标系下的,所以这里不需要转换.所以需要对本函数进行一定的修改
+    Yields:
+        dict: 填充了 num_points_in_gt 的info
     """
-    for info in mmcv.track_iter_progress(infos):
-        pc_info = info["point_cloud"]
-        v_path = pc_info["path"]
-        points_v = np.fromfile(v_path, dtype=np.float32, count=-1).reshape([-1, num_features])
+    num_worker = min(num_worker, os.cpu_count() or 1)
+    count_func = functools.partial(_count_points_in_gt, num_features=num_features)
+    executor = futures.ProcessPoolExecutor(num_worker) if num_worker > 1 else None
+    try:
+        infos = iter(infos)
+        while True:
+            # 按块提交,不需要一次读取所有的info
+            chunk = list(itertools.islice(infos, max(num_worker, 1) * chunk_size))
+            if len(chunk) == 0:
+                break
+            lidar_infos = [info["point_clouds"]["LIDAR"] if info["point_clouds"] else None for info in chunk]
+            tasks = [
+                (osp.join(data_path, get_usd_sample_key(info)), lidar_info["annos"]["bbox3d"])
+                for info, lidar_info in zip(chunk, lidar_infos)
+                if lidar_info is not None
+            ]
+            if executor is None:
+                counts = map(count_func, tasks)
+            else:
+                counts = executor.map(count_func, tasks, chunksize=chunk_size)
+            for info, lidar_info in zip(chunk, lidar_infos):
+                if lidar_info is not None:
+                    num_points_in_gt = next(counts)
+                    if num_points_in_gt is not None:
+                        lidar_info["annos"]["num_points_in_gt"] = num_points_in_gt
+                yield info
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
-        # points_v = points_v[points_v[:, 0] > 0]
-        annos = info["annos"]
-        num_obj = len([n for n in annos["name"] if n != "DontCare"])
 
-        dims = annos["dimensions"][:num_obj]
-        loc = annos["location"][:num_obj]
-        rots = annos["rotation_y"][:num_obj]
+def _count_points_in_gt(task, num_features=4):
+    """计算一帧中每个gt内的点的数量, 在进程池中调用所以定义在模块中
 
-        # Boxes3d with rotation : [x, y, z, x_size, y_size, z_size, yaw]
-        gt_boxes_lidar = np.concatenate([loc, dims, rots[..., np.newaxis]], axis=1)
-        indices = box_np_ops.points_in_rbbox(points_v[:, :3], gt_boxes_lidar)
+    Args:
+        task (tuple): 点云文件的路径以及 [M, 7+] 的box
+        num_features (int, optional): 读取点云文件的维度. Default: 4.
 
-        num_points_in_gt = indices.sum(0)
-        num_ignored = len(annos["dimensions"]) - num_obj
-        num_points_in_gt = np.concatenate([num_points_in_gt, -np.ones([num_ignored])])
-        annos["num_points_in_gt"] = num_points_in_gt.astype(np.int32)
+    Returns:
+        np.ndarray | None: [M] int32, 点云文件不存在时为None
+    """
+    pts_filename, bbox3d = task
+    if len(bbox3d) == 0:
+        # 没有gt的帧不需要读取点云
+        return np.zeros((0,), dtype=np.int32)
+    try:
+        points = np.fromfile(pts_filename, dtype=np.float32).reshape(-1, num_features)
+    except FileNotFoundError:
+        return None
+    boxes = np.asarray(bbox3d, dtype=np.float32).reshape(len(bbox3d), -1)
+    return points_in_boxes_count(points, boxes[:, :7]).astype(np.int32)
 
 
 def _create_reduced_point_cloud(data_path, info_path, save_path=None, back=False, num_features=4, front_camera_id=2):
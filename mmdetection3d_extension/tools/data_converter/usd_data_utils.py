@@ -1,10 +1,10 @@
 # Copyright (c) OpenMMLab. All rights reserved.
 import os
 import json
+import functools
 from collections import OrderedDict
 from concurrent import futures as futures
 from os import path as osp
-from pathlib import Path
 
 import mmcv
 import numpy as np
@@ -12,38 +12,119 @@ from PIL import Image
 from skimage import io
 
 
-def get_usd_info(path, label_path_list: list, num_worker=8):
+def get_usd_info(path, label_path_list: list, num_worker=8, chunk_size=64):
     """获取lidar数据的信息
 
     Args:
         path (str): 数据集的根路径
         label_path_list (list): 需要读取的label的文件名list
-        num_worker (int): 并行处理的数量
+        num_worker (int): 并行处理的进程数,不大于1时在当前进程中处理
+        chunk_size (int): 每个进程一次处理的label数量
 
+    Returns:
+        list[dict]: 与 label_path_list 顺序相同的info
+    """
+    return list(iter_usd_info(path, label_path_list, num_worker, chunk_size))
+
+
+def iter_usd_info(path, label_path_list: list, num_worker=8, chunk_size=64):
+    """按 label_path_list 的顺序逐个生成lidar数据的信息,已经生成的info不会保存在内存中
+
+    json的解析与后处理受GIL限制,多线程几乎没有加速,这里使用进程池,
+    每个进程一次处理 chunk_size 个label以减少进程间通信的次数
+
+    Args:
+        参考 get_usd_info
+
+    Yields:
+        dict: info dict
+    """
+    load_func = functools.partial(_load_usd_label, str(path))
+    # 进程数超过cpu核数时只会增加进程间通信的开销
+    num_worker = min(num_worker, os.cpu_count() or 1)
+    if num_worker <= 1 or len(label_path_list) <= chunk_size:
+        yield from map(load_func, label_path_list)
+        return
+    with futures.ProcessPoolExecutor(num_worker) as executor:
+        yield from executor.map(load_func, label_path_list, chunksize=chunk_size)
+
+
+def get_usd_label_stats(path, label_path_list: list):
+    """获取label文件的修改时间与大小,用于判断label是否需要重新解析
+
+    Args:
+        path (str): 数据集的根路径
+        label_path_list (list): label的文件名list
+
+    Returns:
+        list[tuple]: 每个label的 (mtime_ns, size)
     """
-    root_path = Path(path)
+    stats = []
+    for label_path in label_path_list:
+        stat = os.stat(os.path.join(path, label_path))
+        stats.append((stat.st_mtime_ns, stat.st_size))
+    return stats
+
 
-    def map_func(label_path):
-        """根据文件名获取该文件名所对应的原始数据、label等相关信息
+def get_usd_info_incremental(
+    path, label_path_list: list, manifest=None, infos=None, num_worker=8, chunk_size=64, postprocess=None
+):
+    """增量的获取lidar数据的信息,只重新解析新增的以及修改时间或大小改变的label,其余的info直接复用
+
+    Args:
+        path (str): 数据集的根路径
+        label_path_list (list): 需要读取的label的文件名list
+        manifest (dict, optional): 上一次生成 infos 时的 dict(label_paths=list, stats=list),
+            stats 为 get_usd_label_stats 的结果,与 infos 一一对应. Defaults to None, 全部重新解析.
+        infos (list[dict] | USDShardedInfos, optional): 上一次生成的info, 只按index访问需要复用的帧.
+            Defaults to None.
+        num_worker (int): 并行处理的进程数
+        chunk_size (int): 每个进程一次处理的label数量
+        postprocess (callable, optional): 只作用于重新解析的info的生成器,输入与输出都是info的迭代器,
+            例如计算 num_points_in_gt. Defaults to None.
 
-        Args:
-            label_path (str): label相交于跟目录的路径(包含label的后缀)
+    Returns:
+        tuple: 按 label_path_list 的顺序生成info的迭代器, 新的manifest (dict) 以及需要重新解析的label数量 (int)
+    """
+    stats = get_usd_label_stats(path, label_path_list)
+    previous = dict()
+    if manifest is not None and infos is not None and len(manifest["label_paths"]) == len(infos):
+        for i, (label_path, stat) in enumerate(zip(manifest["label_paths"], manifest["stats"])):
+            previous[label_path] = (tuple(stat), i)
 
-        Returns:
-            dict: info dict
-        """
-        label_path = os.path.join(root_path, label_path)
-        # load json file and convert to dict
-        label = json.load(open(label_path))
-        # label = json.loads(label)  # convert str to dict
+    # 每一帧在上一次的infos中的index, 需要重新解析时为-1
+    reuse = [previous[p][1] if p in previous and previous[p][0] == s else -1 for p, s in zip(label_path_list, stats)]
+    changed = [label_path for label_path, i in zip(label_path_list, reuse) if i < 0]
 
-        # 将从json文件中读取的label进行一些补全操作
-        return __label_postprocess(label)
+    def merge():
+        changed_infos = iter_usd_info(path, changed, num_worker, chunk_size)
+        if postprocess is not None:
+            changed_infos = postprocess(changed_infos)
+        for i in reuse:
+            yield infos[i] if i >= 0 else next(changed_infos)
+        changed_infos.close()
 
-    with futures.ThreadPoolExecutor(num_worker) as executor:
-        usd_infos = executor.map(map_func, label_path_list)
+    manifest = dict(label_paths=list(label_path_list), stats=stats)
+    return merge(), manifest, len(changed)
+
+
+def _load_usd_label(root_path, label_path):
+    """根据文件名获取该文件名所对应的原始数据、label等相关信息, 在进程池中调用所以定义在模块中
+
+    Args:
+        root_path (str): 数据集的根路径
+        label_path (str): label相交于跟目录的路径(包含label的后缀)
+
+    Returns:
+        dict: info dict
+    """
+    label_path = os.path.join(root_path, label_path)
+    # load json file and convert to dict
+    with open(label_path) as f:
+        label = json.load(f)
 
-    return list(usd_infos)
+    # 将从json文件中读取的label进行一些补全操作
+    return __label_postprocess(label)
 
 
 def __label_postprocess(label):
@@ -72,7 +153,7 @@ def __label_postprocess(label):
         annos["truncated"] = np.array(annos["truncated"], dtype=np.int32).reshape(-1)
         annos["occluded"] = np.array(annos["occluded"], dtype=np.int32).reshape(-1)
         if annos["num_points_in_gt"] is None:
-            annos["num_points_in_gt"] = np.zeros(len(annos["class_names"], dtype=np.int32))
+            annos["num_points_in_gt"] = np.zeros(len(annos["class_names"]), dtype=np.int32)
         else:
             annos["num_points_in_gt"] = np.array(annos["num_points_in_gt"]).reshape(-1)
         return annos
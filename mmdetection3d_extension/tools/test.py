@@ -17,6 +17,8 @@ from mmdet3d.datasets import build_dataloader, build_dataset
 from mmdet3d.models import build_model
 from mmdet.apis import multi_gpu_test, set_random_seed
 from mmdet.datasets import replace_ImageToTensor
+from mmdet3d_extension.core.evaluation.usd_utils import warmup as usd_eval_warmup
+from mmdet3d_extension.datasets import *  # noqa: F401, F403
 
 if mmdet.__version__ > '2.23.0':
     # If mmdet version > 2.23.0, setup_multi_processes would be imported and
@@ -107,6 +109,11 @@ def parse_args():
         action=DictAction,
         help='custom options for evaluation, the key-value pair in xxx=yyy '
         'format will be kwargs for dataset.evaluate() function')
+    parser.add_argument(
+        '--online-eval',
+        action='store_true',
+        help='evaluate each batch as soon as it comes off the model instead '
+        'of keeping all the outputs, only for single gpu testing with --eval')
     parser.add_argument(
         '--launcher',
         choices=['none', 'pytorch', 'slurm', 'mpi'],
@@ -127,6 +134,35 @@ def parse_args():
     return args
 
 
+def single_gpu_test_online(model, data_loader, eval_kwargs):
+    """Test with single gpu and feed every batch to an online evaluator.
+
+    Unlike ``single_gpu_test`` the outputs are not kept, the matching
+    statistics of each batch are computed while the dataloader workers
+    prepare the next batches, and only the AP is finalized at the end.
+
+    Returns:
+        dict: Evaluation results.
+    """
+    model.eval()
+    dataset = data_loader.dataset
+    evaluator = dataset.build_online_evaluator(**eval_kwargs)
+    prog_bar = mmcv.ProgressBar(len(dataset))
+    frame_idx = 0
+    for data in data_loader:
+        with torch.no_grad():
+            results = model(return_loss=False, rescale=True, **data)
+        batch_size = len(results)
+        dataset.update_online_evaluator(
+            evaluator, range(frame_idx, frame_idx + batch_size), results)
+        frame_idx += batch_size
+        for _ in range(batch_size):
+            prog_bar.update()
+    ap_result_str, ap_dict = evaluator.evaluate()
+    print('\n' + ap_result_str)
+    return ap_dict
+
+
 def main():
     args = parse_args()
 
@@ -139,6 +175,11 @@ def main():
     if args.eval and args.format_only:
         raise ValueError('--eval and --format_only cannot be both specified')
 
+    if args.online_eval and (not args.eval or args.out or args.format_only
+                             or args.show or args.launcher != 'none'):
+        raise ValueError('--online-eval only works with --eval in single gpu '
+                         'testing, and the outputs are not kept')
+
     if args.out is not None and not args.out.endswith(('.pkl', '.pickle')):
         raise ValueError('The output file must be a pkl file.')
 
@@ -199,6 +240,14 @@ def main():
     if args.seed is not None:
         set_random_seed(args.seed, deterministic=args.deterministic)
 
+    # compile (or load from the on-disk cache) the numba eval kernels ahead
+    # of time, so the evaluation after testing does not pay the jit latency.
+    # only USDDataset uses these kernels, other datasets skip the compile
+    test_cfgs = cfg.data.test if isinstance(cfg.data.test,
+                                            list) else [cfg.data.test]
+    if args.eval and any(ds_cfg.type == 'USDDataset' for ds_cfg in test_cfgs):
+        usd_eval_warmup()
+
     # build the dataloader
     dataset = build_dataset(cfg.data.test)
     data_loader = build_dataloader(dataset, **test_loader_cfg)
@@ -225,6 +274,19 @@ def main():
         # segmentation dataset has `PALETTE` attribute
         model.PALETTE = dataset.PALETTE
 
+    if args.online_eval:
+        eval_kwargs = cfg.get('evaluation', {}).copy()
+        for key in [
+                'interval', 'tmpdir', 'start', 'gpu_collect', 'save_best',
+                'rule'
+        ]:
+            eval_kwargs.pop(key, None)
+        kwargs = {} if args.eval_options is None else args.eval_options
+        eval_kwargs.update(dict(metric=args.eval, **kwargs))
+        model = MMDataParallel(model, device_ids=cfg.gpu_ids)
+        print(single_gpu_test_online(model, data_loader, eval_kwargs))
+        return
+
     if not distributed:
         model = MMDataParallel(model, device_ids=cfg.gpu_ids)
         outputs = single_gpu_test(model, data_loader, args.show, args.show_dir)